@@ -0,0 +1,91 @@
+"""\
+memory cost of idle actors
+
+creates N actors, lets them settle (suspendable actors load an empty state)
+and reports the traced python memory per actor, with a consume task per
+actor and on a dispatcher.
+
+    $ python -m benchmarks.actor_memory
+    $ python -m benchmarks.actor_memory 10000 100000
+
+"""
+import asyncio
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+
+from untamed import World, Actor, SuspendableActor
+
+COUNTS = (10_000, 100_000, 1_000_000)
+
+
+class EmptyPersistence(Actor):
+    """\
+    replies an empty state to every LOAD_STATE and drops everything else
+    """
+
+    __slots__ = ()
+
+    async def on_message(self, msg, sender):
+        if msg["cmd"] == "LOAD_STATE":
+            await self.world.actors[sender].tell({"cmd": "LOADED_STATE", "data": {}})
+
+
+async def settle(world):
+    # wait until every mailbox is drained
+    while any(not actor.queue.empty() for actor in world.actors.values()):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+
+
+async def measure(klass, n, dispatcher):
+    world = World()
+    if dispatcher:
+        world.use_dispatcher()
+    world.create_actor("persistence", EmptyPersistence)
+    await settle(world)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    t1 = time.time()
+    for x in range(n):
+        world.create_actor(f"worker_{x}", klass)
+    elapsed = time.time() - t1
+    await settle(world)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    await world.destroy()
+    if world.dispatcher:
+        world.dispatcher.stop()
+    return {
+        "actor": klass.__name__,
+        "dispatcher": dispatcher,
+        "actors": n,
+        "bytes_per_actor": round(used / n),
+        "create_seconds": round(elapsed, 3),
+    }
+
+
+def main(counts):
+    logging.disable(logging.CRITICAL)
+    results = []
+    for klass in (Actor, SuspendableActor):
+        for dispatcher in (False, True):
+            for n in counts:
+                result = asyncio.run(measure(klass, n, dispatcher))
+                print(
+                    "{actor:<18} dispatcher={dispatcher!s:<5} {actors:>9} actors "
+                    "{bytes_per_actor:>6} bytes/actor "
+                    "created in {create_seconds}s".format(**result)
+                )
+                results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or COUNTS)
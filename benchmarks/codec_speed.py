@@ -0,0 +1,77 @@
+"""\
+encode/decode cost of the codecs on typical actor states
+
+    $ python -m benchmarks.codec_speed
+    $ python -m benchmarks.codec_speed 20000
+
+"""
+import sys
+import time
+
+from untamed import codec
+
+STATES = {
+    # what SuspendableActor keeps for a plain actor
+    "counter": {"recv": 1234, "t": 1581001234.123456},
+    "profile": {
+        "recv": 52,
+        "name": "some user",
+        "email": "user@example.com",
+        "tags": ["a", "b", "c", "d"],
+        "settings": {"theme": "dark", "lang": "en", "notifications": True},
+        "friends": list(range(100)),
+    },
+    "events": {
+        "recv": 1000,
+        "events": [
+            {"at": 1581001234.0 + i, "kind": "click", "target": f"button-{i % 20}"}
+            for i in range(1000)
+        ],
+    },
+    # TaskScheduler keeps schedules keyed by their id
+    "schedules": {
+        i: {"at": 1581001234.0 + i, "actor": f"worker_{i}", "msg": {"cmd": "tick"}}
+        for i in range(500)
+    },
+}
+
+SERIALIZERS = [("pickle", None), ("json", None), ("msgpack", None), ("msgpack", 1024)]
+
+
+def bench(serializer, state, n):
+    data = serializer.dumps(state)
+    t1 = time.perf_counter()
+    for _ in range(n):
+        serializer.dumps(state)
+    t2 = time.perf_counter()
+    for _ in range(n):
+        codec.loads(data)
+    t3 = time.perf_counter()
+    return {
+        "size": len(data),
+        "encode_us": round((t2 - t1) / n * 1e6, 2),
+        "decode_us": round((t3 - t2) / n * 1e6, 2),
+    }
+
+
+def main(n):
+    results = []
+    for state_name, state in STATES.items():
+        for codec_name, compress_over in SERIALIZERS:
+            if codec_name not in codec.CODECS:
+                continue
+            serializer = codec.Serializer(codec_name, compress_over)
+            label = codec_name if compress_over is None else f"{codec_name}+zlib"
+            # large states are slow, keep the run short
+            runs = max(n // (len(serializer.dumps(state)) // 1000 + 1), 10)
+            result = dict(state=state_name, codec=label, **bench(serializer, state, runs))
+            print(
+                "{state:<10} {codec:<13} {size:>7} bytes "
+                "encode {encode_us:>9} us  decode {decode_us:>9} us".format(**result)
+            )
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
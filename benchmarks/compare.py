@@ -0,0 +1,62 @@
+"""\
+compare two results of benchmarks.runtime
+
+prints the change of every number and exits with 1 when one got worse by
+more than the threshold, rates are better higher, everything else lower.
+
+    $ python -m benchmarks.compare old.json new.json
+    $ python -m benchmarks.compare old.json new.json --threshold 0.2
+
+"""
+import json
+import sys
+
+import click
+
+
+def higher_is_better(key):
+    return key.endswith("_per_second")
+
+
+def compared(key):
+    return higher_is_better(key) or key.endswith(("_seconds", "_us", "bytes_per_actor")) or key == "seconds"
+
+
+def compare(old, new, threshold):
+    """\
+    :return: [(benchmark, key, old value, new value, change, regressed)]
+    """
+    rows = []
+    for benchmark, results in new["results"].items():
+        before = old["results"].get(benchmark, {})
+        for key, value in results.items():
+            if not compared(key) or key not in before or not before[key]:
+                continue
+            change = (value - before[key]) / before[key]
+            worse = -change if higher_is_better(key) else change
+            rows.append((benchmark, key, before[key], value, change, worse > threshold))
+    return rows
+
+
+@click.command()
+@click.argument("old_path")
+@click.argument("new_path")
+@click.option("--threshold", default=0.1, help="fraction a number may get worse by")
+def main(old_path, new_path, threshold):
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+    if old["meta"].get("sizes") != new["meta"].get("sizes"):
+        print("warning: the results were run with different sizes")
+
+    rows = compare(old, new, threshold)
+    for benchmark, key, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{benchmark:<16} {key:<34} {before:>12} {after:>12} {change:>+8.1%}{flag}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""\
+runtime benchmarks with results as json, to compare releases
+
+every benchmark runs in a new world on a new event loop and reports rates
+(*_per_second, higher is better), durations (*_seconds), latencies (*_us)
+and sizes (*bytes*), lower is better. progress goes to stderr and the json
+document to stdout or --output.
+
+    $ python -m benchmarks.runtime --output results.json
+    $ python -m benchmarks.runtime --quick tell_throughput ping_pong
+    $ python -m benchmarks.compare old.json results.json
+
+"""
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from untamed import World, Actor, SuspendableActor
+from untamed.metrics import Histogram
+
+from .actor_memory import measure as measure_memory
+
+SIZES = {
+    "full": {
+        "actors": 100_000,
+        "memory_actors": 100_000,
+        "messages": 1_000_000,
+        "senders": 100,
+        "receivers": 1000,
+        "round_trips": 100_000,
+        "asks": 50_000,
+        "suspended": 20_000,
+        "shutdown_actors": 100_000,
+    },
+    "quick": {
+        "actors": 10_000,
+        "memory_actors": 10_000,
+        "messages": 100_000,
+        "senders": 10,
+        "receivers": 100,
+        "round_trips": 10_000,
+        "asks": 5_000,
+        "suspended": 2_000,
+        "shutdown_actors": 10_000,
+    },
+}
+
+MESSAGE = {"cmd": "inc"}
+
+
+class Countdown:
+    """\
+    resolves `done` after `count` ticks
+    """
+
+    def __init__(self, count):
+        self.remaining = count
+        self.done = asyncio.get_running_loop().create_future()
+
+    def tick(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set_result(None)
+
+
+class Sink(Actor):
+    async def on_message(self, msg, sender):
+        self.world.countdown.tick()
+
+
+class Echo(Actor):
+    async def on_message(self, msg, sender):
+        if "msg_id" in msg:
+            await self.world.tell(sender, {"reply_to": msg["msg_id"]})
+        else:
+            await self.world.tell(sender, msg, self.name)
+
+
+class Pinger(Actor):
+    async def on_message(self, msg, sender):
+        world = self.world
+        world.latency.record(time.perf_counter() - msg["at"])
+        world.countdown.tick()
+        if world.countdown.remaining:
+            await world.tell(sender, {"at": time.perf_counter()}, self.name)
+
+
+class Stateful(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+        if msg.get("cmd") == "set":
+            await self.set_state(msg["data"])
+
+    async def state_loaded(self):
+        self.world.countdown.tick()
+
+
+def latency_fields(histogram):
+    summary = histogram.summary()
+    return {
+        f"{key}_us" if key != "count" else key: (
+            value if key == "count" else round(value * 1_000_000, 1)
+        )
+        for key, value in summary.items()
+    }
+
+
+async def creation(sizes):
+    world = World()
+    n = sizes["actors"]
+    started = time.perf_counter()
+    for i in range(n):
+        world.create_actor(f"sink-{i}", Sink)
+    elapsed = time.perf_counter() - started
+    await world.stop()
+    return {"actors": n, "seconds": round(elapsed, 3), "actors_per_second": round(n / elapsed)}
+
+
+async def memory(sizes):
+    results = {}
+    for klass in (Actor, SuspendableActor):
+        result = await measure_memory(klass, sizes["memory_actors"], False)
+        results[f"{klass.__name__}_bytes_per_actor"] = result["bytes_per_actor"]
+    return {"actors": sizes["memory_actors"], **results}
+
+
+async def tell_throughput(sizes):
+    results = {}
+    for pattern, senders, receivers in (
+        ("one_to_one", 1, 1),
+        ("many_to_one", sizes["senders"], 1),
+        ("one_to_many", 1, sizes["receivers"]),
+    ):
+        world = World()
+        names = [f"sink-{i}" for i in range(receivers)]
+        for name in names:
+            world.create_actor(name, Sink)
+        per_sender = sizes["messages"] // senders
+        world.countdown = Countdown(per_sender * senders)
+
+        async def send(offset):
+            tell = world.tell
+            for i in range(per_sender):
+                await tell(names[(offset + i) % receivers], MESSAGE)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(offset) for offset in range(senders)))
+        await world.countdown.done
+        elapsed = time.perf_counter() - started
+        await world.stop()
+        results[f"{pattern}_messages_per_second"] = round(per_sender * senders / elapsed)
+    return {"messages": sizes["messages"], **results}
+
+
+async def ping_pong(sizes):
+    world = World()
+    world.create_actor("pinger", Pinger)
+    world.create_actor("ponger", Echo)
+    world.latency = Histogram()
+    world.countdown = Countdown(sizes["round_trips"])
+    started = time.perf_counter()
+    await world.tell("ponger", {"at": time.perf_counter()}, "pinger")
+    await world.countdown.done
+    elapsed = time.perf_counter() - started
+    await world.stop()
+    return {
+        "round_trips_per_second": round(sizes["round_trips"] / elapsed),
+        **latency_fields(world.latency),
+    }
+
+
+async def ask_round_trip(sizes):
+    world = World()
+    world.create_actor("echo", Echo)
+    latency = Histogram()
+    started = time.perf_counter()
+    for _ in range(sizes["asks"]):
+        asked = time.perf_counter()
+        await world.tell_and_get("echo", {"cmd": "ask"})
+        latency.record(time.perf_counter() - asked)
+    elapsed = time.perf_counter() - started
+    await world.stop()
+    return {"asks_per_second": round(sizes["asks"] / elapsed), **latency_fields(latency)}
+
+
+async def suspend_revive(sizes):
+    n = sizes["suspended"]
+    names = [f"stateful-{i}" for i in range(n)]
+    with tempfile.TemporaryDirectory() as data_dir:
+        world = World()
+        await world.basic_config(data_dir=data_dir)
+        world.countdown = Countdown(n)
+        for name in names:
+            world.create_actor(name, Stateful)
+        await world.countdown.done
+        for i, name in enumerate(names):
+            await world.tell(name, {"cmd": "set", "data": {"n": i, "name": name}})
+
+        started = time.perf_counter()
+        for name in names:
+            await world.suspend_actor(name)
+        await asyncio.gather(*world.passivating.values())
+        suspended = time.perf_counter() - started
+
+        world.countdown = Countdown(n)
+        started = time.perf_counter()
+        for name in names:
+            world.create_actor(name, Stateful)
+        await world.countdown.done
+        revived = time.perf_counter() - started
+        await world.stop()
+    return {
+        "actors": n,
+        "suspend_per_second": round(n / suspended),
+        "revive_per_second": round(n / revived),
+    }
+
+
+async def shutdown(sizes):
+    n = sizes["shutdown_actors"]
+    world = World()
+    for i in range(n):
+        world.create_actor(f"sink-{i}", Sink)
+    # let every actor start
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    late = await world.stop()
+    elapsed = time.perf_counter() - started
+    return {"actors": n, "seconds": round(elapsed, 3), "late": len(late)}
+
+
+BENCHMARKS = {
+    "creation": creation,
+    "memory": memory,
+    "tell_throughput": tell_throughput,
+    "ping_pong": ping_pong,
+    "ask_round_trip": ask_round_trip,
+    "suspend_revive": suspend_revive,
+    "shutdown": shutdown,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(names, size, use_uvloop=False):
+    logging.disable(logging.CRITICAL)
+    if use_uvloop:
+        import uvloop
+        uvloop.install()
+    meta = {
+        "size": size,
+        "sizes": SIZES[size],
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "loop": "uvloop" if use_uvloop else "asyncio",
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    results = {}
+    for name in names:
+        gc.collect()
+        results[name] = asyncio.run(BENCHMARKS[name](SIZES[size]))
+        print(f"{name:<16} {json.dumps(results[name])}", file=sys.stderr)
+    return {"meta": meta, "results": results}
+
+
+@click.command()
+@click.argument("names", nargs=-1, type=click.Choice(list(BENCHMARKS)))
+@click.option("--quick", is_flag=True, help="a tenth of the full sizes")
+@click.option("--uvloop", "use_uvloop", is_flag=True, help="run on uvloop")
+@click.option("--output", default=None, help="write the json here instead of stdout")
+def main(names, quick, use_uvloop, output):
+    report = run(names or list(BENCHMARKS), "quick" if quick else "full", use_uvloop)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from sanic import Sanic
 from sanic.response import json
 from websockets.exceptions import ConnectionClosed, ConnectionClosedError
 
-from untamed import SuspendableActor, Actor
+from untamed import SuspendableActor, Actor, MailboxFull, AskTimeout, add_sanic_route
 
 
 class WebListenerActor(Actor):
@@ -22,6 +22,8 @@ class WebListenerActor(Actor):
 
 
 class SomeActor(SuspendableActor):
+    mailbox_size = 1000
+
     async def on_message(self, msg, sender):
         await super().on_message(msg, sender)
 
@@ -42,8 +44,14 @@ async def test(request):
     world = request.ctx.world
     t = time.time()
 
-    await world.tell("some-actor", {"cmd": "set_foo", "data": {"t": t}})
-    result = await world.tell_and_get("some-actor", {"cmd": "get_foo"})
+    try:
+        world.tell_nowait("some-actor", {"cmd": "set_foo", "data": {"t": t}})
+    except MailboxFull:
+        return json({"error": "busy"}, status=503)
+    try:
+        result = await world.tell_and_get("some-actor", {"cmd": "get_foo"}, timeout=5)
+    except AskTimeout:
+        return json({"error": "timeout"}, status=504)
 
     return json({"actors": world.actors.keys(), "reply": result})
 
@@ -89,6 +97,8 @@ def web_server(app, *args, **kw):
 
 async def main(world):
     await world.basic_config()
+    world.enable_metrics()
+    add_sanic_route(app, world)
 
     @app.middleware("request")
     async def add_world(request):
@@ -8,7 +8,7 @@ class Ponger(Actor):
     async def on_message(self, msg, sender):
         await asyncio.sleep(1)
         print("pong")
-        await self.world.tell(sender, 'ping', self.name)
+        self.world.tell_nowait(sender, 'ping', self.name)
 
 
 class Pinger(Actor):
@@ -16,7 +16,7 @@ class Pinger(Actor):
         # print("msg received", msg, sender)
         await asyncio.sleep(1)
         print("ping")
-        await self.world.tell(sender, 'pong', self.name)
+        self.world.tell_nowait(sender, 'pong', self.name)
 
 
 async def run(world: World):
@@ -18,5 +18,10 @@ setup(
     install_requires=requirements,
     python_requires=">3.7.2",
     test_require=["psutil>=5.2.2"],
-    entry_points={"console_scripts": ["untamed-world = untamed.subsystem:run_world"]},
+    entry_points={
+        "console_scripts": [
+            "untamed-world = untamed.subsystem:run_world",
+            "untamed-bench = untamed.bench:run_bench",
+        ]
+    },
 )
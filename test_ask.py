@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import World, Actor, AskTimeout
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if msg.get('sleep'):
+            await asyncio.sleep(msg['sleep'])
+        if not msg.get('silent'):
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': msg['data']})
+
+
+@pytest.mark.asyncio
+async def test_reply_resolves_directly():
+    world = World()
+    world.create_actor('echo', EchoActor)
+    replies = await asyncio.gather(*[
+        world.tell_and_get('echo', {'data': i}) for i in range(100)
+    ])
+    assert [reply['data'] for reply in replies] == list(range(100))
+    # nothing went through the world actor
+    assert world.self_actor.queue.empty()
+    assert world.wait_reply_list == {}
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_timeout_cleans_up():
+    world = World()
+    world.set_ask_timeout(0.05)
+    world.create_actor('echo', EchoActor)
+    with pytest.raises(AskTimeout):
+        await world.tell_and_get('echo', {'data': 1, 'silent': True})
+    with pytest.raises(asyncio.TimeoutError):
+        await world.tell_and_get('echo', {'data': 1, 'sleep': 0.2}, timeout=0.01)
+    assert world.wait_reply_list == {}
+
+    # the late reply is dropped
+    await asyncio.sleep(0.25)
+    reply = await world.tell_and_get('echo', {'data': 2}, timeout=1)
+    assert reply['data'] == 2
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_abandoned_ask_is_cleaned_up():
+    world = World()
+    world.create_actor('echo', EchoActor)
+    task = asyncio.ensure_future(world.tell_and_get('echo', {'data': 1, 'sleep': 0.1}))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.15)
+    assert world.wait_reply_list == {}
+    await world.stop()
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from untamed.bench import open_loop
+from untamed.subsystem import World, Actor
+
+
+class SlowActor(Actor):
+    async def on_message(self, msg, sender):
+        await asyncio.sleep(0.02)
+        await self.world.tell(sender, {'reply_to': msg['msg_id']})
+
+
+async def make_nodes():
+    target = World()
+    await target.listen('target', port=0)
+    target.create_actor('slow', SlowActor)
+    client = World()
+    await client.listen('client', port=0)
+    client.add_node('target', *target.transport.address)
+    return target, client
+
+
+@pytest.mark.asyncio
+async def test_open_loop():
+    target, client = await make_nodes()
+    result = await open_loop(client, 'target/world', {'cmd': 'PING'}, rate=500, duration=0.4, concurrency=10)
+    assert result['sent'] == result['completed'] == 200
+    assert result['latency_ms']['count'] == 200
+    assert result['latency_ms']['p50'] >= result['service_time_ms']['p50']
+    await client.stop()
+    await target.stop()
+
+
+@pytest.mark.asyncio
+async def test_latency_counts_queueing():
+    target, client = await make_nodes()
+    # 20ms per request one at a time at 100 requests a second, requests
+    # fall behind their schedule
+    result = await open_loop(client, 'target/slow', {}, rate=100, duration=0.5, concurrency=1)
+    assert result['completed'] == 50
+    assert result['service_time_ms']['p99'] < 60
+    assert result['latency_ms']['p99'] > 300
+    await client.stop()
+    await target.stop()
+
+
+@pytest.mark.asyncio
+async def test_timeouts_count_in_latency():
+    target, client = await make_nodes()
+    # every request times out after 10ms
+    result = await open_loop(client, 'target/slow', {}, rate=100, duration=0.2, concurrency=20, timeout=0.01)
+    assert result['timeouts'] == result['sent'] == 20
+    assert result['service_time_ms']['count'] == 0
+    assert result['latency_ms']['count'] == 20
+    assert result['latency_ms']['p50'] >= 10
+    await client.stop()
+    await target.stop()
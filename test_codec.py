@@ -0,0 +1,62 @@
+import pickle
+
+import aioredis
+import pytest
+
+from untamed import codec
+from untamed.subsystem import World, SuspendableActor, RedisPersistence
+
+
+@pytest.mark.parametrize('name', sorted(codec.CODECS))
+def test_round_trip(name):
+    serializer = codec.Serializer(name)
+    state = {'recv': 3, 'name': 'foo', 'items': [1, 2.5, None, True]}
+    assert codec.loads(serializer.dumps(state)) == state
+
+
+def test_compress_over_threshold():
+    serializer = codec.Serializer('json', compress_over=100)
+    small = {'a': 1}
+    large = {'a': 'x' * 1000}
+    assert serializer.dumps(small)[:1] == b'J'
+    assert serializer.dumps(large)[:1] == b'Z'
+    assert len(serializer.dumps(large)) < 100
+    assert codec.loads(serializer.dumps(large)) == large
+
+
+def test_falls_back_to_pickle():
+    serializer = codec.Serializer('json')
+    state = {'seen': {1, 2, 3}}
+    assert codec.loads(serializer.dumps(state)) == state
+
+
+def test_reads_plain_pickle():
+    assert codec.loads(pickle.dumps({'recv': 1})) == {'recv': 1}
+
+
+class JSONActor(SuspendableActor):
+    codec = 'json'
+
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+        if msg.get('cmd', None) == 'get_foo':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state})
+
+
+@pytest.mark.asyncio
+async def test_codec_per_world_and_class():
+    world = World()
+    world.set_codec('msgpack' if 'msgpack' in codec.CODECS else 'json')
+    persistence = world.create_actor('persistence', RedisPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': 'redis://localhost:6379/12'})
+    world.create_actor('json-actor', JSONActor)
+    world.create_actor('plain-actor', SuspendableActor)
+    await world.tell('plain-actor', {'cmd': 'foo'})
+    await world.tell_and_get('json-actor', {'cmd': 'get_foo'})
+    await world.stop()
+
+    redis = await aioredis.create_redis_pool('redis://localhost:6379/12')
+    assert (await redis.get('state::json-actor'))[:1] == b'J'
+    assert (await redis.get('state::plain-actor'))[:1] == codec.get_codec(world.codec).tag
+    redis.close()
+    await redis.wait_closed()
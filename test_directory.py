@@ -0,0 +1,119 @@
+import asyncio
+
+import aioredis
+import pytest
+
+from untamed.directory import LocalDirectory, LRUCache, RedisDirectory
+from untamed.subsystem import World, Actor, ActorNotFound
+
+REDIS_URL = 'redis://localhost:6379/12'
+PREFIX = 'test-directory'
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.world.transport.node})
+
+
+class Counter(Actor):
+    async def on_message(self, msg, sender):
+        self.world.received.append(msg['i'])
+
+
+async def make_nodes(directories):
+    worlds = []
+    for i, directory in enumerate(directories):
+        world = World()
+        world.received = []
+        # nodes find each other in the directory
+        await world.listen(f'node-{i}', port=0)
+        await world.use_directory(directory)
+        worlds.append(world)
+    return worlds
+
+
+async def wait_for(condition, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_actors():
+    world = World()
+    with pytest.raises(ActorNotFound):
+        await world.tell('nobody', {})
+    with pytest.raises(ActorNotFound):
+        world.tell_nowait('nobody', {})
+    with pytest.raises(ActorNotFound):
+        await world.tell_and_get('nobody', {})
+    assert not world.wait_reply_list
+    await world.stop()
+
+
+async def check_directory(worlds):
+    a, b, c = worlds
+    a.create_actor('echo', EchoActor)
+    await a.directory.flush()
+
+    assert (await b.tell_and_get('echo', {}))['data'] == 'node-0'
+    assert b.directory.cached('echo') == 'node-0'
+    assert (await c.tell_and_get('echo', {}))['data'] == 'node-0'
+
+    # moved to another node, the caches drop it
+    await a.stop_actor('echo')
+    await a.directory.flush()
+    await wait_for(lambda: b.directory.cached('echo') is None)
+    c.create_actor('echo', EchoActor)
+    await c.directory.flush()
+    assert (await b.tell_and_get('echo', {}))['data'] == 'node-2'
+    assert (await a.tell_and_get('echo', {}))['data'] == 'node-2'
+
+    with pytest.raises(ActorNotFound):
+        await b.tell_and_get('nobody', {})
+
+    # told without waiting for the lookup, in order and with one lookup
+    c.create_actor('counter', Counter)
+    await c.directory.flush()
+    for i in range(100):
+        assert b.tell_nowait('counter', {'i': i})
+    assert list(b.lookup_backlog) == ['counter']
+    await wait_for(lambda: len(c.received) == 100)
+    assert c.received == list(range(100))
+    # an unknown name is logged, not raised in a task nobody awaits
+    b.tell_nowait('nobody', {'i': 0})
+    await wait_for(lambda: not b.lookup_backlog)
+
+    for world in worlds:
+        await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_local_directory():
+    first = LocalDirectory()
+    await check_directory(await make_nodes([first, LocalDirectory(first), LocalDirectory(first)]))
+    assert not first.entries
+
+
+@pytest.mark.asyncio
+async def test_redis_directory():
+    redis = await aioredis.create_redis_pool(REDIS_URL)
+    await redis.delete(PREFIX, f'{PREFIX}:nodes')
+    await check_directory(await make_nodes([RedisDirectory(REDIS_URL, PREFIX) for _ in range(3)]))
+    assert not await redis.hgetall(PREFIX)
+    redis.close()
+    await redis.wait_closed()
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import World, Actor
+
+
+class Recorder(Actor):
+    async def on_message(self, msg, sender):
+        self.world.handled.append((self.name, msg))
+
+
+class BadStop(Recorder):
+    async def on_stop(self):
+        raise RuntimeError("on_stop failed")
+
+
+@pytest.mark.asyncio
+async def test_idle_actors_have_no_tasks():
+    world = World()
+    world.handled = []
+    world.use_dispatcher(workers=4)
+    tasks_before = len(asyncio.all_tasks())
+    for i in range(1000):
+        world.create_actor(f'recorder-{i}', Recorder)
+    assert len(asyncio.all_tasks()) == tasks_before
+
+    for i in range(1000):
+        await world.tell(f'recorder-{i}', i)
+    await asyncio.sleep(0.1)
+    assert sorted(msg for _, msg in world.handled) == list(range(1000))
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_throughput_quantum():
+    world = World()
+    world.handled = []
+    world.use_dispatcher(workers=1, throughput=5)
+    world.create_actor('busy', Recorder)
+    world.create_actor('quiet', Recorder)
+
+    for i in range(20):
+        await world.tell('busy', i)
+    await world.tell('quiet', 'hello')
+    await asyncio.sleep(0.1)
+
+    names = [name for name, _ in world.handled]
+    assert names.index('quiet') == 5
+    assert [msg for name, msg in world.handled if name == 'busy'] == list(range(20))
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_workers_survive_actor_errors():
+    world = World()
+    world.handled = []
+    world.use_dispatcher(workers=2)
+    for name in ('bad-0', 'bad-1'):
+        world.create_actor(name, BadStop)
+    assert await world.stop_actor('bad-0', timeout=1)
+    await world.remove_actor('bad-1')
+    await asyncio.sleep(0.01)
+    assert not any(task.done() for task in world.dispatcher.tasks)
+    assert 'bad-0' not in world.actors
+
+    for i in range(10):
+        world.create_actor(f'recorder-{i}', Recorder)
+        await world.tell(f'recorder-{i}', i)
+    await asyncio.sleep(0.05)
+    assert sorted(msg for _, msg in world.handled) == list(range(10))
+    await world.stop()
@@ -0,0 +1,74 @@
+import aioredis
+import pytest
+
+from untamed.subsystem import World, EventSourcedActor, RedisPersistence
+
+
+class Counter(EventSourcedActor):
+    snapshot_every = 3
+
+    def apply_event(self, event):
+        self.state['n'] = self.state.get('n', 0) + event['add']
+        self.state.setdefault('log', []).append(event['add'])
+
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'add':
+            await self.emit({'add': msg['data']})
+
+        if msg.get('cmd', None) == 'get':
+            await self.world.tell(
+                sender, {'reply_to': msg['msg_id'], 'data': (self.state, self.seq)}
+            )
+
+
+async def add_and_revive(world):
+    world.create_actor('counter', Counter)
+    for i in range(1, 8):
+        await world.tell('counter', {'cmd': 'add', 'data': i})
+
+    await world.suspend_actor('counter')
+    await world.revive_actor('counter', Counter)
+    state, seq = (await world.tell_and_get('counter', {'cmd': 'get'}))['data']
+    assert state['n'] == 28
+    assert state['log'] == [1, 2, 3, 4, 5, 6, 7]
+    assert seq == 7
+
+
+@pytest.mark.asyncio
+async def test_replays_tail_after_snapshot(tmp_path):
+    world = World()
+    await world.basic_config(data_dir=str(tmp_path))
+    await add_and_revive(world)
+
+    store = world.get_actor('persistence').store
+    # 7 events with a snapshot every 3, only the last one is in the journal
+    assert len(store.hgetall(b'journal::counter')) == 1
+    assert store.hgetall(b'snapshot::counter')
+    await world.stop()
+
+    world = World()
+    await world.basic_config(data_dir=str(tmp_path))
+    world.create_actor('counter', Counter)
+    await world.tell('counter', {'cmd': 'add', 'data': 10})
+    state, seq = (await world.tell_and_get('counter', {'cmd': 'get'}))['data']
+    assert state['n'] == 38
+    assert seq == 8
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_redis_journal():
+    redis = await aioredis.create_redis_pool('redis://localhost:6379/12')
+    await redis.delete('journal::counter', 'snapshot::counter')
+
+    world = World()
+    persistence = world.create_actor('persistence', RedisPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': 'redis://localhost:6379/12'})
+    await add_and_revive(world)
+    assert await redis.llen('journal::counter') == 1
+    await world.stop()
+
+    redis.close()
+    await redis.wait_closed()
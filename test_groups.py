@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from untamed.sharding import Shard, shard_sockets
+from untamed.subsystem import World, Actor
+
+
+class Member(Actor):
+    async def on_message(self, msg, sender):
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id']})
+            return
+        self.world.received.append((self.name, msg['n'], sender))
+
+
+class SlowMember(Member):
+    async def on_message(self, msg, sender):
+        await asyncio.sleep(0.01)
+        await super().on_message(msg, sender)
+
+
+async def wait_for(condition, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_publish_to_local_members():
+    world = World()
+    world.received = []
+    names = [f'member-{i}' for i in range(100)]
+    for name in names:
+        world.create_actor(name, Member)
+    world.subscribe('room', *names)
+    world.subscribe('room', 'slow', 'later')
+    world.create_actor('slow', SlowMember, mailbox_size=1)
+
+    # one pass over the members, the full mailbox is waited for after it
+    assert await world.publish('room', {'n': 1}, 'sender') == 101
+    assert await world.publish('room', {'n': 2}) == 101
+    await wait_for(lambda: len(world.received) == 202)
+    assert sorted(world.received)[:2] == [('member-0', 1, 'sender'), ('member-0', 2, None)]
+    assert [n for name, n, _ in world.received if name == 'slow'] == [1, 2]
+
+    # members that aren't running keep their place
+    world.create_actor('later', Member)
+    await world.remove_actor('member-0')
+    assert await world.publish('room', {'n': 3}) == 101
+    await wait_for(lambda: len(world.received) == 303)
+    assert ('later', 3, None) in world.received
+
+    world.unsubscribe('room', *names, 'slow')
+    assert list(world.groups['room'].local) == ['later']
+    world.unsubscribe('room', 'later')
+    assert 'room' not in world.groups and not world.memberships
+    assert await world.publish('room', {'n': 4}) == 0
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_publish_to_other_nodes():
+    worlds = []
+    for node in ('node-a', 'node-b', 'node-c'):
+        world = World()
+        world.received = []
+        await world.listen(node, port=0)
+        for i in range(10):
+            world.create_actor(f'member-{i}', Member)
+        worlds.append(world)
+    a, b, c = worlds
+    for world in (b, c):
+        a.add_node(world.transport.node, *world.transport.address)
+
+    a.subscribe('room', 'member-0', 'node-a/member-1')
+    for node in ('node-b', 'node-c'):
+        a.subscribe('room', *(f'{node}/member-{i}' for i in range(10)))
+    # connects
+    await a.tell_and_get('node-b/member-0', {})
+    await a.tell_and_get('node-c/member-0', {})
+    seqs = {node: a.transport.links[node].seq for node in ('node-b', 'node-c')}
+
+    assert await a.publish('room', {'n': 1}, 'member-0') == 22
+    # one message per node, sent when the batch is flushed
+    await asyncio.sleep(0)
+    for node, seq in seqs.items():
+        assert a.transport.links[node].seq == seq + 1
+    await wait_for(lambda: len(b.received) == 10 and len(c.received) == 10)
+    assert ('member-9', 1, 'node-a/member-0') in b.received
+    await wait_for(lambda: len(a.received) == 2)
+
+    for world in worlds:
+        await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_publish_to_other_shards():
+    sockets = shard_sockets(2)
+    worlds = []
+    for index in range(2):
+        world = World()
+        world.received = []
+        world.shard = Shard(index, 2, sockets[index])
+        await world.shard.start(world)
+        worlds.append(world)
+    names = [f'member-{i}' for i in range(20)]
+    for world in worlds:
+        for name in names:
+            world.create_actor(name, Member)
+
+    worlds[0].subscribe('room', *names)
+    members = worlds[0].groups['room']
+    assert len(members.local) + len(members.shards[1]) == 20
+    assert await worlds[0].publish('room', {'n': 1}) == 20
+    await wait_for(lambda: len(worlds[0].received) + len(worlds[1].received) == 20)
+    assert sorted(name for world in worlds for name, _, _ in world.received) == sorted(names)
+
+    for world in worlds:
+        await world.stop()
@@ -0,0 +1,90 @@
+import pickle
+
+import aioredis
+import pytest
+
+from untamed import codec
+from untamed.subsystem import World, SuspendableActor, RedisPersistence, STATE_HASH
+
+
+class SomeActor(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'set_foo':
+            await self.set_state(msg['data'])
+
+        if msg.get('cmd', None) == 'del_foo':
+            await self.delete_state(*msg['data'])
+
+        if msg.get('cmd', None) == 'get_foo':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state})
+
+
+async def make_world():
+    world = World()
+    persistence = world.create_actor('persistence', RedisPersistence)
+    await persistence.tell(
+        {'cmd': 'connect', 'data': 'redis://localhost:6379/12', 'state_format': STATE_HASH}
+    )
+    return world, persistence
+
+
+@pytest.mark.asyncio
+async def test_saves_only_changed_keys():
+    world, persistence = await make_world()
+    world.create_actor('hash-actor', SomeActor)
+    await world.tell('hash-actor', {'cmd': 'set_foo', 'data': {'a': 1, 'b': [1, 2], 3: 'three'}})
+    await world.tell('hash-actor', {'cmd': 'del_foo', 'data': ['b']})
+    await world.tell_and_get('hash-actor', {'cmd': 'get_foo'})
+
+    # written behind our back, a delta doesn't touch it
+    await persistence.redis.hset('hstate::hash-actor', 'a', pickle.dumps('untouched'))
+    await world.tell('hash-actor', {'cmd': 'set_foo', 'data': {'c': 3}})
+
+    await world.suspend_actor('hash-actor')
+    await world.revive_actor('hash-actor', SomeActor)
+    result = await world.tell_and_get('hash-actor', {'cmd': 'get_foo'})
+    assert result['data']['a'] == 'untouched'
+    assert result['data']['c'] == 3
+    assert result['data'][3] == 'three'
+    assert 'b' not in result['data']
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_migrates_pickled_state():
+    world, persistence = await make_world()
+    redis = await aioredis.create_redis_pool('redis://localhost:6379/12')
+    await redis.delete('hstate::old-actor')
+    await redis.set('state::old-actor', pickle.dumps({'recv': 10, 'x': 'y'}))
+
+    world.create_actor('old-actor', SomeActor)
+    result = await world.tell_and_get('old-actor', {'cmd': 'get_foo'})
+    assert result['data']['x'] == 'y'
+    assert result['data']['recv'] == 11
+
+    await world.stop()
+    assert not await redis.exists('state::old-actor')
+    assert codec.loads(await redis.hget('hstate::old-actor', 'x')) == 'y'
+    redis.close()
+    await redis.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_migrates_keys_in_a_transaction():
+    world, persistence = await make_world()
+    redis = await aioredis.create_redis_pool('redis://localhost:6379/12')
+    await redis.delete('hstate::empty-actor', 'hstate::full-actor')
+    await redis.set('state::empty-actor', pickle.dumps({}))
+    await redis.set('state::full-actor', pickle.dumps({'x': 'y'}))
+
+    assert await persistence.migrate_keys([b'state::empty-actor', b'state::full-actor']) == 2
+    assert not await redis.exists('state::empty-actor', 'state::full-actor')
+    assert not await redis.exists('hstate::empty-actor')
+    assert codec.loads(await redis.hget('hstate::full-actor', 'x')) == 'y'
+
+    await world.stop()
+    redis.close()
+    await redis.wait_closed()
@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from untamed.sharding import Shard
+from untamed.storage import LogStore
+from untamed.subsystem import World, SuspendableActor
+
+
+class SomeActor(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'set_foo':
+            await self.set_state(msg['data'])
+
+        if msg.get('cmd', None) == 'del_foo':
+            await self.delete_state(*msg['data'])
+
+        if msg.get('cmd', None) == 'get_foo':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state})
+
+
+async def make_world(data_dir):
+    world = World()
+    await world.basic_config(data_dir=data_dir)
+    return world
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart(tmp_path):
+    world = await make_world(str(tmp_path))
+    world.create_actor('local-actor', SomeActor)
+    await world.tell('local-actor', {'cmd': 'set_foo', 'data': {'a': 1, 'b': [1, 2], 3: 'three'}})
+    await world.tell('local-actor', {'cmd': 'del_foo', 'data': ['b']})
+
+    await world.suspend_actor('local-actor')
+    await world.revive_actor('local-actor', SomeActor)
+    result = await world.tell_and_get('local-actor', {'cmd': 'get_foo'})
+    assert result['data']['a'] == 1
+    assert result['data'][3] == 'three'
+    assert 'b' not in result['data']
+    await world.stop()
+
+    world = await make_world(str(tmp_path))
+    world.create_actor('local-actor', SomeActor)
+    result = await world.tell_and_get('local-actor', {'cmd': 'get_foo'})
+    assert result['data']['a'] == 1
+    assert 'b' not in result['data']
+    await world.stop()
+
+
+def test_log_compaction(tmp_path):
+    path = str(tmp_path / 'states.log')
+    store = LogStore(path, compact_min_size=0)
+    for i in range(100):
+        store.hset(b'counter', {b'n': str(i).encode(), b'name': b'counter'})
+    store.hset(b'gone', {b'x': b'1'})
+    store.delete(b'gone')
+    store.flush()
+    assert store.needs_compaction()
+
+    size = os.path.getsize(path)
+    store.compact()
+    assert os.path.getsize(path) < size / 10
+    assert store.hgetall(b'counter') == {b'n': b'99', b'name': b'counter'}
+    assert store.hgetall(b'gone') == {}
+    store.close()
+
+    store = LogStore(path)
+    assert store.hgetall(b'counter') == {b'n': b'99', b'name': b'counter'}
+    store.close()
+
+
+def test_torn_write_is_cut_off(tmp_path):
+    path = str(tmp_path / 'states.log')
+    store = LogStore(path)
+    store.hset(b'actor', {b'a': b'1'})
+    store.close()
+    size = os.path.getsize(path)
+
+    store = LogStore(path)
+    store.hset(b'actor', {b'a': b'2'})
+    store.flush()
+    # the process died in the middle of the second record
+    os.truncate(path, size + 10)
+    store.file.close()
+
+    store = LogStore(path)
+    assert store.hgetall(b'actor') == {b'a': b'1'}
+    assert os.path.getsize(path) == size
+    store.hset(b'actor', {b'b': b'3'})
+    store.close()
+
+    store = LogStore(path)
+    assert store.hgetall(b'actor') == {b'a': b'1', b'b': b'3'}
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_data_dir_keeps_its_shard_count(tmp_path):
+    world = await make_world(str(tmp_path))
+    await world.stop()
+    assert (tmp_path / 'shards').read_text() == '1'
+
+    # actors would be looked up in the log of another shard
+    world = World()
+    world.shard = Shard(0, 2, {})
+    with pytest.raises(ValueError):
+        await world.basic_config(data_dir=str(tmp_path))
+    world.shard = None
+    await world.stop()
+
+    # data dirs made before the count was recorded
+    (tmp_path / 'shards').unlink()
+    world = World()
+    world.shard = Shard(1, 2, {})
+    with pytest.raises(ValueError):
+        await world.basic_config(data_dir=str(tmp_path))
+    world.shard = None
+    await world.stop()
+    world = await make_world(str(tmp_path))
+    await world.stop()
+    assert (tmp_path / 'shards').read_text() == '1'
@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import (
+    World,
+    Actor,
+    MailboxFull,
+    RedisSpillStore,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_SPILL,
+)
+
+
+class Recorder(Actor):
+    async def on_message(self, msg, sender):
+        self.world.handled.append(msg)
+
+
+@pytest.mark.asyncio
+async def test_tell_nowait():
+    world = World()
+    world.handled = []
+    world.create_actor('recorder', Recorder)
+    for i in range(500):
+        world.tell_nowait('recorder', i)
+    await asyncio.sleep(0.05)
+    assert world.handled == list(range(500))
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_batch_yields_between_batches():
+    world = World()
+    world.handled = []
+    world.create_actor('first', Recorder).batch_size = 10
+    world.create_actor('second', Recorder)
+    for i in range(30):
+        world.tell_nowait('first', i)
+    world.tell_nowait('second', 'second')
+    await asyncio.sleep(0.05)
+
+    assert world.handled.index('second') < 30
+    assert [msg for msg in world.handled if msg != 'second'] == list(range(30))
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_bounded_mailbox_blocks():
+    world = World()
+    world.handled = []
+    world.create_actor('recorder', Recorder, mailbox_size=2)
+    assert world.tell_nowait('recorder', 1)
+    assert world.tell_nowait('recorder', 2)
+    with pytest.raises(MailboxFull):
+        world.tell_nowait('recorder', 3)
+
+    # tell waits for room
+    await world.tell('recorder', 3)
+    await asyncio.sleep(0.05)
+    assert world.handled == [1, 2, 3]
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_drop_policies():
+    world = World()
+    world.handled = []
+    newest = world.create_actor('newest', Recorder, mailbox_size=2, overflow=OVERFLOW_DROP_NEWEST)
+    oldest = world.create_actor('oldest', Recorder, mailbox_size=2, overflow=OVERFLOW_DROP_OLDEST)
+    assert [world.tell_nowait('newest', ('newest', i)) for i in range(4)] == [True, True, False, False]
+    for i in range(4):
+        await world.tell('oldest', ('oldest', i))
+    assert newest.queue.dropped == 2
+    assert oldest.queue.dropped == 2
+    await asyncio.sleep(0.05)
+    assert world.handled == [('newest', 0), ('newest', 1), ('oldest', 2), ('oldest', 3)]
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_control_items():
+    world = World()
+    world.handled = []
+    actor = world.create_actor('oldest', Recorder, mailbox_size=2, overflow=OVERFLOW_DROP_OLDEST)
+    # queued before the actor runs
+    world.tell_nowait('oldest', 0)
+    stopped = world.stop_actors(['oldest'], drain=False)
+    for i in range(1, 4):
+        world.tell_nowait('oldest', i)
+    assert actor.queue.dropped == 3
+    await asyncio.wait_for(stopped[0], 1)
+    assert 'oldest' not in world.actors
+
+    await world.stop()
+
+
+class SlowRecorder(Actor):
+    async def on_message(self, msg, sender):
+        await asyncio.sleep(0.001)
+        self.world.handled.append(msg)
+
+
+@pytest.mark.asyncio
+async def test_spill_to_redis():
+    world = World()
+    world.handled = []
+    world.spill_store = RedisSpillStore('redis://localhost:6379/12')
+    actor = world.create_actor('spilling', SlowRecorder, mailbox_size=10, overflow=OVERFLOW_SPILL)
+    for i in range(200):
+        world.tell_nowait('spilling', i)
+    assert actor.queue.qsize() == 10
+
+    for _ in range(100):
+        if len(world.handled) == 200:
+            break
+        await asyncio.sleep(0.05)
+    assert world.handled == list(range(200))
+
+    await world.stop()
+
+
+class FlakySpillStore:
+    def __init__(self):
+        self.values = []
+        self.failures = 1
+
+    async def push(self, key, values):
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('store is down')
+        self.values += values
+
+    async def pop(self, key, count):
+        values, self.values = self.values[:count], self.values[count:]
+        return values
+
+    async def clear(self, key):
+        self.values = []
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_spill_survives_store_errors():
+    world = World()
+    world.handled = []
+    world.spill_store = FlakySpillStore()
+    actor = world.create_actor('spilling', SlowRecorder, mailbox_size=10, overflow=OVERFLOW_SPILL)
+    for i in range(50):
+        world.tell_nowait('spilling', i)
+    # the failed batch is kept, not lost
+    await asyncio.sleep(0.01)
+    assert actor.queue.spill.in_flight == 0
+    for i in range(50, 100):
+        world.tell_nowait('spilling', i)
+    for _ in range(100):
+        if len(world.handled) == 100:
+            break
+        await asyncio.sleep(0.05)
+    assert world.handled == list(range(100))
+    assert actor.queue.spill.size == 0
+
+    # messages the store lost don't keep the mailbox spilling
+    spill = actor.queue.spill
+    spill.stored = 5
+    await asyncio.wait_for(spill.pull(), 1)
+    assert spill.size == 0
+
+    await world.stop()
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from untamed.metrics import Histogram
+from untamed.subsystem import World, Actor, SuspendableActor
+from untamed.tracing import RecordingTracer
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if msg.get('sleep'):
+            await asyncio.sleep(msg['sleep'])
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': msg['data']})
+
+
+class Counter(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for i in range(1, 10_001):
+        histogram.record(i / 1_000_000)
+    quantiles = histogram.quantiles()
+    for q, value in quantiles.items():
+        expected = q * 10_000 / 1_000_000
+        assert abs(value - expected) <= expected * 0.04
+    assert histogram.summary()['max'] == 0.01
+    assert histogram.summary()['count'] == 10_000
+
+
+@pytest.mark.asyncio
+async def test_actor_stats(tmp_path):
+    world = World()
+    await world.basic_config(data_dir=str(tmp_path))
+    world.create_actor('echo-1', EchoActor)
+    world.enable_metrics()
+    world.create_actor('echo-2', EchoActor)
+    world.create_actor('counter', Counter)
+
+    for i in range(10):
+        await world.tell_and_get('echo-1', {'data': i})
+        await world.tell_and_get('echo-2', {'data': i, 'sleep': 0.001})
+    await world.tell('counter', {'cmd': 'inc'})
+    await world.suspend_actor('counter')
+    world.create_actor('counter', Counter)
+    await world.tell('counter', {'cmd': 'inc'})
+    await asyncio.sleep(0.05)
+
+    stats = await world.tell_and_get('metrics', {'cmd': 'stats'})
+    echo = stats['data']['actors']['EchoActor']
+    assert echo['received'] == 20
+    assert echo['handled'] == 20
+    assert echo['queue_depth'] == 0
+    assert echo['handle_time']['p99'] >= 0.001
+    assert stats['data']['ask_time']['count'] == 20
+    assert stats['data']['persistence_save_time']['count'] >= 1
+    assert stats['data']['persistence_load_time']['count'] >= 1
+
+    text = (await world.tell_and_get('metrics', {'cmd': 'prometheus'}))['data']
+    assert 'untamed_messages_handled_total{actor_class="EchoActor"} 20' in text
+    assert 'untamed_handle_seconds_count{actor_class="EchoActor"} 20' in text
+    assert 'untamed_ask_seconds_count' in text
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_per_actor_stats_with_tracing():
+    world = World()
+    tracer = RecordingTracer()
+    world.trace(tracer)
+    world.enable_metrics(per_actor=True)
+    world.create_actor('echo', EchoActor)
+    await world.tell_and_get('echo', {'data': 1})
+
+    assert world.stats()['actors']['echo']['handled'] == 1
+    assert [e['kind'] for e in tracer.events if e['actor'] == 'echo'][-1] == 'handle_end'
+
+    world.untrace()
+    await world.tell_and_get('echo', {'data': 2})
+    assert world.stats()['actors']['echo']['handled'] == 2
+    await world.stop()
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import World, SuspendableActor, RedisPersistence
+
+
+class CountingPersistence(RedisPersistence):
+    async def save_and_load(self, saves, loads):
+        self.world.round_trips += 1
+        return await super().save_and_load(saves, loads)
+
+
+class SomeActor(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'set_foo':
+            await self.set_state(msg['data'])
+
+        if msg.get('cmd', None) == 'get_foo':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state})
+
+
+@pytest.mark.asyncio
+async def test_batched_save_and_load():
+    world = World()
+    world.round_trips = 0
+    persistence = world.create_actor('persistence', CountingPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': 'redis://localhost:6379/12'})
+
+    n = 500
+    for i in range(n):
+        world.create_actor(f'batch-{i}', SomeActor)
+        await world.tell(f'batch-{i}', {'cmd': 'set_foo', 'data': {'i': i}})
+    for i in range(n):
+        await world.suspend_actor(f'batch-{i}')
+
+    for i in range(n):
+        await world.revive_actor(f'batch-{i}', SomeActor)
+    results = await asyncio.gather(
+        *[world.tell_and_get(f'batch-{i}', {'cmd': 'get_foo'}) for i in range(n)]
+    )
+    assert [result['data']['i'] for result in results] == list(range(n))
+    assert world.round_trips < n / 10
+
+    await world.stop()
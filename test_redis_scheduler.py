@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import aioredis
+import pytest
+
+from untamed.subsystem import World, Actor, RedisTaskScheduler
+
+REDIS_URL = 'redis://localhost:6379/12'
+PREFIX = 'test-schedule'
+
+received = []
+
+
+class Collector(Actor):
+    async def on_message(self, msg, sender):
+        received.append((self.world, msg['n']))
+
+
+async def make_world():
+    world = World()
+    world.create_actor('collector', Collector)
+    scheduler = world.create_actor('task_scheduler', RedisTaskScheduler)
+    await scheduler.tell({'cmd': 'connect', 'data': REDIS_URL, 'prefix': PREFIX})
+    return world
+
+
+async def wait_for(count, timeout=5):
+    deadline = time.time() + timeout
+    while len(received) < count and time.time() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def clean_redis():
+    redis = await aioredis.create_redis_pool(REDIS_URL)
+    await redis.delete(f'{PREFIX}:due', f'{PREFIX}:leases', f'{PREFIX}:items')
+    return redis
+
+
+@pytest.mark.asyncio
+async def test_worlds_share_schedules_without_double_firing():
+    received.clear()
+    redis = await clean_redis()
+    worlds = [await make_world(), await make_world()]
+    at = time.time() + 0.3
+    for i in range(400):
+        await worlds[i % 2].tell('task_scheduler', {
+            'cmd': 'schedule', 'data': {'at': at, 'actor': 'collector', 'msg': {'n': i}}
+        })
+
+    await wait_for(400)
+    await asyncio.sleep(0.2)
+    assert sorted(n for _, n in received) == list(range(400))
+    assert await redis.zcard(f'{PREFIX}:leases') == 0
+    assert await redis.hlen(f'{PREFIX}:items') == 0
+    for world in worlds:
+        await world.stop()
+    redis.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_sent_again():
+    received.clear()
+    redis = await clean_redis()
+    world = await make_world()
+    scheduler = world.get_actor('task_scheduler')
+    await world.tell_and_get('task_scheduler', {
+        'cmd': 'schedule', 'data': {'at': time.time() + 0.1, 'actor': 'collector', 'msg': {'n': 1}}
+    })
+    # another world claimed it and died without releasing it
+    now = time.time() + 0.15
+    claimed, _ = await scheduler.run_script('claim', repr(now), repr(now + 0.2), 10)
+    await world.stop()
+    assert len(claimed) == 3
+
+    received.clear()
+    world = await make_world()
+    await wait_for(1)
+    assert [n for _, n in received] == [1]
+    await world.stop()
+    redis.close()
+
+
+@pytest.mark.asyncio
+async def test_scheduled_again_while_claimed():
+    received.clear()
+    redis = await clean_redis()
+    world = await make_world()
+    scheduler = world.get_actor('task_scheduler')
+    await world.tell_and_get('task_scheduler', {
+        'cmd': 'schedule',
+        'data': {'at': time.time() + 60, 'every': 60, 'id': 'job', 'actor': 'collector', 'msg': {'n': 1}},
+    })
+    now = time.time() + 61
+    claimed, _ = await scheduler.run_script('claim', repr(now), repr(now + 30), 10)
+    assert claimed[0] == b'job'
+
+    # scheduled once by another world before the claim is released
+    await world.tell_and_get('task_scheduler', {
+        'cmd': 'schedule', 'data': {'at': time.time() + 0.1, 'id': 'job', 'actor': 'collector', 'msg': {'n': 2}}
+    })
+    await scheduler.run_script('ack', 'job', repr(now + 60))
+    await wait_for(1)
+    await asyncio.sleep(0.1)
+    assert [n for _, n in received] == [2]
+    assert await redis.zcard(f'{PREFIX}:due') == 0
+    await world.stop()
+    redis.close()
+
+
+@pytest.mark.asyncio
+async def test_recurring_and_cancel():
+    received.clear()
+    redis = await clean_redis()
+    world = await make_world()
+    await world.tell('task_scheduler', {
+        'cmd': 'schedule',
+        'data': {'at': time.time(), 'every': 0.05, 'id': 'ticker', 'actor': 'collector', 'msg': {'n': 't'}},
+    })
+    await asyncio.sleep(0.22)
+    await world.tell('task_scheduler', {'cmd': 'cancel', 'data': {'id': 'ticker'}})
+    count = len(received)
+    assert 3 <= count <= 6
+
+    await asyncio.sleep(0.15)
+    assert len(received) == count
+    assert await redis.zcard(f'{PREFIX}:due') == 0
+    await world.stop()
+    redis.close()
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from untamed.sharding import MAX_BATCH, HashRing, RemoteActor, Shard, shard_channels, shard_sockets
+from untamed.subsystem import World, Actor
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if msg.get('cmd') == 'forward':
+            await self.world.tell(msg['to'], {'cmd': 'ping', 'from': self.name}, sender=self.name)
+        if msg.get('cmd') == 'ping':
+            await self.world.tell(sender, {'cmd': 'pong', 'from': self.name}, sender=self.name)
+        if msg.get('cmd') == 'pong':
+            self.world.pongs.append((self.name, msg['from']))
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.world.shard.index})
+
+
+def test_hash_ring():
+    names = [f'actor-{i}' for i in range(10_000)]
+    ring = HashRing(4)
+    owners = [ring.owner(name) for name in names]
+    for shard in range(4):
+        assert 1500 < owners.count(shard) < 3500
+    # the same on every shard
+    other = HashRing(4)
+    assert owners == [other.owner(name) for name in names]
+
+    # a fifth shard takes names from the others without moving the rest
+    bigger = HashRing(5)
+    moved = sum(1 for name, owner in zip(names, owners) if bigger.owner(name) != owner)
+    assert moved < 3000
+    assert all(bigger.owner(name) in (owner, 4) for name, owner in zip(names, owners))
+
+
+async def make_shards(count):
+    sockets = shard_sockets(count)
+    worlds = []
+    for index in range(count):
+        world = World()
+        world.pongs = []
+        world.shard = Shard(index, count, sockets[index])
+        await world.shard.start(world)
+        worlds.append(world)
+    return worlds
+
+
+@pytest.mark.asyncio
+async def test_actors_are_placed_by_name():
+    worlds = await make_shards(3)
+    names = [f'echo-{i}' for i in range(30)]
+    for world in worlds:
+        for name in names:
+            world.create_actor(name, EchoActor)
+
+    for name in names:
+        owner = worlds[0].shard.ring.owner(name)
+        for index, world in enumerate(worlds):
+            assert (name in world.actors) == (index == owner)
+        # asked from every shard, answered by the owner
+        for world in worlds:
+            reply = await world.tell_and_get(name, {'cmd': 'where'})
+            assert reply['data'] == owner
+    assert isinstance(worlds[1].create_actor('echo-0', EchoActor), (Actor, RemoteActor))
+
+    for world in worlds:
+        await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_actors_talk_across_shards():
+    worlds = await make_shards(2)
+    names = [f'echo-{i}' for i in range(20)]
+    for world in worlds:
+        for name in names:
+            world.create_actor(name, EchoActor)
+
+    for i, name in enumerate(names):
+        worlds[i % 2].tell_nowait(name, {'cmd': 'forward', 'to': names[-1 - i]})
+    # a round trip through every shard after the pings and pongs
+    for _ in range(3):
+        for world in worlds:
+            for name in names:
+                await world.tell_and_get(name, {'cmd': 'sync'})
+
+    pongs = worlds[0].pongs + worlds[1].pongs
+    assert sorted(pongs) == sorted((name, names[-1 - i]) for i, name in enumerate(names))
+
+    for world in worlds:
+        await world.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('connect', [shard_sockets, shard_channels])
+async def test_messages_that_cant_be_encoded_are_dropped(connect):
+    links = connect(2)
+    worlds = []
+    for index in range(2):
+        world = World()
+        world.set_codec('json')
+        world.shard = Shard(index, 2, links[index])
+        await world.shard.start(world)
+        worlds.append(world)
+    names = [f'echo-{i}' for i in range(10)]
+    for world in worlds:
+        for name in names:
+            world.create_actor(name, EchoActor)
+    remote = next(name for name in names if worlds[0].shard.remote_owner(name) == 1)
+
+    worlds[0].tell_nowait(remote, {'cmd': 'bad', 'data': lambda: 1})
+    # the link still works, sets aren't json but are pickled by the codec
+    reply = await worlds[0].tell_and_get(remote, {'cmd': 'where', 'data': {1, 2}})
+    assert reply['data'] == 1
+    for world in worlds:
+        await world.stop()
+    if connect is shard_channels:
+        for channel in links[0].values():
+            channel.unlink()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('connect', [shard_sockets, shard_channels])
+async def test_senders_wait_for_a_slow_shard(connect):
+    links = connect(2)
+    worlds = []
+    for index in range(2):
+        world = World()
+        world.shard = Shard(index, 2, links[index])
+        await world.shard.start(world)
+        worlds.append(world)
+    remote = next(f'echo-{i}' for i in range(10) if worlds[0].shard.remote_owner(f'echo-{i}') == 1)
+    worlds[1].create_actor(remote, EchoActor)
+    # shard 1 stops reading
+    worlds[1].shard.links[0].read_task.cancel()
+    link = worlds[0].shard.links[1]
+    largest = 0
+
+    async def send():
+        nonlocal largest
+        for i in range(100_000):
+            await worlds[0].tell(remote, {'cmd': 'count', 'data': 'x' * 1000 + str(i)})
+            largest = max(largest, len(link.buffer))
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(send(), 0.5)
+    assert largest < MAX_BATCH
+    for world in worlds:
+        await world.stop()
+    if connect is shard_channels:
+        for channel in links[0].values():
+            channel.unlink()
@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import pickle
+
+import pytest
+
+from untamed.sharding import shard_channels, Shard
+from untamed.shm import RingBuffer, channel_pair, dumps, out_of_band
+from untamed.subsystem import World, Actor
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.world.shard.index})
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(4096)
+    try:
+        sent = received = 0
+        # records of varying size go around the ring many times
+        for round in range(200):
+            while ring.write(*encode([sent, 'x' * (sent % 300)])):
+                sent += 1
+            while True:
+                record = ring.read()
+                if record is None:
+                    break
+                assert record == [received, 'x' * (received % 300)]
+                received += 1
+        assert received == sent > 1000
+        assert ring.empty()
+        with pytest.raises(ValueError):
+            ring.write(b'x' * 4096)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def encode(obj):
+    import pickle
+    return pickle.dumps(obj), ()
+
+
+def test_large_bytearrays_go_out_of_band():
+    ring = RingBuffer(1 << 20)
+    try:
+        payload = bytearray(range(256)) * 1024
+        data, buffers = dumps([('tell', 'a', payload), ('tell', 'b', b'small')])
+        assert len(buffers) == 1 and buffers[0].nbytes == len(payload)
+        assert len(data) < 1000
+        assert ring.write(data, buffers)
+        batch = ring.read()
+        # still readable once the ring is written over
+        assert ring.write(*dumps([bytearray(len(payload))]))
+        assert type(batch[0][2]) is bytearray and batch[0][2] == payload
+        assert batch[1] == ('tell', 'b', b'small')
+        # smaller ones stay in the pickle, and batches without large ones
+        # aren't copied to look for them
+        assert dumps([bytearray(100)])[1] == []
+        batch = [('tell', 'a', {'data': [bytearray(100)]}, None)]
+        assert out_of_band(batch) is batch
+        batch.append(('tell', 'b', {'data': [payload]}, None))
+        assert type(out_of_band(batch)[1][2]['data'][0]) is pickle.PickleBuffer
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def echo(channel, count):
+    async def main():
+        channel.open()
+        received = 0
+        while received < count:
+            batch = await channel.get()
+            received += len(batch)
+            channel.put(batch)
+            await channel.wait_writable()
+        # the last put is written before the process ends
+        while channel.records:
+            await asyncio.sleep(0.01)
+        channel.close()
+    asyncio.run(main())
+
+
+def test_channel_between_processes():
+    here, there = channel_pair(1 << 20)
+    # forked before this process runs a loop
+    process = multiprocessing.get_context('fork').Process(target=echo, args=(there, 2010))
+    process.start()
+    payload = bytearray(range(256)) * 1024
+
+    async def main():
+        here.open()
+        for i in range(2000):
+            here.put([('tell', i)])
+            await here.wait_writable()
+        # large bytearrays go out of band
+        for i in range(10):
+            here.put([payload])
+        echoed = []
+        while len(echoed) < 2010:
+            echoed += await asyncio.wait_for(here.get(), 5)
+        return echoed
+
+    try:
+        echoed = asyncio.run(main())
+        assert echoed[:2000] == [('tell', i) for i in range(2000)]
+        assert echoed[2000:] == [payload] * 10
+        assert type(echoed[-1]) is bytearray
+    finally:
+        process.join(5)
+        here.close()
+        here.unlink()
+        there.close()
+
+
+@pytest.mark.asyncio
+async def test_shards_over_shared_memory():
+    channels = shard_channels(2, capacity=1 << 16)
+    worlds = []
+    for index in range(2):
+        world = World()
+        world.shard = Shard(index, 2, channels[index])
+        await world.shard.start(world)
+        worlds.append(world)
+    names = [f'echo-{i}' for i in range(20)]
+    for world in worlds:
+        for name in names:
+            world.create_actor(name, EchoActor)
+    for world in worlds:
+        for name in names:
+            reply = await world.tell_and_get(name, {'cmd': 'where'})
+            assert reply['data'] == worlds[0].shard.ring.owner(name)
+    for world in worlds:
+        await world.stop()
+    for peers in channels:
+        for channel in peers.values():
+            channel.unlink()
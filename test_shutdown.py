@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pytest
+
+from untamed.subsystem import (
+    World, Actor, SuspendableActor, LocalPersistence, DURABILITY_INTERVAL, DURABILITY_ON_SUSPEND,
+)
+
+handled = []
+
+
+class SlowActor(Actor):
+    async def on_message(self, msg, sender):
+        await asyncio.sleep(msg.get('sleep', 0))
+        handled.append(msg['n'])
+
+
+class Counter(SuspendableActor):
+    durability = DURABILITY_INTERVAL
+
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'add':
+            await self.set_state({'n': self.state.get('n', 0) + 1})
+
+        if msg.get('cmd', None) == 'sleep':
+            await asyncio.sleep(msg['seconds'])
+
+        if msg.get('cmd', None) == 'get':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state.get('n')})
+
+
+@pytest.mark.asyncio
+async def test_stop_actor_without_polling():
+    world = World()
+    world.create_actor('slow', SlowActor)
+    started = time.perf_counter()
+    assert await world.stop_actor('slow')
+    assert time.perf_counter() - started < 0.05
+    assert world.get_actor('slow') is None
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_drain_handles_queued_messages():
+    handled.clear()
+    world = World()
+    world.create_actor('slow', SlowActor)
+    for i in range(5):
+        await world.tell('slow', {'n': i})
+    await world.stop_actor('slow')
+    assert handled == [0, 1, 2, 3, 4]
+
+    handled.clear()
+    world.create_actor('slow', SlowActor)
+    await world.tell('slow', {'n': 0, 'sleep': 0.01})
+    for i in range(1, 5):
+        await world.tell('slow', {'n': i})
+    await asyncio.sleep(0)
+    await world.stop_actor('slow', drain=False)
+    assert handled == [0]
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_deadline():
+    world = World()
+    world.create_actor('stuck', SlowActor)
+    world.create_actor('fine', SlowActor)
+    await world.tell('stuck', {'n': 0, 'sleep': 10})
+
+    started = time.perf_counter()
+    assert await world.stop(timeout=0.1) == ['stuck']
+    assert time.perf_counter() - started < 0.5
+    assert world.actors == {}
+
+
+@pytest.mark.asyncio
+async def test_persistence_stops_after_draining_actors(tmp_path):
+    world = World()
+    await world.basic_config(data_dir=str(tmp_path))
+    world.create_actor('counter', Counter)
+    for i in range(100):
+        await world.tell('counter', {'cmd': 'add'})
+    await world.stop()
+
+    world = World()
+    await world.basic_config(data_dir=str(tmp_path))
+    world.create_actor('counter', Counter)
+    assert (await world.tell_and_get('counter', {'cmd': 'get'}))['data'] == 100
+    await world.stop()
+
+
+async def persistent_world(path):
+    # no task scheduler, its stop phase would let the counter drain first
+    world = World()
+    persistence = world.create_actor('persistence', LocalPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': str(path)})
+    return world
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('loaded', [True, False])
+@pytest.mark.parametrize('durability', [DURABILITY_INTERVAL, DURABILITY_ON_SUSPEND])
+async def test_stop_saves_changes_made_while_draining(tmp_path, durability, loaded):
+    Counter.durability = durability
+    try:
+        world = await persistent_world(tmp_path / 'states.log')
+        world.create_actor('counter', Counter)
+        if loaded:
+            await world.tell_and_get('counter', {'cmd': 'get'})
+        # still queued when stop flushes the dirty states, or while
+        # the state is loading
+        for i in range(100):
+            await world.tell('counter', {'cmd': 'add'})
+        await world.stop()
+
+        world = await persistent_world(tmp_path / 'states.log')
+        world.create_actor('counter', Counter)
+        assert (await world.tell_and_get('counter', {'cmd': 'get'}))['data'] == 100
+        await world.stop()
+    finally:
+        Counter.durability = DURABILITY_INTERVAL
+
+
+@pytest.mark.asyncio
+async def test_stop_deadline_includes_suspending_actors(tmp_path):
+    world = await persistent_world(tmp_path / 'states.log')
+    world.create_actor('stuck', Counter)
+    await world.tell_and_get('stuck', {'cmd': 'get'})
+    await world.tell('stuck', {'cmd': 'sleep', 'seconds': 5})
+    world.passivate_actor('stuck')
+
+    started = time.perf_counter()
+    assert await world.stop(timeout=0.2) == ['stuck']
+    assert time.perf_counter() - started < 0.5
+    assert not world.passivating
+
+
+@pytest.mark.asyncio
+async def test_stop_many_actors():
+    world = World()
+    world.use_dispatcher()
+    for i in range(10_000):
+        world.create_actor(f'actor-{i}', Actor)
+
+    started = time.perf_counter()
+    assert await world.stop() == []
+    assert time.perf_counter() - started < 2
+    assert world.actors == {}
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+
+from untamed.subsystem import World, Actor, TaskScheduler
+
+received = []
+
+
+class Collector(Actor):
+    async def on_message(self, msg, sender):
+        received.append(msg['n'])
+
+
+async def make_world(data_dir):
+    world = World()
+    await world.basic_config(data_dir=data_dir)
+    world.create_actor('collector', Collector)
+    return world
+
+
+async def schedule(world, at, n, **data):
+    data.update({'at': at, 'actor': 'collector', 'msg': {'n': n}})
+    return await world.tell_and_get('task_scheduler', {'cmd': 'schedule', 'data': data})
+
+
+@pytest.mark.asyncio
+async def test_fires_in_order(tmp_path):
+    received.clear()
+    world = await make_world(str(tmp_path))
+    now = time.time()
+    await schedule(world, now + 0.2, 2)
+    await schedule(world, now + 0.1, 1)
+    key = await schedule(world, now + 0.15, 'cancelled')
+    await world.tell('task_scheduler', {'cmd': 'cancel', 'data': {'id': key['data']}})
+
+    await asyncio.sleep(0.3)
+    assert received == [1, 2]
+    assert not world.get_actor('task_scheduler').timers
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_recurring(tmp_path):
+    received.clear()
+    world = await make_world(str(tmp_path))
+    await schedule(world, time.time(), 'tick', every=0.05, id='ticker')
+    await asyncio.sleep(0.22)
+    await world.tell('task_scheduler', {'cmd': 'cancel', 'data': {'id': 'ticker'}})
+    count = len(received)
+    assert 4 <= count <= 6
+
+    await asyncio.sleep(0.1)
+    assert len(received) == count
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_many_due_timers_are_sent_together(tmp_path):
+    received.clear()
+    world = await make_world(str(tmp_path))
+    at = time.time() + 1
+    for i in range(10_000):
+        await world.tell('task_scheduler', {
+            'cmd': 'schedule', 'data': {'at': at, 'actor': 'collector', 'msg': {'n': i}}
+        })
+    # all schedules are in once this is answered
+    await schedule(world, at, 10_000)
+    assert received == []
+
+    deadline = time.time() + 5
+    while len(received) < 10_001 and time.time() < deadline:
+        await asyncio.sleep(0.05)
+    assert sorted(received) == list(range(10_001))
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_survives_restart(tmp_path):
+    received.clear()
+    world = await make_world(str(tmp_path))
+    await schedule(world, time.time() + 0.2, 'after restart')
+    await world.stop()
+    assert received == []
+
+    world = await make_world(str(tmp_path))
+    await asyncio.sleep(0.3)
+    assert received == ['after restart']
+    await world.stop()
+
+
+class CountingScheduler(TaskScheduler):
+    saves = 0
+
+    async def save_state(self, full=True):
+        CountingScheduler.saves += 1
+        await super().save_state(full)
+
+
+@pytest.mark.asyncio
+async def test_schedules_are_written_behind(tmp_path):
+    world = await make_world(str(tmp_path))
+    await world.stop_actor('task_scheduler')
+    world.create_actor('task_scheduler', CountingScheduler)
+    at = time.time() + 60
+    for i in range(1000):
+        await world.tell('task_scheduler', {'cmd': 'schedule', 'data': {
+            'id': f'timer-{i}', 'at': at, 'actor': 'collector', 'msg': {'n': i},
+        }})
+    await world.tell('task_scheduler', {'cmd': 'cancel', 'data': {'id': 'timer-0'}})
+    await world.tell_and_get('task_scheduler', {'cmd': 'schedule', 'data': {
+        'at': at, 'actor': 'collector', 'msg': {'n': 'last'},
+    }})
+    # not one write per schedule
+    assert CountingScheduler.saves <= 2
+    await world.stop()
+
+    world = await make_world(str(tmp_path))
+    await world.tell_and_get('task_scheduler', {'cmd': 'schedule', 'data': {
+        'at': at, 'actor': 'collector', 'msg': {'n': 'sync'},
+    }})
+    timers = world.get_actor('task_scheduler').timers
+    assert len(timers) == 1001 and 'timer-0' not in timers
+    await world.stop()
@@ -0,0 +1,59 @@
+import pytest
+
+from untamed.subsystem import World, Actor
+from untamed.tracing import RecordingTracer
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': msg['data']})
+
+
+@pytest.mark.asyncio
+async def test_traces_one_actor():
+    world = World()
+    world.create_actor('traced', EchoActor)
+    world.create_actor('other', EchoActor)
+    tracer = RecordingTracer()
+    world.trace(tracer, 'traced')
+    assert type(world.get_actor('other')) is EchoActor
+
+    await world.tell_and_get('traced', {'data': 1})
+    await world.tell_and_get('other', {'data': 2})
+    world.tell_nowait('traced', {'data': 3})
+    await world.tell_and_get('traced', {'data': 4})
+
+    kinds = [(e['kind'], e['msg']['data']) for e in tracer.events]
+    assert kinds[:5] == [
+        ('send', 1), ('enqueue', 1), ('dequeue', 1), ('handle_start', 1), ('handle_end', 1),
+    ]
+    assert {data for _, data in kinds} == {1, 3, 4}
+    assert len({e['trace_id'] for e in tracer.events}) == 3
+    end = [e for e in tracer.events if e['kind'] == 'handle_end'][0]
+    assert end['duration'] >= 0
+
+    world.untrace('traced')
+    assert type(world.get_actor('traced')) is EchoActor
+    await world.tell_and_get('traced', {'data': 5})
+    assert len(tracer.events) == 15
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_sampling_and_new_actors():
+    world = World()
+    world.trace(RecordingTracer(sample_rate=0.0))
+    actor = world.create_actor('sampled', EchoActor)
+    assert type(actor).__name__ == 'TracedEchoActor'
+    for i in range(100):
+        await world.tell('sampled', {'cmd': 'ping'})
+    assert not type(actor).tracer.events
+
+    tracer = RecordingTracer(sample_rate=0.5)
+    world.trace(tracer)
+    for i in range(1000):
+        await world.tell('sampled', {'cmd': 'ping'})
+    sent = [e for e in tracer.events if e['kind'] == 'send']
+    assert 350 < len(sent) < 650
+    await world.stop()
@@ -0,0 +1,239 @@
+import asyncio
+import pickle
+
+import pytest
+
+from untamed.codec import PickleCodec
+from untamed.subsystem import ActorNotFound, World, Actor
+from untamed.transport import BATCH, DATAGRAM_ITEM, HELLO, Transport, frame
+
+RAN = []
+
+
+class Payload:
+    def __reduce__(self):
+        return RAN.append, ('ran',)
+
+
+class EchoActor(Actor):
+    async def on_message(self, msg, sender):
+        if msg.get('cmd') == 'forward':
+            await self.world.tell(msg['to'], {'cmd': 'ping'}, sender=self.name)
+        if msg.get('cmd') == 'ping':
+            await self.world.tell(sender, {'cmd': 'pong', 'from': self.name}, sender=self.name)
+        if msg.get('cmd') == 'pong':
+            self.world.received.append((self.name, msg['from']))
+        if msg.get('cmd') == 'count':
+            self.world.received.append(msg['i'])
+        if 'msg_id' in msg:
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.world.transport.node})
+
+
+async def make_nodes(*names, **options):
+    worlds = []
+    for name in names:
+        world = World()
+        world.received = []
+        await world.listen(name, port=0, **options)
+        world.create_actor('echo', EchoActor)
+        worlds.append(world)
+    for world in worlds[1:]:
+        world.add_node(worlds[0].transport.node, *worlds[0].transport.address)
+    return worlds
+
+
+async def wait_for(condition, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_tell_and_ask_across_nodes():
+    a, b = await make_nodes('node-a', 'node-b')
+    # b knows a, a learns where b is when b connects
+    reply = await b.tell_and_get('node-a/echo', {'cmd': 'where'})
+    assert reply['data'] == 'node-a'
+    reply = await a.tell_and_get('node-b/echo', {'cmd': 'where'})
+    assert reply['data'] == 'node-b'
+    # the local node by its own name
+    assert (await a.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+
+    # the sender is qualified with its node, so the pong comes back
+    await a.tell('echo', {'cmd': 'forward', 'to': 'node-b/echo'})
+    await wait_for(lambda: a.received)
+    assert a.received == [('echo', 'echo')]
+
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_pickles_from_peers_are_refused():
+    with pytest.raises(ValueError):
+        Transport('node-a', codec='pickle')
+    a, b = await make_nodes('node-a', 'node-b')
+    for kind in (HELLO, BATCH):
+        for data in (PickleCodec.tag + pickle.dumps(Payload()), pickle.dumps(Payload())):
+            _, writer = await asyncio.open_connection(*a.transport.address)
+            writer.write(frame(kind, 1, data))
+            await writer.drain()
+            await asyncio.sleep(0.05)
+            writer.close()
+    assert not RAN
+
+    # errors of an ask come back as data
+    with pytest.raises(ActorNotFound):
+        await b.tell_and_get('node-a/nobody', {})
+    assert (await b.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_batches_and_reconnects():
+    a, b = await make_nodes('node-a', 'node-b', max_batch=100)
+    for i in range(1000):
+        await b.tell('node-a/echo', {'cmd': 'count', 'i': i})
+    link = b.transport.links['node-a']
+    assert link.seq <= 20
+    await wait_for(lambda: len(a.received) == 1000)
+
+    # drop the connection with batches in flight, they are sent again
+    # and handled once
+    for i in range(1000, 2000):
+        b.tell_nowait('node-a/echo', {'cmd': 'count', 'i': i})
+    link.flush()
+    link.writer.transport.abort()
+    await wait_for(lambda: len(a.received) == 2000)
+    await wait_for(lambda: not link.unacked)
+    assert a.received == list(range(2000))
+
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_restarted_node_that_accepted():
+    a, b = await make_nodes('node-a', 'node-b', max_batch=1)
+    await b.tell_and_get('node-a/echo', {})
+    for i in range(10):
+        await a.tell('node-b/echo', {'cmd': 'count', 'i': i})
+    await wait_for(lambda: len(b.received) == 10)
+
+    # a new session counts its batches from 1 again, b has to know
+    address = a.transport.address
+    await a.stop()
+    a = World()
+    await a.listen('node-a', *address, max_batch=1)
+    a.create_actor('echo', EchoActor)
+    assert (await b.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+    for i in range(10, 20):
+        await a.tell('node-b/echo', {'cmd': 'count', 'i': i})
+    await wait_for(lambda: len(b.received) == 20)
+    assert b.received == list(range(20))
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_messages_that_cant_be_encoded_are_dropped():
+    a, b = await make_nodes('node-a', 'node-b', max_batch=4)
+    b.tell_nowait('node-a/echo', {'cmd': 'count', 'i': 0})
+    b.tell_nowait('node-a/echo', {'bad': lambda: 1})
+    b.tell_nowait('node-a/echo', {'cmd': 'count', 'i': 1})
+    # a full batch is written by the sender, the bad message isn't its error
+    b.tell_nowait('node-a/echo', {'cmd': 'count', 'i': 2})
+    await b.tell('node-a/echo', {'cmd': 'count', 'i': 3})
+    await wait_for(lambda: len(a.received) == 4)
+    assert a.received == [0, 1, 2, 3]
+    assert not b.transport.links['node-a'].buffer
+    assert (await b.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_nodes_are_dialled_where_they_connected_from():
+    a = World()
+    a.received = []
+    await a.listen('node-a', port=0)
+    a.create_actor('echo', EchoActor)
+    b = World()
+    await b.listen('node-b', host='0.0.0.0', port=0)
+    b.create_actor('echo', EchoActor)
+    b.add_node('node-a', *a.transport.address)
+    await b.tell_and_get('node-a/echo', {})
+    port = b.transport.address[1]
+    assert a.transport.links['node-b'].address == ('127.0.0.1', port)
+
+    # dialled again after the connection is dropped
+    a.transport.links['node-b'].writer.transport.abort()
+    await asyncio.sleep(0.05)
+    assert (await a.tell_and_get('node-b/echo', {}))['data'] == 'node-b'
+
+    # an address given with add_node is kept
+    a.add_node('node-b', 'localhost', port)
+    b.transport.links['node-a'].writer.transport.abort()
+    assert (await b.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+    assert a.transport.links['node-b'].address == ('localhost', port)
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_silent_nodes_are_dropped():
+    a, b = await make_nodes('node-a', 'node-b', heartbeat_interval=0.05, heartbeat_timeout=0.2)
+    await b.tell_and_get('node-a/echo', {})
+    assert len(a.transport.connections) == 1
+    # heartbeats keep an idle connection
+    await asyncio.sleep(0.5)
+    assert len(a.transport.connections) == 1
+
+    # b stops reading and sending
+    b.transport.heartbeat_task.cancel()
+    b.transport.links['node-a'].writer.transport.pause_reading()
+    await wait_for(lambda: not a.transport.connections)
+    await a.stop()
+    await b.stop()
+
+
+@pytest.mark.asyncio
+async def test_datagrams():
+    a, b = await make_nodes('node-a', 'node-b', datagrams=True, mtu=1000)
+    await b.tell_and_get('node-a/echo', {})
+    sent = []
+    sendto = b.transport.udp.sendto
+    b.transport.udp.sendto = lambda data, address: sent.append(len(data)) or sendto(data, address)
+
+    for i in range(200):
+        assert b.tell_datagram('node-a/echo', {'cmd': 'count', 'i': i})
+    await wait_for(lambda: len(a.received) == 200)
+    assert a.received == list(range(200))
+    # packed up to the mtu
+    assert 5 <= len(sent) <= 20
+    assert max(sent) <= 1000
+
+    # too large for a datagram, sent on the connection
+    seq = b.transport.links['node-a'].seq
+    b.tell_datagram('node-a/echo', {'cmd': 'count', 'i': 'large', 'data': 'x' * 5000})
+    await wait_for(lambda: len(a.received) == 201)
+    assert b.transport.links['node-a'].seq == seq + 1
+    # asks and local names don't take datagrams
+    assert (await b.tell_and_get('node-a/echo', {}))['data'] == 'node-a'
+    assert b.tell_datagram('echo', {'cmd': 'count', 'i': 0})
+
+    # from a socket that isn't a node, or a pickle from a node
+    loop = asyncio.get_event_loop()
+    stranger, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0))
+    item = a.transport.serializer.dumps(['echo', {'cmd': 'count', 'i': 'stranger'}, None])
+    stranger.sendto(DATAGRAM_ITEM.pack(len(item)) + item, a.transport.address)
+    item = PickleCodec.tag + pickle.dumps(Payload())
+    sendto(DATAGRAM_ITEM.pack(len(item)) + item, a.transport.address)
+    await asyncio.sleep(0.05)
+    assert len(a.received) == 201 and not RAN
+    stranger.close()
+
+    await a.stop()
+    await b.stop()
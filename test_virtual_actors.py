@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import World, SuspendableActor, RedisPersistence
+
+
+class Counter(SuspendableActor):
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+
+        if msg.get('cmd', None) == 'incr':
+            await self.set_state({'n': self.state.get('n', 0) + 1})
+
+        if msg.get('cmd', None) == 'get':
+            await self.world.tell(sender, {'reply_to': msg['msg_id'], 'data': self.state.get('n', 0)})
+
+
+async def make_world(**kw):
+    world = World()
+    persistence = world.create_actor('persistence', RedisPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': 'redis://localhost:6379/12'})
+    world.enable_virtual_actors(Counter, **kw)
+    return world
+
+
+@pytest.mark.asyncio
+async def test_activate_on_first_message():
+    world = await make_world(idle_ttl=None)
+    await world.tell('counter-a', {'cmd': 'incr'})
+    await world.tell('counter-a', {'cmd': 'incr'})
+    assert 'counter-a' in world.actors
+    first = await world.tell_and_get('counter-a', {'cmd': 'get'})
+
+    await world.suspend_actor('counter-a')
+    assert 'counter-a' not in world.actors
+
+    await world.tell('counter-a', {'cmd': 'incr'})
+    result = await world.tell_and_get('counter-a', {'cmd': 'get'})
+    assert result['data'] == first['data'] + 1
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    world = await make_world(idle_ttl=None, max_active=2)
+    await world.tell('counter-1', {'cmd': 'incr'})
+    await world.tell('counter-2', {'cmd': 'incr'})
+    await world.tell('counter-1', {'cmd': 'incr'})
+    await world.tell('counter-3', {'cmd': 'incr'})
+
+    assert 'counter-1' in world.actors
+    assert 'counter-2' not in world.actors
+    assert list(world.virtual_actors) == ['counter-1', 'counter-3']
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_idle_passivation():
+    world = await make_world(idle_ttl=0.2)
+    await world.tell('counter-idle', {'cmd': 'incr'})
+    await asyncio.sleep(1.5)
+    assert 'counter-idle' not in world.actors
+
+    await world.stop()
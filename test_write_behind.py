@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from untamed.subsystem import (
+    World,
+    SuspendableActor,
+    RedisPersistence,
+    DURABILITY_INTERVAL,
+    DURABILITY_ON_SUSPEND,
+)
+
+
+class CountingPersistence(RedisPersistence):
+    async def save_and_load(self, saves, loads):
+        self.world.saves.extend(
+            (f'state::{sender}', dict(state)) for sender, (state, _) in saves.items()
+        )
+        return await super().save_and_load(saves, loads)
+
+
+class IntervalActor(SuspendableActor):
+    durability = DURABILITY_INTERVAL
+
+    async def on_message(self, msg, sender):
+        await super().on_message(msg, sender)
+        if msg.get('cmd', None) == 'set_foo':
+            await self.set_state(msg['data'])
+
+
+class OnSuspendActor(IntervalActor):
+    durability = DURABILITY_ON_SUSPEND
+
+
+async def make_world():
+    world = World()
+    world.saves = []
+    persistence = world.create_actor('persistence', CountingPersistence)
+    await persistence.tell({'cmd': 'connect', 'data': 'redis://localhost:6379/12'})
+    return world
+
+
+@pytest.mark.asyncio
+async def test_interval_coalesces_writes():
+    world = await make_world()
+    world.set_write_behind(interval=0.1, count=1000)
+    world.create_actor('interval-actor', IntervalActor)
+    for i in range(50):
+        await world.tell('interval-actor', {'cmd': 'set_foo', 'data': {'i': i}})
+    await asyncio.sleep(0.3)
+
+    saves = [value for key, value in world.saves if key == 'state::interval-actor']
+    assert len(saves) == 1
+    assert saves[0]['i'] == 49
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_on_count():
+    world = await make_world()
+    world.set_write_behind(interval=60, count=10)
+    world.create_actor('interval-actor', IntervalActor)
+    for i in range(25):
+        await world.tell('interval-actor', {'cmd': 'set_foo', 'data': {'i': i}})
+    await asyncio.sleep(0.1)
+
+    saves = [value for key, value in world.saves if key == 'state::interval-actor']
+    assert 1 <= len(saves) <= 5
+
+    await world.stop()
+
+
+@pytest.mark.asyncio
+async def test_on_suspend_and_stop():
+    world = await make_world()
+    world.create_actor('suspended', OnSuspendActor)
+    world.create_actor('stopped', OnSuspendActor)
+    for i in range(10):
+        await world.tell('suspended', {'cmd': 'set_foo', 'data': {'i': i}})
+        await world.tell('stopped', {'cmd': 'set_foo', 'data': {'i': i}})
+    await asyncio.sleep(0.1)
+    assert not world.saves
+
+    await world.suspend_actor('suspended')
+    await world.stop()
+    assert [key for key, _ in world.saves] == ['state::suspended', 'state::stopped']
@@ -1 +1,7 @@
-from .subsystem import *
\ No newline at end of file
+from .subsystem import *
+from .codec import *
+from .storage import *
+from .tracing import *
+from .metrics import *
+from .transport import *
+from .directory import *
@@ -0,0 +1,140 @@
+"""\
+load generator for a running world
+
+untamed-bench joins the world listening on --target as a node of its own
+(see transport) and asks one of its actors at a fixed rate. requests are
+sent on schedule whether or not the earlier ones were answered (an open
+loop), so a slow world can't slow down the load put on it.
+
+latency is measured from the time a request was due, not from the time it
+was sent: a request waiting for a free slot or behind a stalled one counts
+that wait, which is what a client would see. measuring from the send time
+instead hides stalls (coordinated omission), it is reported as service time.
+latency covers every request sent, a timed out one at the time it timed out,
+service time only the completed ones.
+
+the run is repeated for each concurrency level, the most requests in flight
+at once.
+
+    $ untamed-world --listen 127.0.0.1:7000
+    $ untamed-bench --target 127.0.0.1:7000 --rate 5000 --concurrency 1,10,100
+
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import click
+
+from .metrics import Histogram
+from .subsystem import World, AskTimeout
+
+
+def millis(histogram):
+    return {key: value if key == "count" else round(value * 1000, 3)
+            for key, value in histogram.summary().items()}
+
+
+async def open_loop(world, who, message, rate, duration, concurrency, timeout=5.0):
+    """\
+    ask `who` `rate` times a second for `duration` seconds with at most
+    `concurrency` asks in flight
+
+    :return: counts, the achieved rate and latency summaries in milliseconds
+    """
+    latency = Histogram()
+    service = Histogram()
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"sent": 0, "completed": 0, "timeouts": 0, "errors": 0}
+
+    async def request(due):
+        async with slots:
+            sent = time.perf_counter()
+            counts["sent"] += 1
+            try:
+                await world.tell_and_get(who, dict(message), timeout=timeout)
+            except AskTimeout:
+                counts["timeouts"] += 1
+            except Exception:
+                counts["errors"] += 1
+            else:
+                counts["completed"] += 1
+                service.record(time.perf_counter() - sent)
+        # failed requests count too, the slowest ones are the timeouts and
+        # leaving them out makes an overloaded world look fast
+        latency.record(time.perf_counter() - due)
+
+    total = max(1, int(rate * duration))
+    interval = 1.0 / rate
+    requests = []
+    started = time.perf_counter()
+    for i in range(total):
+        due = started + i * interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        requests.append(asyncio.ensure_future(request(due)))
+    await asyncio.gather(*requests)
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "rate": rate,
+        **counts,
+        "achieved_rate": round(counts["completed"] / elapsed, 1),
+        "latency_ms": millis(latency),
+        "service_time_ms": millis(service),
+    }
+
+
+async def sweep(target, node, actor, message, rate, duration, levels, timeout=5.0):
+    host, port = target.rsplit(":", 1)
+    world = World()
+    await world.listen(f"bench-{os.getpid()}", port=0)
+    world.add_node(node, host, int(port))
+    who = f"{node}/{actor}"
+    try:
+        # connects, and fails early on a wrong target
+        await world.tell_and_get(who, dict(message), timeout=timeout)
+        results = []
+        for concurrency in levels:
+            result = await open_loop(world, who, message, rate, duration, concurrency, timeout)
+            report(result)
+            results.append(result)
+        return results
+    finally:
+        await world.stop()
+
+
+def report(result):
+    latency = result["latency_ms"]
+    click.echo(
+        f"concurrency {result['concurrency']:>5}  "
+        f"{result['completed']:>8}/{result['sent']:<8} done  "
+        f"{result['timeouts']:>5} timeouts  "
+        f"{result['achieved_rate']:>10} req/s  "
+        f"p50 {latency['p50']:>9} ms  p99 {latency['p99']:>9} ms  "
+        f"p99.9 {latency['p99.9']:>9} ms  max {latency['max']:>9} ms"
+    )
+
+
+@click.command()
+@click.option('--target', required=True, help='host:port the world listens on, see untamed-world --listen')
+@click.option('--node', default='world', help='node name of the world')
+@click.option('--actor', default='world', help='actor asked, the world actor answers PING')
+@click.option('--message', default='{"cmd": "PING"}', help='json message the actor replies to')
+@click.option('--rate', default=1000.0, help='requests per second')
+@click.option('--duration', default=10.0, help='seconds per concurrency level')
+@click.option('--concurrency', default='1,10,100', help='comma separated levels of requests in flight')
+@click.option('--timeout', default=5.0, help='seconds to wait for a reply')
+@click.option('--output', default=None, help='write the results as json here')
+def run_bench(target, node, actor, message, rate, duration, concurrency, timeout, output):
+    logging.basicConfig(level=logging.WARNING)
+    levels = [int(level) for level in concurrency.split(",")]
+    results = asyncio.run(
+        sweep(target, node, actor, json.loads(message), rate, duration, levels, timeout)
+    )
+    if output:
+        with open(output, "w") as fh:
+            json.dump({"target": target, "actor": actor, "results": results}, fh, indent=2)
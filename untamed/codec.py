@@ -0,0 +1,243 @@
+"""\
+codecs for actor states and messages
+
+every encoded value starts with the tag byte of its codec, so data written
+with one codec can be read after switching to another. data written before
+codecs existed is a plain pickle, which always starts with 0x80.
+"""
+import json
+import logging
+import pickle
+import zlib
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Codec",
+    "PickleCodec",
+    "JSONCodec",
+    "MsgpackCodec",
+    "Serializer",
+    "Decoder",
+    "register_codec",
+    "get_codec",
+    "get_serializer",
+    "loads",
+    "DEFAULT_CODEC",
+]
+
+COMPRESSED_TAG = b"Z"
+PICKLE_PROTOCOL_TAG = 0x80
+
+
+class Codec:
+    name = None
+    # one byte put in front of the encoded value
+    tag = None
+
+    def dumps(self, obj) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes):
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    name = "pickle"
+    tag = b"P"
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONCodec(Codec):
+    """\
+    ujson when it's installed, json otherwise. keys of dicts become strings
+    """
+
+    name = "json"
+    tag = b"J"
+
+    def dumps(self, obj):
+        if ujson is not None:
+            return ujson.dumps(obj).encode()
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data):
+        if ujson is not None:
+            return ujson.loads(bytes(data))
+        return json.loads(bytes(data))
+
+
+class MsgpackCodec(Codec):
+    """\
+    tuples come back as lists
+    """
+
+    name = "msgpack"
+    tag = b"M"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS = {}
+TAGS = {}
+
+
+def register_codec(codec: Codec):
+    if len(codec.tag) != 1 or codec.tag == COMPRESSED_TAG:
+        raise ValueError(f"codec {codec.name} needs a single byte tag other than Z")
+    if codec.tag in TAGS and TAGS[codec.tag].name != codec.name:
+        raise ValueError(f"tag {codec.tag} is used by {TAGS[codec.tag].name}")
+    CODECS[codec.name] = codec
+    TAGS[codec.tag] = codec
+
+
+def get_codec(name) -> Codec:
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"unknown codec {name}, known: {', '.join(CODECS)}")
+
+
+register_codec(PickleCodec())
+register_codec(JSONCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+# the C pickler is as fast as msgpack on typical states (see
+# benchmarks/codec_speed.py) and keeps tuples, sets and classes intact
+DEFAULT_CODEC = "pickle"
+
+
+class Serializer:
+    """\
+    encodes with a codec and compresses values above a size threshold
+
+    values the codec can't encode, eg. a set with msgpack, are pickled
+    instead, the tag tells which codec to decode them with.
+
+    :param codec: name of a registered codec
+    :param compress_over: compress encoded values longer than this many bytes,
+        None to never compress
+    :param level: zlib compression level
+    :param fallback: pickle the values the codec can't encode, False to
+        raise instead
+    """
+
+    def __init__(self, codec=DEFAULT_CODEC, compress_over=None, level=1, fallback=True):
+        self.codec = get_codec(codec)
+        self.compress_over = compress_over
+        self.level = level
+        self.fallback = fallback
+
+    def dumps(self, obj) -> bytes:
+        codec = self.codec
+        try:
+            data = codec.tag + codec.dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            if codec.name == "pickle" or not self.fallback:
+                raise
+            logger.debug(f"{codec.name} can't encode {type(obj)}, pickling it")
+            data = PickleCodec.tag + pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self.compress_over is not None and len(data) > self.compress_over:
+            return COMPRESSED_TAG + zlib.compress(data, self.level)
+        return data
+
+    def loads(self, data: bytes):
+        return loads(data)
+
+
+def loads(data: bytes):
+    """\
+    decode a value written by any Serializer, or a plain pickle
+    """
+    tag = data[:1]
+    if tag == COMPRESSED_TAG:
+        data = zlib.decompress(memoryview(data)[1:])
+        tag = data[:1]
+    if data[0] == PICKLE_PROTOCOL_TAG:
+        return pickle.loads(data)
+    try:
+        codec = TAGS[tag]
+    except KeyError:
+        raise ValueError(f"no codec registered for tag {tag}")
+    return codec.loads(memoryview(data)[1:])
+
+
+class Decoder:
+    """\
+    decodes values of the given codecs only, for data that can come from
+    anyone: unlike loads it refuses pickles, unless "pickle" is one of the
+    codecs, and compressed values
+
+    :param codecs: names of registered codecs
+    """
+
+    def __init__(self, *codecs):
+        self.codecs = {}
+        for name in codecs:
+            codec = get_codec(name)
+            self.codecs[codec.tag] = codec
+
+    def loads(self, data: bytes):
+        tag = bytes(data[:1])
+        codec = self.codecs.get(tag)
+        if codec is None:
+            accepted = ", ".join(codec.name for codec in self.codecs.values())
+            raise ValueError(f"refused a value tagged {tag}, only {accepted} is accepted")
+        return codec.loads(memoryview(data)[1:])
+
+
+SERIALIZERS = {}
+
+
+def dumps_batch(dumps, batch, destination):
+    """\
+    encode a list of messages, the ones that can't be encoded are logged and
+    left out so they don't hold up the others
+
+    :return: dumps(batch), None when no message could be encoded
+    """
+    try:
+        return dumps(batch)
+    except Exception:
+        pass
+    encodable = []
+    for item in batch:
+        try:
+            dumps([item])
+        except Exception:
+            logger.exception(f"dropped a message to {destination} that can't be encoded")
+        else:
+            encodable.append(item)
+    return dumps(encodable) if encodable else None
+
+
+def get_serializer(codec=DEFAULT_CODEC, compress_over=None) -> Serializer:
+    """\
+    a shared Serializer for the codec and threshold
+    """
+    key = (codec, compress_over)
+    serializer = SERIALIZERS.get(key)
+    if serializer is None:
+        serializer = SERIALIZERS[key] = Serializer(codec, compress_over)
+    return serializer
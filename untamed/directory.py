@@ -0,0 +1,314 @@
+"""\
+where actors run in a cluster of nodes
+
+a Directory maps actor names to the node running them, and nodes to the
+address they listen on, see World.use_directory. a world registers the actors
+it creates and unregisters the ones that stop or are passivated, so a virtual
+actor can come back on another node. changes are batched and written once
+per loop iteration.
+
+every node keeps the lookups it made in an LRU cache, so telling a remote
+actor usually costs a dict lookup. when an entry changes, eg. an actor moved
+to another node, every node is told to drop it from its cache.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+import aioredis
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["LRUCache", "Directory", "LocalDirectory", "RedisDirectory"]
+
+DEFAULT_CACHE_SIZE = 100_000
+# names changed by one call of the redis script
+CHANGES_PER_SCRIPT = 1000
+
+# KEYS: the directory hash, the invalidation channel
+# ARGV: node, then name and "1" to register or "0" to unregister. names of
+# other nodes aren't unregistered, they registered them again since
+APPLY_SCRIPT = """
+local changed = {}
+for i = 2, #ARGV, 2 do
+    local name = ARGV[i]
+    local current = redis.call('HGET', KEYS[1], name)
+    if ARGV[i + 1] == '1' then
+        if current ~= ARGV[1] then
+            redis.call('HSET', KEYS[1], name, ARGV[1])
+            changed[#changed + 1] = name
+        end
+    elseif current == ARGV[1] then
+        redis.call('HDEL', KEYS[1], name)
+        changed[#changed + 1] = name
+    end
+end
+if #changed > 0 then
+    redis.call('PUBLISH', KEYS[2], table.concat(changed, '\\n'))
+end
+return #changed
+"""
+
+
+class LRUCache:
+    __slots__ = ("entries", "maxsize")
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Directory:
+    """\
+    subclasses keep the map where every node finds it and tell every node
+    about changed entries
+
+    :param cache_size: lookups cached on this node
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache = LRUCache(cache_size)
+        self.node = None
+        # name -> node to register, None to unregister
+        self.changes = {}
+        self.flush_handle = None
+        self.writing = None
+        # name -> lookup in flight, callers asking for the same name share it
+        self.lookups = {}
+        # counts invalidations, lookups made before one aren't cached
+        self.generation = 0
+        # node -> (host, port)
+        self.addresses = {}
+
+    async def start(self, node, address):
+        """\
+        :param address: (host, port) node listens on
+        """
+        self.node = node
+        self.addresses[node] = address
+
+    async def node_address(self, node):
+        """\
+        :return: (host, port) node listens on, None for unknown nodes
+        """
+        address = self.addresses.get(node)
+        if address is None:
+            address = await self.get_address(node)
+            if address is not None:
+                self.addresses[node] = address
+        return address
+
+    def cached(self, name):
+        return self.cache.get(name)
+
+    async def lookup(self, name):
+        """\
+        :return: the node running the actor, None when it isn't registered
+        """
+        node = self.cache.get(name)
+        if node is not None:
+            return node
+        lookup = self.lookups.get(name)
+        if lookup is None:
+            lookup = self.lookups[name] = asyncio.ensure_future(self.fetch(name))
+        return await asyncio.shield(lookup)
+
+    async def fetch(self, name):
+        generation = self.generation
+        try:
+            node = await self.get(name)
+        finally:
+            self.lookups.pop(name, None)
+        if node is not None and generation == self.generation:
+            self.cache.put(name, node)
+        return node
+
+    def register(self, name):
+        self.change(name, self.node)
+
+    def unregister(self, name):
+        self.change(name, None)
+
+    def change(self, name, node):
+        self.changes[name] = node
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_event_loop().call_soon(self.write_changes)
+
+    def write_changes(self):
+        self.flush_handle = None
+        if self.changes:
+            changes, self.changes = self.changes, {}
+            self.writing = asyncio.ensure_future(self.write(changes, self.writing))
+
+    async def write(self, changes, previous):
+        # in the order they were made
+        if previous is not None:
+            await previous
+        try:
+            await self.apply(changes)
+        except Exception:
+            logger.exception("Exception on writing to the directory")
+
+    async def flush(self):
+        """\
+        write the changes made so far
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.write_changes()
+        if self.writing is not None:
+            await self.writing
+
+    def invalidate(self, names):
+        self.generation += 1
+        for name in names:
+            self.cache.invalidate(name)
+
+    async def get(self, name):
+        raise NotImplementedError
+
+    async def get_address(self, node):
+        raise NotImplementedError
+
+    async def apply(self, changes):
+        """\
+        :param changes: {name: this node to register, None to unregister}
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        await self.flush()
+
+
+class LocalDirectory(Directory):
+    """\
+    a directory in this process for tests and worlds sharing a loop, pass
+    the directory of another world as `join` to share its map
+    """
+
+    def __init__(self, join=None, cache_size=DEFAULT_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.entries = {} if join is None else join.entries
+        self.nodes = {} if join is None else join.nodes
+        self.members = [self] if join is None else join.members
+        if join is not None:
+            self.members.append(self)
+
+    async def start(self, node, address):
+        await super().start(node, address)
+        self.nodes[node] = address
+
+    async def get(self, name):
+        return self.entries.get(name)
+
+    async def get_address(self, node):
+        return self.nodes.get(node)
+
+    async def apply(self, changes):
+        changed = []
+        for name, node in changes.items():
+            current = self.entries.get(name)
+            if node is not None and current != node:
+                self.entries[name] = node
+                changed.append(name)
+            elif node is None and current == self.node:
+                del self.entries[name]
+                changed.append(name)
+        if changed:
+            for member in self.members:
+                member.invalidate(changed)
+
+    async def close(self):
+        await super().close()
+        if self in self.members:
+            self.members.remove(self)
+
+
+class RedisDirectory(Directory):
+    """\
+    the map in the redis hash <prefix>, changes are published on
+    <prefix>:invalidate. addresses of nodes are in <prefix>:nodes
+
+    :param redis_url: redis shared by every node
+    """
+
+    def __init__(self, redis_url, prefix="directory", cache_size=DEFAULT_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.redis = None
+        self.subscriber = None
+        self.listen_task = None
+        self.script = None
+
+    @property
+    def keys(self):
+        return [self.prefix, f"{self.prefix}:invalidate"]
+
+    async def start(self, node, address):
+        await super().start(node, address)
+        self.redis = await aioredis.create_redis_pool(self.redis_url)
+        await self.redis.hset(f"{self.prefix}:nodes", node, "%s:%d" % address)
+        self.script = await self.redis.script_load(APPLY_SCRIPT)
+        self.subscriber = await aioredis.create_redis(self.redis_url)
+        (channel,) = await self.subscriber.subscribe(self.keys[1])
+        self.listen_task = asyncio.ensure_future(self.listen(channel))
+
+    async def listen(self, channel):
+        while await channel.wait_message():
+            names = await channel.get()
+            self.invalidate(names.decode().split("\n"))
+
+    async def get(self, name):
+        node = await self.redis.hget(self.prefix, name)
+        return None if node is None else node.decode()
+
+    async def get_address(self, node):
+        address = await self.redis.hget(f"{self.prefix}:nodes", node)
+        if address is None:
+            return None
+        host, port = address.decode().rsplit(":", 1)
+        return host, int(port)
+
+    async def apply(self, changes):
+        changes = list(changes.items())
+        for i in range(0, len(changes), CHANGES_PER_SCRIPT):
+            args = [self.node]
+            for name, node in changes[i:i + CHANGES_PER_SCRIPT]:
+                args += [name, "0" if node is None else "1"]
+            try:
+                await self.redis.evalsha(self.script, keys=self.keys, args=args)
+            except aioredis.ReplyError as e:
+                # redis restarted and lost its script cache
+                if not str(e).startswith("NOSCRIPT"):
+                    raise
+                await self.redis.eval(APPLY_SCRIPT, keys=self.keys, args=args)
+
+    async def close(self):
+        await super().close()
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+        if self.subscriber is not None:
+            self.subscriber.close()
+            await self.subscriber.wait_closed()
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
@@ -0,0 +1,306 @@
+"""\
+runtime metrics
+
+World.enable_metrics swaps the class of every actor for a subclass counting
+the messages put to and handled from its mailbox and timing its handler,
+like tracing does. stats are kept per actor class, or per actor, in
+log-linear histograms with a bounded relative error (the layout of HDR
+histograms) so recording is a couple of integer operations.
+"""
+import time
+
+from .tracing import traced_class, untraced_class
+
+__all__ = [
+    "Histogram",
+    "ActorStats",
+    "Metrics",
+    "metered_class",
+    "unmetered_class",
+    "add_sanic_route",
+]
+
+# 2^5 sub buckets per power of two, values are within ~3% of their bucket
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    """\
+    durations in seconds, recorded as whole microseconds
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        # bucket index -> count
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1_000_000)
+        if value < SUB_BUCKETS:
+            index = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS
+            index = shift * HALF_SUB_BUCKETS + (value >> shift)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @staticmethod
+    def bucket_value(index):
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // HALF_SUB_BUCKETS - 1
+        top = index - shift * HALF_SUB_BUCKETS
+        # the middle of the bucket
+        return (top << shift) + (1 << shift) // 2
+
+    def quantiles(self, quantiles=QUANTILES):
+        """\
+        :return: {quantile: seconds}
+        """
+        result = {}
+        if not self.count:
+            return {q: 0.0 for q in quantiles}
+        pending = sorted(quantiles)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending and seen >= pending[0] * self.count:
+                value = min(self.bucket_value(index), self.max)
+                result[pending.pop(0)] = value / 1_000_000
+            if not pending:
+                break
+        for q in pending:
+            result[q] = self.max / 1_000_000
+        return result
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1_000_000 if self.count else 0.0,
+            "max": self.max / 1_000_000,
+            **{f"p{q * 100:g}": v for q, v in self.quantiles().items()},
+        }
+
+
+class ActorStats:
+    __slots__ = ("received", "dropped", "handled", "handle_time")
+
+    def __init__(self):
+        # accepted to the mailbox
+        self.received = 0
+        # dropped by a full mailbox
+        self.dropped = 0
+        # taken from the mailbox and handled
+        self.handled = 0
+        self.handle_time = Histogram()
+
+
+class Metrics:
+    """\
+    :param per_actor: keep stats per actor name instead of per class
+    """
+
+    def __init__(self, per_actor=False):
+        self.per_actor = per_actor
+        # class or actor name -> ActorStats
+        self.actors = {}
+        self.ask_time = Histogram()
+        self.save_time = Histogram()
+        self.load_time = Histogram()
+
+    def stats_for(self, key):
+        stats = self.actors.get(key)
+        if stats is None:
+            stats = self.actors[key] = ActorStats()
+        return stats
+
+    def key_for(self, actor):
+        if self.per_actor:
+            return actor.name
+        return base_class(type(actor)).__name__
+
+    def snapshot(self, world):
+        depth = {}
+        for actor in list(world.actors.values()):
+            size = actor.queue.qsize()
+            total, largest = depth.get(self.key_for(actor), (0, 0))
+            depth[self.key_for(actor)] = (total + size, max(largest, size))
+
+        actors = {}
+        for key, stats in self.actors.items():
+            total, largest = depth.get(key, (0, 0))
+            actors[key] = {
+                "received": stats.received,
+                "dropped": stats.dropped,
+                "handled": stats.handled,
+                "queue_depth": total,
+                "queue_depth_max": largest,
+                "handle_time": stats.handle_time.summary(),
+            }
+        return {
+            "actors": actors,
+            "ask_time": self.ask_time.summary(),
+            "persistence_save_time": self.save_time.summary(),
+            "persistence_load_time": self.load_time.summary(),
+        }
+
+    def prometheus(self, world):
+        """\
+        the snapshot in the prometheus text format
+        """
+        snapshot = self.snapshot(world)
+        label = "actor" if self.per_actor else "actor_class"
+        lines = []
+        for name, kind, field, help_text in (
+            ("untamed_messages_received_total", "counter", "received", "messages accepted to mailboxes"),
+            ("untamed_messages_dropped_total", "counter", "dropped", "messages dropped by full mailboxes"),
+            ("untamed_messages_handled_total", "counter", "handled", "messages handled"),
+            ("untamed_mailbox_depth", "gauge", "queue_depth", "messages waiting in mailboxes"),
+            ("untamed_mailbox_depth_max", "gauge", "queue_depth_max", "largest mailbox"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, stats in snapshot["actors"].items():
+                lines.append(f'{name}{{{label}="{escape(key)}"}} {stats[field]}')
+
+        lines.append("# HELP untamed_handle_seconds time spent handling a message")
+        lines.append("# TYPE untamed_handle_seconds summary")
+        for key, stats in self.actors.items():
+            lines.extend(summary_lines(
+                "untamed_handle_seconds", stats.handle_time, f'{label}="{escape(key)}"'
+            ))
+
+        for name, histogram, help_text in (
+            ("untamed_ask_seconds", self.ask_time, "tell_and_get round trip"),
+            ("untamed_persistence_save_seconds", self.save_time, "batched state saves"),
+            ("untamed_persistence_load_seconds", self.load_time, "batched state loads"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            lines.extend(summary_lines(name, histogram))
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def summary_lines(name, histogram, labels=""):
+    separator = "," if labels else ""
+    lines = [
+        f'{name}{{{labels}{separator}quantile="{q}"}} {v}'
+        for q, v in histogram.quantiles().items()
+    ]
+    braces = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{braces} {histogram.total / 1_000_000}")
+    lines.append(f"{name}_count{braces} {histogram.count}")
+    return lines
+
+
+METERED_CLASSES = {}
+
+
+def base_class(klass):
+    return unmetered_class(untraced_class(klass))
+
+
+def metered_class(klass, metrics):
+    """\
+    a subclass of klass keeping metrics of its actors, a traced class stays
+    traced with metrics kept under the tracing
+    """
+    tracer = klass.__dict__.get("tracer")
+    klass = base_class(klass)
+    key = (klass, metrics)
+    metered = METERED_CLASSES.get(key)
+    if metered is None:
+        metered = METERED_CLASSES[key] = make_metered_class(klass, metrics)
+    if tracer is not None:
+        return traced_class(metered, tracer)
+    return metered
+
+
+def unmetered_class(klass):
+    tracer = klass.__dict__.get("tracer")
+    if tracer is not None:
+        base = untraced_class(klass)
+        unmetered = base.__dict__.get("unmetered", base)
+        return klass if unmetered is base else traced_class(unmetered, tracer)
+    return klass.__dict__.get("unmetered", klass)
+
+
+def make_metered_class(klass, metrics):
+    if metrics.per_actor:
+        def stats_of(actor):
+            return metrics.stats_for(actor.name)
+    else:
+        class_stats = metrics.stats_for(klass.__name__)
+
+        def stats_of(actor):
+            return class_stats
+
+    async def tell(self, msg, sender=None, msg_id=None):
+        accepted = await klass.tell(self, msg, sender, msg_id)
+        stats = stats_of(self)
+        if accepted is False:
+            stats.dropped += 1
+        else:
+            stats.received += 1
+        return accepted
+
+    def tell_nowait(self, msg, sender=None, msg_id=None):
+        accepted = klass.tell_nowait(self, msg, sender, msg_id)
+        stats = stats_of(self)
+        if accepted is False:
+            stats.dropped += 1
+        else:
+            stats.received += 1
+        return accepted
+
+    async def process(self, item):
+        started = time.perf_counter()
+        running = await klass.process(self, item)
+        stats = stats_of(self)
+        stats.handled += 1
+        stats.handle_time.record(time.perf_counter() - started)
+        return running
+
+    return type(
+        f"Metered{klass.__name__}",
+        (klass,),
+        {
+            "__slots__": (),
+            "__module__": klass.__module__,
+            "unmetered": klass,
+            "tell": tell,
+            "tell_nowait": tell_nowait,
+            "process": process,
+        },
+    )
+
+
+def add_sanic_route(app, world, uri="/metrics"):
+    """\
+    serve the metrics of world in the prometheus text format on a sanic app,
+    the text is produced by the world's metrics actor
+    """
+    from sanic.response import text
+
+    async def metrics_handler(request):
+        reply = await world.tell_and_get("metrics", {"cmd": "prometheus"})
+        return text(reply["data"], content_type="text/plain; version=0.0.4")
+
+    app.add_route(metrics_handler, uri, methods=["GET"])
+    return metrics_handler
@@ -0,0 +1,303 @@
+"""\
+running one world per process
+
+every shard process runs the same world.py. actors are placed on a shard by
+consistent hashing of their name: create_actor on any other shard returns a
+RemoteActor, and World.tell/tell_nowait/tell_and_get forward messages for
+names placed elsewhere. actors that aren't sharded (Actor.sharded = False),
+like persistence and the schedulers, run on every shard.
+
+shards are connected pairwise with unix socket pairs, or shared memory rings
+(see shm). messages to a shard are buffered and written as one frame per
+loop iteration, or as soon as MAX_BATCH messages are waiting, encoded with
+the codec of the world (see World.set_codec) on sockets and pickled on rings.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import socket
+import struct
+
+from .codec import dumps_batch, get_serializer, loads
+from .shm import DEFAULT_CAPACITY, ShmChannel, channel_pair
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["HashRing", "Shard", "RemoteActor", "shard_sockets", "shard_channels"]
+
+FRAME_HEADER = struct.Struct("<I")
+# pause senders while this many bytes wait to be written to a shard
+HIGH_WATER = 1 << 20
+# write a batch as soon as this many messages wait, so the bytes waiting
+# are seen by wait_writable
+MAX_BATCH = 256
+
+
+def stable_hash(name):
+    # hash() of str is randomized per process
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little")
+
+
+class HashRing:
+    """\
+    :param shards: number of shards
+    :param vnodes: points per shard on the ring, more spread names evenly
+    """
+
+    def __init__(self, shards, vnodes=64):
+        self.shards = shards
+        points = sorted(
+            (stable_hash(f"{shard}-{i}"), shard)
+            for shard in range(shards)
+            for i in range(vnodes)
+        )
+        self.points = [point for point, _ in points]
+        self.owners = [shard for _, shard in points]
+        self.cache = {}
+
+    def owner(self, name):
+        owner = self.cache.get(name)
+        if owner is None:
+            if len(self.cache) > 100_000:
+                self.cache.clear()
+            index = bisect.bisect(self.points, stable_hash(name)) % len(self.points)
+            owner = self.cache[name] = self.owners[index]
+        return owner
+
+
+class RemoteActor:
+    """\
+    stands in for an actor placed on another shard
+    """
+
+    __slots__ = ("name", "world")
+
+    def __init__(self, name, world):
+        self.name = name
+        self.world = world
+
+    async def tell(self, msg, sender=None, msg_id=None):
+        if msg_id:
+            msg["msg_id"] = msg_id
+        return await self.world.tell(self.name, msg, sender)
+
+    def tell_nowait(self, msg, sender=None, msg_id=None):
+        if msg_id:
+            msg["msg_id"] = msg_id
+        return self.world.tell_nowait(self.name, msg, sender)
+
+
+class ShardLink:
+    """\
+    the connection to one other shard
+    """
+
+    def __init__(self, shard, peer, sock):
+        self.shard = shard
+        self.peer = peer
+        self.sock = sock
+        self.reader = None
+        self.writer = None
+        self.buffer = []
+        self.flush_scheduled = False
+        self.read_task = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
+        self.read_task = asyncio.ensure_future(self.read())
+
+    def send(self, envelope):
+        self.buffer.append(envelope)
+        if len(self.buffer) >= MAX_BATCH:
+            self.flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if not self.buffer or self.writer is None:
+            return
+        batch, self.buffer = self.buffer, []
+        world = self.shard.world
+        serializer = get_serializer(world.codec, world.compress_over)
+        data = dumps_batch(serializer.dumps, batch, f"shard {self.peer}")
+        if data is not None:
+            self.writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+    async def wait_writable(self):
+        if self.writer is not None:
+            if self.writer.transport.get_write_buffer_size() > HIGH_WATER:
+                await self.writer.drain()
+
+    async def read(self):
+        reader = self.reader
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                data = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                for envelope in loads(data):
+                    await self.shard.received(self, envelope)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Exception on reading from shard")
+
+    def close(self):
+        if self.read_task is not None:
+            self.read_task.cancel()
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+
+
+class ShmLink(ShardLink):
+    """\
+    the shared memory channel to one other shard
+    """
+
+    def __init__(self, shard, peer, channel):
+        super().__init__(shard, peer, None)
+        self.channel = channel
+
+    async def open(self):
+        self.channel.open()
+        self.read_task = asyncio.ensure_future(self.read())
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.buffer:
+            batch, self.buffer = self.buffer, []
+            records = dumps_batch(self.channel.encode, batch, f"shard {self.peer}")
+            if records is not None:
+                self.channel.write(records)
+
+    async def wait_writable(self):
+        await self.channel.wait_writable()
+
+    async def read(self):
+        try:
+            while True:
+                for envelope in await self.channel.get():
+                    await self.shard.received(self, envelope)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Exception on reading from shard")
+
+    def close(self):
+        if self.read_task is not None:
+            self.read_task.cancel()
+        self.flush()
+        self.channel.close()
+
+
+class Shard:
+    """\
+    :param index: this shard
+    :param count: number of shards
+    :param sockets: {other shard index: socket or ShmChannel connected to it}
+    """
+
+    def __init__(self, index, count, sockets):
+        self.index = index
+        self.count = count
+        self.ring = HashRing(count)
+        self.links = {
+            peer: (ShmLink if isinstance(sock, ShmChannel) else ShardLink)(self, peer, sock)
+            for peer, sock in sockets.items()
+        }
+        self.world = None
+
+    async def start(self, world):
+        self.world = world
+        for link in self.links.values():
+            await link.open()
+
+    def remote_owner(self, name):
+        """\
+        :return: the shard of name when it isn't this one, None otherwise
+        """
+        owner = self.ring.owner(name)
+        return None if owner == self.index else owner
+
+    async def tell(self, owner, who, msg, sender):
+        link = self.links[owner]
+        link.send(("tell", who, msg, sender))
+        await link.wait_writable()
+        return True
+
+    def tell_nowait(self, owner, who, msg, sender):
+        self.links[owner].send(("tell", who, msg, sender))
+        return True
+
+    def ask(self, owner, msg_id, who, msg):
+        self.links[owner].send(("ask", msg_id, who, msg))
+
+    def publish(self, owner, names, msg, sender):
+        self.links[owner].send(("publish", names, msg, sender))
+
+    async def received(self, link, envelope):
+        kind = envelope[0]
+        if kind == "tell":
+            _, who, msg, sender = envelope
+            try:
+                await self.world.tell(who, msg, sender)
+            except KeyError:
+                logger.warning(f"no actor {who} for a message from {sender}")
+        elif kind == "publish":
+            _, names, msg, sender = envelope
+            await self.world.deliver(dict.fromkeys(names), msg, sender)
+        elif kind == "ask":
+            asyncio.ensure_future(self.answer(link, *envelope[1:]))
+        elif kind == "reply":
+            _, msg_id, reply, error = envelope
+            fut = self.world.wait_reply_list.pop(msg_id, None)
+            if fut is None or fut.done():
+                return
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                reply["reply_to"] = msg_id
+                fut.set_result(reply)
+
+    async def answer(self, link, msg_id, who, msg):
+        try:
+            reply = await self.world.tell_and_get(who, msg)
+        except Exception as e:
+            link.send(("reply", msg_id, None, e))
+        else:
+            link.send(("reply", msg_id, reply, None))
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+
+
+def shard_sockets(count):
+    """\
+    connect every pair of shards
+
+    :return: [{other shard index: socket}] for every shard
+    """
+    sockets = [{} for _ in range(count)]
+    for i in range(count):
+        for j in range(i + 1, count):
+            sockets[i][j], sockets[j][i] = socket.socketpair()
+    return sockets
+
+
+def shard_channels(count, capacity=DEFAULT_CAPACITY):
+    """\
+    connect every pair of shards with shared memory rings
+
+    :return: [{other shard index: ShmChannel}] for every shard
+    """
+    channels = [{} for _ in range(count)]
+    for i in range(count):
+        for j in range(i + 1, count):
+            channels[i][j], channels[j][i] = channel_pair(capacity)
+    return channels
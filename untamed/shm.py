@@ -0,0 +1,390 @@
+"""\
+messages between processes on one host through shared memory
+
+a RingBuffer is a multiprocessing.shared_memory segment that one process
+writes records to and one other process reads them from, with no syscall or
+copy through the kernel per message. a ShmChannel is one end of a pair of
+rings, one for each direction, used by shards as an alternative to socket
+pairs, see sharding.shard_channels.
+
+a reader with nothing to read sets a flag in the ring and waits on a
+doorbell, an eventfd or a pipe. writers ring it once per batch of records
+and only when the flag is set, so a busy reader is never woken.
+
+records hold a pickled batch of messages. bytearrays of OUT_OF_BAND bytes or
+more, in messages made of dicts, lists and tuples, skip the pickle stream
+(pickle protocol 5 out-of-band buffers): they are copied from the sender's
+memory straight into the ring and from the ring into the receiver's
+bytearray. a batch is walked once for them and pickled once, it is only
+copied when it has some. a bytearray mustn't change after it is sent.
+"""
+import asyncio
+import collections
+import logging
+import os
+import pickle
+import struct
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["RingBuffer", "Doorbell", "ShmChannel", "channel_pair"]
+
+# write and read positions on their own cache lines
+HEAD, TAIL, WAITING = 0, 64, 128
+HEADER_SIZE = 192
+COUNTER = struct.Struct("<Q")
+# record size, pickle size, number of out of band buffers
+RECORD = struct.Struct("<III")
+LENGTH = struct.Struct("<I")
+# record size of the padding up to the end of the ring
+WRAP = 0xFFFFFFFF
+ALIGN = 8
+
+DEFAULT_CAPACITY = 8 << 20
+OUT_OF_BAND = 64 << 10
+# pause senders while this many bytes wait for room in the ring
+HIGH_WATER = 4 << 20
+# seconds between attempts to write to a full ring
+RETRY_DELAY = 0.0005
+
+
+# types out_of_band looks into
+NESTED = frozenset((bytearray, dict, list, tuple))
+
+
+def out_of_band(value):
+    """\
+    :return: value with the large bytearrays in it wrapped in a PickleBuffer,
+        pickle doesn't take bytearrays out of band on its own. value itself
+        when there are none
+    """
+    kind = type(value)
+    if kind is bytearray:
+        return pickle.PickleBuffer(value) if len(value) >= OUT_OF_BAND else value
+    if kind is dict:
+        for item in value.values():
+            if type(item) in NESTED and out_of_band(item) is not item:
+                return {key: out_of_band(item) for key, item in value.items()}
+        return value
+    if kind is list or kind is tuple:
+        for item in value:
+            if type(item) in NESTED and out_of_band(item) is not item:
+                return kind(out_of_band(item) for item in value)
+        return value
+    return value
+
+
+def dumps(obj):
+    """\
+    :return: the pickle of obj, its out of band buffers
+    """
+    buffers = []
+    data = pickle.dumps(out_of_band(obj), protocol=5, buffer_callback=buffers.append)
+    return data, [buffer.raw() for buffer in buffers]
+
+
+def record_size(data, buffers):
+    size = RECORD.size + LENGTH.size * len(buffers) + len(data)
+    size += sum(buffer.nbytes for buffer in buffers)
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+class RingBuffer:
+    """\
+    records written by one process and read by one other
+
+    :param capacity: bytes for records, a multiple of 8
+    :param name: attach to the segment of this name instead of creating one
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, name=None):
+        if capacity % ALIGN:
+            raise ValueError(f"capacity must be a multiple of {ALIGN}")
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.capacity = capacity
+        # records larger than this would wait for an empty ring
+        self.max_record = capacity // 2
+        self.buf = self.shm.buf
+        self.data = self.buf[HEADER_SIZE:HEADER_SIZE + capacity]
+
+    def __reduce__(self):
+        # processes that aren't forked attach by name
+        return RingBuffer, (self.capacity, self.shm.name)
+
+    def empty(self):
+        return COUNTER.unpack_from(self.buf, HEAD)[0] == COUNTER.unpack_from(self.buf, TAIL)[0]
+
+    def waiting(self):
+        return self.buf[WAITING] == 1
+
+    def set_waiting(self, waiting):
+        self.buf[WAITING] = 1 if waiting else 0
+
+    def write(self, data, buffers=()):
+        """\
+        :param data: pickled record
+        :param buffers: out of band buffers of the pickle
+        :return: False when there is no room for the record now
+        """
+        size = record_size(data, buffers)
+        if size > self.max_record:
+            raise ValueError(f"record of {size} bytes is larger than {self.max_record}")
+        buf, ring, capacity = self.buf, self.data, self.capacity
+        head = COUNTER.unpack_from(buf, HEAD)[0]
+        tail = COUNTER.unpack_from(buf, TAIL)[0]
+        pos = head % capacity
+        # records don't wrap around, the rest of the ring is skipped instead
+        pad = capacity - pos if pos + size > capacity else 0
+        if capacity - (head - tail) < pad + size:
+            return False
+        if pad:
+            LENGTH.pack_into(ring, pos, WRAP)
+            head += pad
+            pos = 0
+
+        RECORD.pack_into(ring, pos, size, len(data), len(buffers))
+        offset = pos + RECORD.size
+        for buffer in buffers:
+            LENGTH.pack_into(ring, offset, buffer.nbytes)
+            offset += LENGTH.size
+        ring[offset:offset + len(data)] = data
+        offset += len(data)
+        for buffer in buffers:
+            ring[offset:offset + buffer.nbytes] = buffer
+            offset += buffer.nbytes
+        # the record is complete before the reader can see it
+        COUNTER.pack_into(buf, HEAD, head + size)
+        return True
+
+    def read(self):
+        """\
+        :return: the next record unpickled, None when the ring is empty
+        """
+        buf, ring, capacity = self.buf, self.data, self.capacity
+        head = COUNTER.unpack_from(buf, HEAD)[0]
+        tail = COUNTER.unpack_from(buf, TAIL)[0]
+        if head == tail:
+            return None
+        pos = tail % capacity
+        if LENGTH.unpack_from(ring, pos)[0] == WRAP:
+            tail += capacity - pos
+            pos = 0
+            if head == tail:
+                COUNTER.pack_into(buf, TAIL, tail)
+                return None
+
+        size, data_size, count = RECORD.unpack_from(ring, pos)
+        offset = pos + RECORD.size
+        lengths = struct.unpack_from(f"<{count}I", ring, offset)
+        offset += LENGTH.size * count
+        data = ring[offset:offset + data_size]
+        offset += data_size
+        buffers = []
+        for length in lengths:
+            # copied out, the ring is written over once the tail moves
+            buffers.append(bytearray(ring[offset:offset + length]))
+            offset += length
+        try:
+            return pickle.loads(data, buffers=buffers)
+        finally:
+            data.release()
+            COUNTER.pack_into(buf, TAIL, tail + size)
+
+    def close(self):
+        if self.buf is None:
+            return
+        self.data.release()
+        self.buf = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Doorbell:
+    """\
+    wakes the reader of a ring, an eventfd where there is one, a pipe otherwise
+    """
+
+    def __init__(self):
+        if hasattr(os, "eventfd"):
+            self.read_fd = self.write_fd = os.eventfd(0, os.EFD_NONBLOCK)
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+
+    def fileno(self):
+        return self.read_fd
+
+    def ring(self):
+        try:
+            if self.read_fd == self.write_fd:
+                os.eventfd_write(self.write_fd, 1)
+            else:
+                os.write(self.write_fd, b"\0")
+        except BlockingIOError:
+            # rung enough already
+            pass
+
+    def drain(self):
+        try:
+            if self.read_fd == self.write_fd:
+                os.eventfd_read(self.read_fd)
+            else:
+                while os.read(self.read_fd, 4096):
+                    pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        if self.read_fd is None:
+            return
+        os.close(self.read_fd)
+        if self.write_fd != self.read_fd:
+            os.close(self.write_fd)
+        self.read_fd = self.write_fd = None
+
+
+class ShmChannel:
+    """\
+    one end of a pair of rings between two processes
+
+    :param send: the ring this end writes to
+    :param send_bell: the doorbell of its reader
+    :param receive: the ring this end reads from
+    :param receive_bell: the doorbell this end waits on
+    """
+
+    def __init__(self, send, send_bell, receive, receive_bell):
+        self.send = send
+        self.send_bell = send_bell
+        self.receive = receive
+        self.receive_bell = receive_bell
+        # (pickle, out of band buffers, size) waiting for room in the ring
+        self.records = collections.deque()
+        self.pending = 0
+        self.retry = None
+        self.readable = None
+        self.writable = None
+        self.reader_fd = None
+        self.loop = None
+
+    def open(self):
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.loop = asyncio.get_event_loop()
+        self.reader_fd = self.receive_bell.fileno()
+        self.loop.add_reader(self.reader_fd, self.rung)
+
+    def rung(self):
+        self.receive_bell.drain()
+        self.readable.set()
+
+    def put(self, batch):
+        """\
+        write a list of messages to the other end
+        """
+        self.write(self.encode(batch))
+
+    def encode(self, batch):
+        """\
+        :return: records of the batch, more than one when it doesn't fit in
+            the ring at once
+        """
+        data, buffers = dumps(batch)
+        size = record_size(data, buffers)
+        if size > self.send.max_record:
+            if len(batch) == 1:
+                raise ValueError(f"message of {size} bytes doesn't fit in the ring")
+            half = len(batch) // 2
+            return self.encode(batch[:half]) + self.encode(batch[half:])
+        return [(data, buffers, size)]
+
+    def write(self, records):
+        """\
+        write records made by encode
+        """
+        for record in records:
+            self.records.append(record)
+            self.pending += record[2]
+        self.write_records()
+
+    def write_records(self):
+        records = self.records
+        written = False
+        while records:
+            data, buffers, size = records[0]
+            if not self.send.write(data, buffers):
+                break
+            records.popleft()
+            self.pending -= size
+            written = True
+        if written and self.send.waiting():
+            self.send_bell.ring()
+
+        if self.pending <= HIGH_WATER:
+            self.writable.set()
+        else:
+            self.writable.clear()
+        if records and self.retry is None:
+            # the ring is full, try again once the reader made room
+            self.retry = self.loop.call_later(RETRY_DELAY, self.retry_write)
+
+    def retry_write(self):
+        self.retry = None
+        self.write_records()
+
+    async def wait_writable(self):
+        await self.writable.wait()
+
+    async def get(self):
+        """\
+        :return: the next list of messages from the other end
+        """
+        ring = self.receive
+        while True:
+            batch = ring.read()
+            if batch is not None:
+                return batch
+            self.readable.clear()
+            ring.set_waiting(True)
+            # a writer that didn't see the flag yet doesn't ring
+            if ring.empty():
+                await self.readable.wait()
+            ring.set_waiting(False)
+
+    def close(self):
+        if self.retry is not None:
+            self.retry.cancel()
+        if self.readable is not None:
+            self.loop.remove_reader(self.reader_fd)
+        self.send.close()
+        self.receive.close()
+        self.send_bell.close()
+        self.receive_bell.close()
+
+    def unlink(self):
+        self.send.unlink()
+        self.receive.unlink()
+
+
+def channel_pair(capacity=DEFAULT_CAPACITY):
+    """\
+    :return: the two ends of a new channel
+    """
+    forward, backward = RingBuffer(capacity), RingBuffer(capacity)
+    forward_bell, backward_bell = Doorbell(), Doorbell()
+    return (
+        ShmChannel(forward, forward_bell, backward, backward_bell),
+        ShmChannel(backward, backward_bell, forward, forward_bell),
+    )
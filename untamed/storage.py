@@ -0,0 +1,190 @@
+"""\
+local file storage for actor states
+
+an append-only log of records with an in-memory index of where the live
+values are. a write appends a record, a read is one pread. the log is
+compacted by rewriting the live records once most of it is garbage.
+
+record layout, little endian:
+
+    crc32 of the rest (4) | op (1) | key length (4) | field length (4) |
+    value length (4) | key | field | value
+
+"""
+import mmap
+import os
+import struct
+import zlib
+
+__all__ = ["LogStore"]
+
+HEADER = struct.Struct("<IBIII")
+
+OP_HSET = 1
+OP_HDEL = 2
+# deletes the whole key
+OP_DEL = 3
+
+
+def encode_record(op, key, field=b"", value=b""):
+    record = HEADER.pack(0, op, len(key), len(field), len(value))[4:] + key + field + value
+    return struct.pack("<I", zlib.crc32(record)) + record
+
+
+class LogStore:
+    """\
+    hashes of bytes fields to bytes values, kept in an append-only log
+
+    :param path: file of the log, created if it doesn't exist
+    :param sync: fsync on every flush, otherwise a crash of the machine
+        (not of the process) can lose the last flushed writes
+    :param compact_ratio: compact when garbage is more than this part of the log
+    :param compact_min_size: don't compact logs smaller than this many bytes
+    """
+
+    def __init__(self, path, sync=False, compact_ratio=0.5, compact_min_size=1 << 20):
+        self.path = path
+        self.sync = sync
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        # key -> {field: (offset of the value, length of the value, record size)}
+        self.index = {}
+        self.size = 0
+        # bytes of records that were overwritten or deleted
+        self.garbage = 0
+        self.buffer = []
+        self.file = None
+        self.open()
+
+    def open(self):
+        self.index = {}
+        self.garbage = 0
+        self.file = open(self.path, "a+b")
+        self.size = self.recover()
+
+    def recover(self):
+        """\
+        rebuild the index from the log, a torn record at the end (the process
+        died while writing it) is cut off
+        """
+        self.file.seek(0, os.SEEK_END)
+        if not self.file.tell():
+            return 0
+
+        data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            crc, op, key_len, field_len, value_len = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + key_len + field_len + value_len
+            if end > len(data):
+                break
+            if zlib.crc32(memoryview(data)[offset + 4:end]) != crc:
+                break
+
+            start = offset + HEADER.size
+            key = data[start:start + key_len]
+            field = data[start + key_len:start + key_len + field_len]
+            self.apply(op, key, field, end - value_len, value_len, end - offset)
+            offset = end
+
+        size = len(data)
+        data.close()
+        if offset != size:
+            self.file.truncate(offset)
+        return offset
+
+    def apply(self, op, key, field, value_offset, value_len, record_size):
+        if op == OP_HSET:
+            fields = self.index.setdefault(key, {})
+            previous = fields.get(field)
+            if previous:
+                self.garbage += previous[2]
+            fields[field] = (value_offset, value_len, record_size)
+            return
+
+        # deletes are garbage as soon as they are applied
+        self.garbage += record_size
+        if op == OP_HDEL:
+            fields = self.index.get(key)
+            if fields and field in fields:
+                self.garbage += fields.pop(field)[2]
+                if not fields:
+                    del self.index[key]
+        elif op == OP_DEL:
+            for previous in self.index.pop(key, {}).values():
+                self.garbage += previous[2]
+
+    def append(self, op, key, field=b"", value=b""):
+        record = encode_record(op, key, field, value)
+        self.buffer.append(record)
+        value_offset = self.size + len(record) - len(value)
+        self.size += len(record)
+        self.apply(op, key, field, value_offset, len(value), len(record))
+
+    def hset(self, key: bytes, mapping: dict):
+        for field, value in mapping.items():
+            self.append(OP_HSET, key, field, value)
+
+    def hdel(self, key: bytes, fields):
+        for field in fields:
+            if field in self.index.get(key, ()):
+                self.append(OP_HDEL, key, field)
+
+    def delete(self, key: bytes):
+        if key in self.index:
+            self.append(OP_DEL, key)
+
+    def hgetall(self, key: bytes) -> dict:
+        fields = self.index.get(key)
+        if not fields:
+            return {}
+        self.flush()
+        fd = self.file.fileno()
+        return {
+            field: os.pread(fd, length, offset)
+            for field, (offset, length, _) in fields.items()
+        }
+
+    def keys(self):
+        return self.index.keys()
+
+    def flush(self):
+        """\
+        write the buffered records to the file
+        """
+        if not self.buffer:
+            return
+        self.file.write(b"".join(self.buffer))
+        self.buffer = []
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def needs_compaction(self):
+        return (
+            self.size >= self.compact_min_size
+            and self.garbage > self.size * self.compact_ratio
+        )
+
+    def compact(self):
+        """\
+        rewrite the live records to a new log and switch to it
+        """
+        self.flush()
+        tmp_path = f"{self.path}.compact"
+        with open(tmp_path, "wb") as out:
+            for key in self.index:
+                for field, value in self.hgetall(key).items():
+                    out.write(encode_record(OP_HSET, key, field, value))
+            out.flush()
+            os.fsync(out.fileno())
+
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.open()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
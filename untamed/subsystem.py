@@ -1,13 +1,20 @@
 import asyncio
+import collections
 import functools
+import heapq
 import importlib
+import itertools
 import os
 import pickle
 import random
+import re
 import logging
+import signal
+import struct
 import sys
 import time
 import uuid
+from collections import OrderedDict
 from typing import Union
 
 import click
@@ -16,17 +23,448 @@ from multiprocessing import Process
 import aioredis
 from watchdog.events import FileSystemEventHandler, DirModifiedEvent
 
-logging.basicConfig(level=logging.DEBUG)
+from . import codec
+from .directory import Directory
+from .storage import LogStore
+from .metrics import Metrics, metered_class
+from .sharding import RemoteActor, Shard, shard_channels, shard_sockets
+from .tracing import traced_class, untraced_class
+from .transport import Transport, remote_error
+
 logger = logging.getLogger(__name__)
 
 
+# what a full mailbox does with a new message
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+
+# messages World.tell_nowait holds for an actor being looked up in the
+# directory, more raise MailboxFull
+LOOKUP_BACKLOG = 10_000
+
+
+@remote_error
+class AskTimeout(asyncio.TimeoutError):
+    """\
+    no reply to World.tell_and_get within its timeout
+    """
+
+
+class MailboxFull(asyncio.QueueFull):
+    pass
+
+
+@remote_error
+class ActorNotFound(KeyError):
+    """\
+    no actor of that name here, and none registered on another node
+    """
+
+
+class Mailbox:
+    """\
+    message queue of an actor, a small single consumer asyncio.Queue
+
+    it only holds a buffer while there are messages in it, so an idle
+    actor doesn't pay for it. when the actor runs on a dispatcher a message
+    arriving in an idle mailbox schedules the actor.
+
+    with a `maxsize` a full mailbox applies its `overflow` policy, it blocks
+    the sender, drops the new or the oldest message or spills the messages
+    to a MailboxSpill until the actor catches up.
+    """
+
+    __slots__ = (
+        "items",
+        "maxsize",
+        "overflow",
+        "dropped",
+        "spill",
+        "getter",
+        "putters",
+        "actor",
+        "dispatcher",
+        "scheduled",
+    )
+
+    def __init__(self, maxsize=0, overflow=OVERFLOW_BLOCK, spill=None):
+        self.items = None
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.spill = spill
+        self.getter = None
+        self.putters = None
+        self.actor = None
+        self.dispatcher = None
+        self.scheduled = False
+
+    def qsize(self):
+        return len(self.items) if self.items else 0
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return 0 < self.maxsize <= self.qsize()
+
+    def attach(self, actor, dispatcher):
+        self.actor = actor
+        self.dispatcher = dispatcher
+        if not self.empty():
+            self.scheduled = True
+            dispatcher.schedule(actor)
+
+    def detach(self):
+        self.actor = None
+        self.dispatcher = None
+
+    def put_nowait(self, item):
+        """\
+        :return: False when the message was dropped
+        :raises MailboxFull: when the mailbox is full and blocks senders
+        """
+        if self.spill is not None and (self.spill.size or self.full()):
+            # keep the order, once we spilled everything goes to the spill
+            self.spill.push(item)
+            return True
+
+        if self.maxsize and self.full():
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                self.drop_oldest()
+            else:
+                raise MailboxFull()
+
+        self.put_control(item)
+        return True
+
+    def drop_oldest(self):
+        # signals and replies the actor waits for are never dropped
+        items = self.items
+        for i, item in enumerate(items):
+            if not is_control(item):
+                del items[i]
+                self.dropped += 1
+                return
+
+    def put_control(self, item, first=False):
+        """\
+        put an item regardless of the capacity, for stop/suspend signals
+        and replies the actor is waiting for
+
+        :param first: put it before the queued items
+        """
+        if self.items is None:
+            self.items = collections.deque()
+        if first:
+            self.items.appendleft(item)
+        else:
+            self.items.append(item)
+
+        getter = self.getter
+        if getter is not None and not getter.done():
+            getter.set_result(None)
+        if self.dispatcher is not None and not self.scheduled:
+            self.scheduled = True
+            self.dispatcher.schedule(self.actor)
+
+    async def put(self, item):
+        while self.overflow == OVERFLOW_BLOCK and self.full():
+            if self.putters is None:
+                self.putters = collections.deque()
+            putter = asyncio.get_running_loop().create_future()
+            self.putters.append(putter)
+            try:
+                await putter
+            except BaseException:
+                putter.cancel()
+                if putter in self.putters:
+                    self.putters.remove(putter)
+                if not self.full():
+                    self.wakeup_putter()
+                raise
+        return self.put_nowait(item)
+
+    def get_nowait(self):
+        if not self.items:
+            raise asyncio.QueueEmpty
+        item = self.items.popleft()
+        if not self.items:
+            # give the buffer back, most actors stay idle for a long time
+            self.items = None
+        if self.putters:
+            self.wakeup_putter()
+        if self.spill is not None and self.spill.size:
+            self.spill.refill()
+        return item
+
+    def get_batch(self, limit):
+        """\
+        take up to `limit` items without waiting
+        """
+        items = self.items
+        if not items:
+            return []
+        if len(items) <= limit:
+            batch = list(items)
+            self.items = None
+        else:
+            popleft = items.popleft
+            batch = [popleft() for _ in range(limit)]
+        for _ in range(len(batch)):
+            if not self.putters:
+                break
+            self.wakeup_putter()
+        if self.spill is not None and self.spill.size:
+            self.spill.refill()
+        return batch
+
+    async def get(self):
+        while not self.items:
+            if self.spill is not None and self.spill.size:
+                self.spill.refill()
+            self.getter = asyncio.get_running_loop().create_future()
+            try:
+                await self.getter
+            finally:
+                self.getter = None
+        return self.get_nowait()
+
+    def wakeup_putter(self):
+        while self.putters:
+            putter = self.putters.popleft()
+            if not putter.done():
+                putter.set_result(None)
+                return
+
+
+class MailboxSpill:
+    """\
+    overflow of a mailbox kept in a spill store (eg. redis)
+
+    messages are pushed to the store in batches, when the mailbox has
+    room again they are pulled back in the same order.
+    """
+
+    def __init__(self, mailbox, store, key):
+        self.mailbox = mailbox
+        self.store = store
+        self.key = key
+        # not yet written to the store
+        self.pending = collections.deque()
+        self.in_flight = 0
+        self.stored = 0
+        # leftovers of a previous process are dropped on the first flush
+        self.cleared = False
+        self.lock = asyncio.Lock()
+        self.flush_task = None
+        self.refill_task = None
+
+    @property
+    def size(self):
+        return len(self.pending) + self.in_flight + self.stored
+
+    def push(self, item):
+        self.pending.append(item)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush())
+
+    def refill(self):
+        if self.refill_task is None:
+            self.refill_task = asyncio.ensure_future(self.pull())
+
+    async def flush(self):
+        try:
+            async with self.lock:
+                if not self.cleared:
+                    await self.store.clear(self.key)
+                    self.cleared = True
+                while self.pending:
+                    batch = list(self.pending)
+                    self.pending.clear()
+                    self.in_flight = len(batch)
+                    try:
+                        await self.store.push(self.key, [pickle.dumps(i) for i in batch])
+                    except BaseException:
+                        # kept here, pulled back from pending or written
+                        # by the next flush
+                        self.pending.extendleft(reversed(batch))
+                        raise
+                    finally:
+                        self.in_flight = 0
+                    self.stored += len(batch)
+        except Exception:
+            logger.exception(f"couldn't spill messages of {self.key}")
+        finally:
+            self.flush_task = None
+
+    async def pull(self):
+        mailbox = self.mailbox
+        try:
+            async with self.lock:
+                while self.size:
+                    room = mailbox.maxsize - mailbox.qsize()
+                    if room <= 0:
+                        break
+                    if self.stored:
+                        items = await self.store.pop(self.key, room)
+                        items = [pickle.loads(i) for i in items]
+                        if not items:
+                            logger.error(f"spilled messages of {self.key} are missing from the store")
+                            self.stored = 0
+                            continue
+                        self.stored -= len(items)
+                    else:
+                        n = min(room, len(self.pending))
+                        items = [self.pending.popleft() for _ in range(n)]
+                    if not items:
+                        break
+                    for item in items:
+                        mailbox.put_control(item)
+        except Exception:
+            logger.exception(f"couldn't read back spilled messages of {self.key}")
+        finally:
+            self.refill_task = None
+
+
+class RedisSpillStore:
+    """\
+    keeps spilled messages in redis lists
+    """
+
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self.redis = None
+        self.connecting = None
+
+    async def connect(self):
+        if self.redis is None:
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(
+                    aioredis.create_redis_pool(self.redis_url)
+                )
+            self.redis = await self.connecting
+        return self.redis
+
+    async def push(self, key, values):
+        redis = await self.connect()
+        await redis.rpush(key, *values)
+
+    async def pop(self, key, count):
+        redis = await self.connect()
+        tr = redis.multi_exec()
+        values = tr.lrange(key, 0, count - 1)
+        tr.ltrim(key, count, -1)
+        await tr.execute()
+        return await values
+
+    async def clear(self, key):
+        redis = await self.connect()
+        await redis.delete(key)
+
+    async def close(self):
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
+            self.redis = None
+            self.connecting = None
+
+
+class Dispatcher:
+    """\
+    runs actors on a fixed set of worker coroutines
+
+    actors with pending messages wait in a run queue, a worker takes one,
+    handles at most `throughput` messages and puts it back at the end of the
+    run queue if it still has messages, so a busy actor can't starve the others.
+    idle actors don't cost a task.
+    """
+
+    def __init__(self, workers=8, throughput=10):
+        self.workers = workers
+        self.throughput = throughput
+        self.run_queue = asyncio.Queue()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self.work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def schedule(self, actor):
+        self.run_queue.put_nowait(actor)
+
+    async def work(self):
+        run_queue = self.run_queue
+        while True:
+            actor = await run_queue.get()
+            mailbox = actor.queue
+            try:
+                running = await actor.process_batch(mailbox.get_batch(self.throughput))
+            except Exception:
+                # eg. raised by on_stop, the worker serves the other actors
+                logger.exception(f"Exception on running {actor.name}, dropping it")
+                actor.world.failed(actor)
+                running = False
+            if not running:
+                mailbox.detach()
+            elif mailbox.empty():
+                mailbox.scheduled = False
+            else:
+                run_queue.put_nowait(actor)
+
+
+# commands put in mailboxes with put_control
+CONTROL_COMMANDS = frozenset(
+    ("INTERNAL_STOP", "INTERNAL_SUSPEND", "LOADED_STATE", "LOADED_JOURNAL", "FIRE")
+)
+
+
+def is_stop(item):
+    return item is not None and isinstance(item[0], dict) and item[0].get("cmd") == "INTERNAL_STOP"
+
+
+def is_control(item):
+    return item is None or (isinstance(item[0], dict) and item[0].get("cmd") in CONTROL_COMMANDS)
+
+
 class Actor:
+    # subclasses without __slots__ get a __dict__ and can add any attribute
+    __slots__ = ("name", "queue", "world", "stopping", "__weakref__")
+
+    # pinned actors consume their mailbox in their own task even when
+    # the world runs actors on a dispatcher
+    pinned = False
+    # World.stop stops actors in the order of their phase, so actors other
+    # actors depend on (eg. persistence) stop last
+    stop_phase = 1
+    # with several shard processes the actor runs on the shard its name
+    # hashes to, otherwise every shard runs its own, see sharding
+    sharded = True
+    # messages handled per wakeup before letting other tasks run
+    batch_size = 100
+    # mailbox capacity, 0 for unbounded, and what to do when it's full
+    mailbox_size = 0
+    overflow = OVERFLOW_BLOCK
+    # codec name for the state and messages of this class, None for
+    # the world's codec
+    codec = None
+
     def __init__(self, name, queue, world):
         self.queue = queue
         self.name = name
         self.world = world
         self.stopping = False
-        asyncio.ensure_future(self.loop())
+        if type(self).loop is not Actor.loop:
+            asyncio.ensure_future(self.loop())
 
     async def after_create(self):
         pass
@@ -37,7 +475,18 @@ class Actor:
     async def tell(self, msg, sender=None, msg_id=None):
         if msg_id:
             msg["msg_id"] = msg_id
-        await self.queue.put((msg, sender))
+        return await self.queue.put((msg, sender))
+
+    def tell_nowait(self, msg, sender=None, msg_id=None):
+        """\
+        put a message to the mailbox without a coroutine round trip
+
+        :return: False when a full mailbox dropped the message
+        :raises MailboxFull: when the mailbox is full and blocks senders
+        """
+        if msg_id:
+            msg["msg_id"] = msg_id
+        return self.queue.put_nowait((msg, sender))
 
     async def on_message(self, msg, sender):
         """\
@@ -53,81 +502,196 @@ class Actor:
         pass
 
     async def post_stop(self):
-        await self.world.tell(
-            self.world.self_actor.name, {"cmd": "STOPPED"}, sender=self.name
-        )
+        self.world.stopped(self)
 
     async def pre_message(self, msg, sender):
         return msg, sender
 
     async def consume(self):
+        queue = self.queue
         while True:
             # wait for an item from the producer
             # item is (msg, sender) tuple
-            item = await self.queue.get()
-            logger.info(f"consume {item}")
-            if item is None:
-                # the producer emits None to indicate that it is done
-                # print("breaking - {}".format(self.name))
-                self.stopping = True
-                await self.on_stop()
+            item = await queue.get()
+            # and handle whatever else is waiting in the same wakeup
+            batch = [item]
+            batch.extend(queue.get_batch(self.batch_size - 1))
+            if not await self.process_batch(batch):
                 break
+            if not queue.empty():
+                await asyncio.sleep(0)
 
-            if item and "cmd" in item[0]:
-                if item[0]["cmd"] == "INTERNAL_STOP":
-                    self.stopping = True
-                    await self.on_stop()
-                    await self.post_stop()
-                    return
+    async def process_batch(self, items):
+        """\
+        handle items taken from the mailbox in order
 
-            try:
-                item = await self.pre_message(*item)
-                if item:
-                    await self.on_message(*item)
-            except Exception as e:
-                logger.exception(f"Exception on processing on_message {self.name}")
-                print("-> exception", e, type(e), self, item)
+        :return: False when the actor stopped
+        """
+        for item in items:
+            if not await self.process(item):
+                return False
+            if self.stopping:
+                # stopped without draining, the rest of the batch is dropped
+                break
+        return True
+
+    async def process(self, item):
+        """\
+        handle one item of the mailbox
+
+        :param item: (msg, sender) tuple or None
+        :return: False when the actor stopped
+        """
+        if item is None:
+            # the producer emits None to indicate that it is done
+            # print("breaking - {}".format(self.name))
+            self.stopping = True
+            await self.on_stop()
+            self.world.passivated(self.name)
+            return False
+
+        if is_stop(item):
+            self.stopping = True
+            await self.on_stop()
+            await self.post_stop()
+            return False
+
+        try:
+            item = await self.pre_message(*item)
+            if item:
+                await self.on_message(*item)
+        except Exception as e:
+            logger.exception(f"Exception on processing on_message {self.name}")
+            print("-> exception", e, type(e), self, item)
+        return True
+
+
+# when a SuspendableActor saves its state
+DURABILITY_EVERY_WRITE = "every_write"
+# write-behind, changes are flushed every World.flush_interval seconds or
+# World.flush_count writes, on suspend and on World.stop
+DURABILITY_INTERVAL = "interval"
+# write-behind, changes are flushed on suspend and on World.stop
+DURABILITY_ON_SUSPEND = "on_suspend"
 
 
 class SuspendableActor(Actor):
+    # state is allocated on first use, see __getattr__
+    __slots__ = ("state", "wait_for", "wait_queue", "dirty", "changed")
+
+    durability = DURABILITY_EVERY_WRITE
+
     def __init__(self, name, queue, world):
-        self.state = {}
         self.wait_for = None
-        self.wait_queue = []
+        self.wait_queue = None
+        # state changed since the last save
+        self.dirty = False
+        # top level keys set or deleted since the last save
+        self.changed = None
         super().__init__(name, queue, world)
 
+    def __getattr__(self, name):
+        # only called when the attribute isn't set
+        if name == "state":
+            self.state = {}
+            return self.state
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
     async def set_state(self, new_state: dict):
         self.state.update(new_state)
-        await self.save_state()
+        await self.state_changed(new_state)
 
-    async def save_state(self):
-        await self.world.tell(
-            "persistence", {"cmd": "SAVE_STATE", "data": self.state}, sender=self.name
-        )
+    async def delete_state(self, *keys):
+        for key in keys:
+            self.state.pop(key, None)
+        await self.state_changed(keys)
+
+    async def state_changed(self, keys):
+        if self.changed is None:
+            self.changed = set(keys)
+        else:
+            self.changed.update(keys)
+
+        if self.durability == DURABILITY_EVERY_WRITE:
+            await self.save_state(full=False)
+            return
+
+        self.dirty = True
+        if self.durability == DURABILITY_INTERVAL:
+            self.world.mark_dirty(self)
+
+    async def save_state(self, full=True):
+        """\
+        :param full: save the whole state, otherwise only the keys changed
+            through set_state/delete_state if persistence supports it
+        """
+        msg = {"cmd": "SAVE_STATE", "data": self.state}
+        if not full:
+            msg["changed"] = self.changed or ()
+        self.dirty = False
+        self.changed = None
+        await self.world.tell("persistence", msg, sender=self.name)
+
+    async def post_stop(self):
+        # changes made while draining the mailbox, after World.stop flushed
+        if self.dirty:
+            await self.save_state(full=False)
+        await super().post_stop()
 
     async def after_create(self):
-        # TODO: we need better locking
-        self.wait_for = 'PRELOAD'
+        # hold every message until our state is loaded, if a previous
+        # incarnation of this actor is still being suspended wait until its
+        # final save is queued to persistence so we don't load a stale state
+        self.wait_for = "LOADED_STATE"
+        await self.world.wait_passivated(self)
         await self.load_state()
-        self.wait_for = None
 
     async def load_state(self):
         await self.world.tell("persistence", {"cmd": "LOAD_STATE"}, sender=self.name)
 
+    async def state_loaded(self):
+        """\
+        called when the state is loaded, before the messages received
+        while loading it are handled
+        """
+
+    async def process(self, item):
+        if item is None and self.wait_for:
+            # suspended while loading, close the mailbox after handling
+            # the messages we are holding
+            self.hold(item)
+            return True
+        if self.wait_for and not self.stopping and is_stop(item):
+            # stopped with draining while loading, likewise
+            self.hold(item)
+            return True
+        return await super().process(item)
+
+    def hold(self, item):
+        if self.wait_queue is None:
+            self.wait_queue = []
+        self.wait_queue.append(item)
+
     async def replay_waiting_messages(self):
-        for t in self.wait_queue:
+        waiting, self.wait_queue = self.wait_queue, None
+        for t in waiting or ():
+            if t is None:
+                self.queue.put_control(None)
+                break
+            if is_stop(t):
+                self.queue.put_control(t, first=True)
+                break
             item = await self.pre_message(*t)
             if item:
                 await self.on_message(*item)
 
     async def pre_message(self, msg, sender):
         if self.wait_for:
-            if msg["cmd"] != self.wait_for:
-                logger.info(f"waiting for {self.wait_for} but received {msg}")
-                self.wait_queue.append((msg, sender))
+            if not isinstance(msg, dict) or msg.get("cmd") != self.wait_for:
+                self.hold((msg, sender))
             else:
-                logger.info(f"resolved waiting for {self.wait_for}")
-                asyncio.ensure_future(self.replay_waiting_messages())
                 self.wait_for = None
                 return msg, sender
         else:
@@ -135,19 +699,23 @@ class SuspendableActor(Actor):
 
     async def on_message(self, msg, sender):
         if msg["cmd"] == "INTERNAL_SUSPEND":
-            logger.info("saving state ")
-
-            await self.save_state()
+            await self.save_state(full=False)
             return
 
         if msg["cmd"] == "INTERNAL_RELOAD_STATE":
-            logger.info("re-loading state ")
             await self.load_state()
             self.wait_for = "LOADED_STATE"
             return
 
         if msg["cmd"] == "LOADED_STATE":
-            return await self.set_state(msg["data"])
+            # nothing changed yet, no need to save it back
+            if msg["data"]:
+                self.state.update(msg["data"])
+            await self.state_loaded()
+            # messages that arrived while we were loading are handled in
+            # order, before anything that is still in the mailbox
+            await self.replay_waiting_messages()
+            return
 
         try:
             await self.set_state({"recv": self.state.get("recv", 0) + 1})
@@ -157,21 +725,456 @@ class SuspendableActor(Actor):
         await super().on_message(msg, sender)
 
 
-class RedisPersistence(Actor):
-    async def save(self, key, value):
-        return await self.redis.set(key, pickle.dumps(value))
+class EventSourcedActor(SuspendableActor):
+    """\
+    an actor whose state is built from the events its handlers emit
+
+    emitted events are appended to a journal, durability decides when like
+    for SuspendableActor, every snapshot_every events a snapshot of the
+    state is saved and the journal before it dropped. a revived actor loads
+    the latest snapshot and replays the events after it with apply_event.
+    """
+
+    __slots__ = ("events", "seq", "snapshot_seq")
+
+    # save a snapshot of the state every this many events
+    snapshot_every = 100
+
+    def __init__(self, name, queue, world):
+        # events emitted since the last save
+        self.events = None
+        # number of events applied to the state
+        self.seq = 0
+        self.snapshot_seq = 0
+        super().__init__(name, queue, world)
+
+    def apply_event(self, event):
+        """\
+        change the state for an event, called when it's emitted and when
+        the journal is replayed so it must not have other side effects
+        """
+        self.state.update(event)
+
+    async def emit(self, event):
+        self.apply_event(event)
+        self.seq += 1
+        if self.events is None:
+            self.events = []
+        self.events.append(event)
+
+        if self.durability == DURABILITY_EVERY_WRITE:
+            await self.save_state()
+            return
+
+        self.dirty = True
+        if self.durability == DURABILITY_INTERVAL:
+            self.world.mark_dirty(self)
+
+    async def save_state(self, full=True):
+        events, self.events = self.events or (), None
+        self.dirty = False
+        if not events:
+            return
+
+        msg = {"cmd": "APPEND_EVENTS", "seq": self.seq - len(events), "events": events}
+        if self.seq - self.snapshot_seq >= self.snapshot_every:
+            # encoded now, later changes of the state must not leak into it
+            msg["snapshot"] = self.world.serializer_for(self.name).dumps(
+                {"seq": self.seq, "state": self.state}
+            )
+            self.snapshot_seq = self.seq
+        await self.world.tell("persistence", msg, sender=self.name)
+
+    async def after_create(self):
+        self.wait_for = "LOADED_JOURNAL"
+        await self.world.wait_passivated(self)
+        await self.load_state()
+
+    async def load_state(self):
+        await self.world.tell("persistence", {"cmd": "LOAD_JOURNAL"}, sender=self.name)
+
+    def recover(self, snapshot, events):
+        self.state = {}
+        self.seq = self.snapshot_seq = 0
+        if snapshot:
+            self.state.update(snapshot["state"])
+            self.seq = self.snapshot_seq = snapshot["seq"]
+        for event in events:
+            self.apply_event(event)
+            self.seq += 1
+
+    async def on_message(self, msg, sender):
+        if msg["cmd"] == "INTERNAL_SUSPEND":
+            await self.save_state()
+            return
+
+        if msg["cmd"] == "INTERNAL_RELOAD_STATE":
+            # unsaved events are saved first so the reload sees them
+            await self.save_state()
+            await self.load_state()
+            self.wait_for = "LOADED_JOURNAL"
+            return
+
+        if msg["cmd"] == "LOADED_JOURNAL":
+            self.recover(msg["snapshot"], msg["events"])
+            await self.state_loaded()
+            await self.replay_waiting_messages()
+            return
+
+
+# how RedisPersistence stores states
+# the whole pickled state under state::<name>
+STATE_BLOB = "blob"
+# a hash under hstate::<name> with a field per top level key, so a save
+# only writes the keys that changed
+STATE_HASH = "hash"
+
 
-    async def load(self, key, sender):
-        data = await self.redis.get(key)
-        if data:
-            data = pickle.loads(data)
+def encode_field(key):
+    # str keys are stored as they are, anything else pickled. utf-8 never
+    # starts with 0x80, pickle always does, so they can't be confused
+    if isinstance(key, str):
+        return key.encode()
+    return pickle.dumps(key)
+
+
+def decode_field(field):
+    if field[:1] == b"\x80":
+        return pickle.loads(field)
+    return field.decode()
+
+
+class PersistenceRequests:
+    """\
+    state and journal requests gathered from a batch of messages
+
+    saves and journal appends of the same actor are coalesced
+    """
+
+    __slots__ = ("saves", "loads", "appends", "replays", "loading")
+
+    def __init__(self):
+        # sender -> (state, changed keys or None for everything)
+        self.saves = {}
+        self.loads = []
+        # sender -> [snapshot or None, seq of the first event, events]
+        self.appends = {}
+        self.replays = []
+        self.loading = set()
+
+    def __bool__(self):
+        return bool(self.saves or self.loads or self.appends or self.replays)
+
+    def add_save(self, msg, sender):
+        changed = msg.get("changed")
+        if sender in self.saves:
+            previous = self.saves[sender][1]
+            if changed is None or previous is None:
+                changed = None
+            else:
+                changed = previous.union(changed)
+        elif changed is not None:
+            changed = set(changed)
+        self.saves[sender] = (msg["data"], changed)
+
+    def add_append(self, msg, sender):
+        snapshot = msg.get("snapshot")
+        append = self.appends.get(sender)
+        if snapshot is not None:
+            # the snapshot includes the events before it
+            self.appends[sender] = [snapshot, msg["seq"] + len(msg["events"]), []]
+        elif append is None:
+            self.appends[sender] = [None, msg["seq"], list(msg["events"])]
+        else:
+            append[2].extend(msg["events"])
+
+    def add_load(self, sender, journal=False):
+        if journal:
+            self.replays.append(sender)
         else:
-            data = {}
-        logger.info("loaded data - %s", data)
-        await self.world.tell(sender, {"cmd": "LOADED_STATE", "data": data})
+            self.loads.append(sender)
+        self.loading.add(sender)
+
+
+class Persistence(Actor):
+    """\
+    saves and loads the states of SuspendableActors and the journals of
+    EventSourcedActors
+
+    subclasses implement connect, save_and_load and append_and_replay,
+    requests arriving together are handed to them at once
+    """
+
+    __slots__ = ()
+    pinned = True
+    sharded = False
+    stop_phase = 2
+    # senders wait instead of growing the queue without limit
+    mailbox_size = 10_000
+    # SAVE_STATE and LOAD_STATE requests handled at once
+    batch_size = 1000
+
+    def reply_state(self, sender, data):
+        # a reply must not activate a new incarnation of a suspended actor
+        actor = self.world.reply_target(sender)
+        if actor:
+            actor.queue.put_control(({"cmd": "LOADED_STATE", "data": data}, None))
+
+    def reply_journal(self, sender, snapshot, events):
+        actor = self.world.reply_target(sender)
+        if actor:
+            actor.queue.put_control((
+                {"cmd": "LOADED_JOURNAL", "snapshot": snapshot, "events": events},
+                None,
+            ))
+
+    async def connect(self, target):
+        raise NotImplementedError
 
-    async def connect(self, conn_url):
+    async def save_and_load(self, saves, loads):
+        """\
+        :param saves: {sender: (state, changed keys or None for everything)}
+        :param loads: [sender]
+        """
+        raise NotImplementedError
+
+    async def append_and_replay(self, appends, replays):
+        """\
+        :param appends: {sender: [snapshot or None, seq of the first event, events]},
+            a snapshot replaces the journal before the events
+        :param replays: [sender]
+        """
+        raise NotImplementedError
+
+    async def process_batch(self, items):
+        # consecutive state and journal requests are gathered, anything else
+        # is handled in order after the requests before it are done
+        requests = PersistenceRequests()
+        for item in items:
+            cmd = None
+            if item is not None and isinstance(item[0], dict):
+                cmd = item[0].get("cmd")
+
+            if cmd == "SAVE_STATE" or cmd == "APPEND_EVENTS":
+                msg, sender = item
+                # a load before this save must not see it
+                if sender in requests.loading:
+                    await self.flush_requests(requests)
+                    requests = PersistenceRequests()
+                if cmd == "SAVE_STATE":
+                    requests.add_save(msg, sender)
+                else:
+                    requests.add_append(msg, sender)
+                continue
+
+            if cmd == "LOAD_STATE" or cmd == "LOAD_JOURNAL":
+                requests.add_load(item[1], journal=cmd == "LOAD_JOURNAL")
+                continue
+
+            if requests:
+                await self.flush_requests(requests)
+                requests = PersistenceRequests()
+            if not await self.process(item):
+                return False
+
+        if requests:
+            await self.flush_requests(requests)
+        return True
+
+    async def flush_requests(self, requests):
+        started = time.perf_counter()
+        try:
+            if requests.saves or requests.loads:
+                await self.save_and_load(requests.saves, requests.loads)
+            if requests.appends or requests.replays:
+                await self.append_and_replay(requests.appends, requests.replays)
+            metrics = self.world.metrics
+            if metrics is not None:
+                # a batch with saves and loads is one round trip, it counts for both
+                elapsed = time.perf_counter() - started
+                if requests.saves or requests.appends:
+                    metrics.save_time.record(elapsed)
+                if requests.loads or requests.replays:
+                    metrics.load_time.record(elapsed)
+        except Exception:
+            logger.exception(
+                f"Exception on saving {len(requests.saves)} and loading "
+                f"{len(requests.loads)} states"
+            )
+
+    async def on_message(self, msg, sender):
+        if msg["cmd"] in ("SAVE_STATE", "LOAD_STATE", "APPEND_EVENTS", "LOAD_JOURNAL"):
+            await self.flush_requests(self.gather(msg, sender))
+
+        if msg["cmd"] == "connect":
+            await self.connect(msg["data"])
+
+    def gather(self, msg, sender):
+        requests = PersistenceRequests()
+        if msg["cmd"] == "SAVE_STATE":
+            requests.add_save(msg, sender)
+        elif msg["cmd"] == "APPEND_EVENTS":
+            requests.add_append(msg, sender)
+        else:
+            requests.add_load(sender, journal=msg["cmd"] == "LOAD_JOURNAL")
+        return requests
+
+
+class RedisPersistence(Persistence):
+    __slots__ = ("redis", "state_format")
+
+    def __init__(self, name, queue, world):
+        self.state_format = STATE_BLOB
+        super().__init__(name, queue, world)
+
+    async def save_and_load(self, saves, loads):
+        """\
+        write `saves` and read `loads` pipelined in a single round trip
+        """
+        if self.state_format == STATE_HASH:
+            return await self.save_and_load_hashes(saves, loads)
+
+        pipe = self.redis.pipeline()
+        if saves:
+            pairs = []
+            for sender, (state, _) in saves.items():
+                pairs.append(f"state::{sender}")
+                pairs.append(self.world.serializer_for(sender).dumps(state))
+            pipe.mset(*pairs)
+        if loads:
+            values = pipe.mget(*[f"state::{sender}" for sender in loads])
+        await pipe.execute()
+
+        if loads:
+            for sender, data in zip(loads, await values):
+                self.reply_state(sender, codec.loads(data) if data else {})
+
+    async def save_and_load_hashes(self, saves, loads):
+        # all or nothing, a full save deletes the hash before writing it again
+        pipe = self.redis.multi_exec()
+        for sender, (state, changed) in saves.items():
+            key = f"hstate::{sender}"
+            dumps = self.world.serializer_for(sender).dumps
+            if changed is None:
+                pipe.delete(key)
+                changed = state.keys()
+
+            pairs = []
+            deleted = []
+            for field in changed:
+                if field in state:
+                    pairs.append(encode_field(field))
+                    pairs.append(dumps(state[field]))
+                else:
+                    deleted.append(encode_field(field))
+            if pairs:
+                pipe.hmset(key, *pairs)
+            if deleted:
+                pipe.hdel(key, *deleted)
+
+        values = [pipe.hgetall(f"hstate::{sender}") for sender in loads]
+        await pipe.execute()
+
+        missing = []
+        for sender, fields in zip(loads, values):
+            fields = await fields
+            if not fields:
+                missing.append(sender)
+                continue
+            data = {decode_field(k): codec.loads(v) for k, v in fields.items()}
+            self.reply_state(sender, data)
+
+        if missing:
+            await self.migrate_and_load(missing)
+
+    async def append_and_replay(self, appends, replays):
+        """\
+        journals are lists under journal::<name>, snapshots are kept under
+        snapshot::<name>, a snapshot drops the journal before it
+        """
+        # all or nothing, a snapshot saved without its journal dropped would
+        # have the events before it replayed on top of it
+        pipe = self.redis.multi_exec()
+        for sender, (snapshot, _, events) in appends.items():
+            key = f"journal::{sender}"
+            if snapshot is not None:
+                pipe.set(f"snapshot::{sender}", snapshot)
+                pipe.delete(key)
+            if events:
+                dumps = self.world.serializer_for(sender).dumps
+                pipe.rpush(key, *[dumps(event) for event in events])
+
+        values = [
+            (pipe.get(f"snapshot::{sender}"), pipe.lrange(f"journal::{sender}", 0, -1))
+            for sender in replays
+        ]
+        await pipe.execute()
+
+        for sender, (snapshot, events) in zip(replays, values):
+            snapshot = await snapshot
+            self.reply_journal(
+                sender,
+                codec.loads(snapshot) if snapshot else None,
+                [codec.loads(event) for event in await events],
+            )
+
+    async def migrate_and_load(self, senders):
+        """\
+        load the states that are still stored as a pickled blob and
+        convert them to hashes
+        """
+        values = await self.redis.mget(*[f"state::{sender}" for sender in senders])
+        pipe = self.redis.multi_exec()
+        for sender, data in zip(senders, values):
+            data = codec.loads(data) if data else {}
+            self.reply_state(sender, data)
+            if data:
+                self.write_hash(pipe, sender, data)
+        await pipe.execute()
+
+    def write_hash(self, pipe, sender, state):
+        """\
+        queue the conversion of a blob to a hash on a multi_exec, so the blob
+        is only deleted along with writing the hash
+        """
+        dumps = self.world.serializer_for(sender).dumps
+        pairs = []
+        for field, value in state.items():
+            pairs.append(encode_field(field))
+            pairs.append(dumps(value))
+        if pairs:
+            pipe.hmset(f"hstate::{sender}", *pairs)
+        pipe.delete(f"state::{sender}")
+
+    async def migrate_blob_states(self, count=1000):
+        """\
+        convert every pickled state::<name> key to a hstate::<name> hash
+        """
+        migrated = 0
+        keys = []
+        async for key in self.redis.iscan(match="state::*", count=count):
+            keys.append(key)
+            if len(keys) >= count:
+                migrated += await self.migrate_keys(keys)
+                keys = []
+        if keys:
+            migrated += await self.migrate_keys(keys)
+        logger.info(f"migrated {migrated} states to hashes")
+        return migrated
+
+    async def migrate_keys(self, keys):
+        values = await self.redis.mget(*keys)
+        pipe = self.redis.multi_exec()
+        for key, data in zip(keys, values):
+            if data:
+                sender = key.decode()[len("state::"):]
+                self.write_hash(pipe, sender, codec.loads(data))
+        await pipe.execute()
+        return len(keys)
+
+    async def connect(self, conn_url, state_format=STATE_BLOB):
         self.redis = await aioredis.create_redis_pool(conn_url)
+        self.state_format = state_format
         await self.redis.ping()
 
     async def on_stop(self):
@@ -179,76 +1182,745 @@ class RedisPersistence(Actor):
         await self.redis.wait_closed()
 
     async def on_message(self, msg, sender):
-        # logger.info("PERSISTENCE - got message on persistence %s %s", msg, sender)
         if msg["cmd"] == "connect":
-            await self.connect(msg["data"])
+            await self.connect(msg["data"], msg.get("state_format", STATE_BLOB))
+            return
 
-        if msg["cmd"] == "SAVE_STATE":
-            await self.save(f"state::{sender}", msg["data"])
+        if msg["cmd"] == "MIGRATE_STATES":
+            await self.migrate_blob_states()
+            return
 
-        if msg["cmd"] == "LOAD_STATE":
-            logger.info("load sate !")
-            await self.load(f"state::{sender}", sender)
+        await super().on_message(msg, sender)
 
     def __del__(self):
         print("delete !")
 
 
+# big endian so the fields sort in the order of the events
+EVENT_SEQ = struct.Struct(">Q")
+
+
+class LocalPersistence(Persistence):
+    """\
+    keeps the states in a LogStore file, no redis needed
+
+    like STATE_HASH every top level key of a state is a field of its own, so
+    a save only appends the keys that changed. the log is compacted when
+    most of it is overwritten records.
+    """
+
+    __slots__ = ("store",)
+
+    def __init__(self, name, queue, world):
+        self.store = None
+        super().__init__(name, queue, world)
+
+    async def connect(self, path):
+        self.store = LogStore(path)
+
+    async def save_and_load(self, saves, loads):
+        store = self.store
+        for sender, (state, changed) in saves.items():
+            key = f"hstate::{sender}".encode()
+            dumps = self.world.serializer_for(sender).dumps
+            if changed is None:
+                store.delete(key)
+                changed = state.keys()
+
+            store.hset(key, {
+                encode_field(field): dumps(state[field])
+                for field in changed if field in state
+            })
+            store.hdel(key, [encode_field(field) for field in changed if field not in state])
+
+        # one write for the whole batch
+        store.flush()
+        for sender in loads:
+            fields = store.hgetall(f"hstate::{sender}".encode())
+            self.reply_state(
+                sender, {decode_field(k): codec.loads(v) for k, v in fields.items()}
+            )
+
+        if saves and store.needs_compaction():
+            store.compact()
+
+    async def append_and_replay(self, appends, replays):
+        # events are fields of journal::<name> named by their sequence number
+        store = self.store
+        for sender, (snapshot, seq, events) in appends.items():
+            key = f"journal::{sender}".encode()
+            if snapshot is not None:
+                store.hset(f"snapshot::{sender}".encode(), {b"": snapshot})
+                store.delete(key)
+            if events:
+                dumps = self.world.serializer_for(sender).dumps
+                store.hset(key, {
+                    EVENT_SEQ.pack(seq + i): dumps(event)
+                    for i, event in enumerate(events)
+                })
+
+        store.flush()
+        for sender in replays:
+            snapshot = store.hgetall(f"snapshot::{sender}".encode()).get(b"")
+            events = store.hgetall(f"journal::{sender}".encode())
+            self.reply_journal(
+                sender,
+                codec.loads(snapshot) if snapshot else None,
+                [codec.loads(events[seq]) for seq in sorted(events)],
+            )
+
+        if appends and store.needs_compaction():
+            store.compact()
+
+    async def on_stop(self):
+        if self.store is not None:
+            self.store.close()
+
+
 class WorldActor(Actor):
+    __slots__ = ()
+    pinned = True
+    sharded = False
+
     async def on_message(self, msg, sender):
         try:
             await super().on_message(msg, sender)
-            logger.info("msg world actor %s", msg)
             if "reply_to" in msg:
-                await self.world.got_reply(msg)
+                self.world.resolve_reply(msg)
+
+            if msg.get("cmd", None) == "STOPPED" and sender in self.world.actors:
+                self.world.stopped(self.world.actors[sender])
 
-            if msg.get("cmd", None) == "STOPPED":
-                logger.info(f"received STOPPED {sender}")
-                if sender in self.world.wait_stop:
-                    self.world.wait_stop.remove(sender)
-                    del self.world.actors[sender]
+            if msg.get("cmd", None) == "PING" and "msg_id" in msg:
+                # health checks and untamed-bench
+                await self.world.tell(sender, {"reply_to": msg["msg_id"], "cmd": "PONG"})
 
         except Exception as e:
             logger.exception("exception on world actor")
             print("-> exc world actor", e, type(e))
 
 
+class MetricsActor(Actor):
+    """\
+    replies to {"cmd": "stats"} with World.stats and to {"cmd": "prometheus"}
+    with the same in the prometheus text format
+    """
+
+    __slots__ = ()
+    pinned = True
+    sharded = False
+
+    async def on_message(self, msg, sender):
+        metrics = self.world.metrics
+        if msg.get("cmd") == "stats":
+            data = self.world.stats()
+        elif msg.get("cmd") == "prometheus":
+            data = metrics.prometheus(self.world) if metrics else ""
+        else:
+            return
+        if msg.get("msg_id"):
+            await self.world.tell(sender, {"reply_to": msg["msg_id"], "data": data})
+
+
 class TaskScheduler(SuspendableActor):
+    """\
+    delivers messages to actors at a given time
+
+    schedule with {"cmd": "schedule", "data": {"at": unix time, "actor": name,
+    "msg": msg}}, optionally with an "id" to cancel it by and "every" seconds
+    to repeat it. cancel with {"cmd": "cancel", "data": {"id": id}}.
+
+    schedules are kept in the state so they survive restarts, pending ones
+    are in a min heap and a single loop timer is armed for the earliest.
+    the state is written behind (see World.set_write_behind): the schedules
+    changed between two flushes are saved at once, a schedule made just
+    before a crash may be lost. with LocalPersistence or STATE_HASH a flush
+    only writes the changed schedules.
+    """
+
+    __slots__ = ("heap", "timers", "stale", "counter", "timer", "timer_at")
+    sharded = False
+    # nothing is sent to actors that are stopping
+    stop_phase = 0
+    # hundreds of thousands of timers are too many to save at every change
+    durability = DURABILITY_INTERVAL
+
+    def __init__(self, name, queue, world):
+        # (at, counter, id), cancelled entries stay until they are popped
+        self.heap = []
+        # id -> its live heap entry
+        self.timers = {}
+        self.stale = 0
+        self.counter = itertools.count()
+        self.timer = None
+        self.timer_at = None
+        super().__init__(name, queue, world)
+
+    def push(self, key, schedule):
+        self.cancel(key)
+        entry = (schedule["at"], next(self.counter), key)
+        self.timers[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def cancel(self, key):
+        if self.timers.pop(key, None) is None:
+            return False
+        self.stale += 1
+        # rebuild once cancelled entries are most of the heap
+        if self.stale > len(self.timers):
+            self.heap = list(self.timers.values())
+            heapq.heapify(self.heap)
+            self.stale = 0
+        return True
+
+    def arm(self):
+        heap = self.heap
+        while heap and self.timers.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+            self.stale -= 1
+
+        at = heap[0][0] if heap else None
+        if self.timer is not None:
+            if at == self.timer_at:
+                return
+            self.timer.cancel()
+            self.timer = None
+        if at is not None:
+            loop = asyncio.get_event_loop()
+            self.timer = loop.call_later(max(0.0, at - time.time()), self.wakeup)
+            self.timer_at = at
+
+    def wakeup(self):
+        self.timer = None
+        self.queue.put_control(({"cmd": "FIRE"}, None))
+
+    async def fire(self):
+        """\
+        send every due message, done and repeated schedules are saved at once
+        """
+        now = time.time()
+        heap = self.heap
+        done = []
+        repeated = {}
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            at, _, key = entry
+            if self.timers.get(key) is not entry:
+                self.stale -= 1
+                continue
+            del self.timers[key]
+
+            schedule = self.state[key]
+            try:
+                await self.world.tell(schedule["actor"], schedule["msg"], sender=self.name)
+            except Exception:
+                logger.exception(f"Exception on sending scheduled message {key}")
+
+            every = schedule.get("every")
+            if every:
+                # missed runs are skipped
+                at += every * ((now - at) // every + 1)
+                schedule = dict(schedule, at=at)
+                repeated[key] = schedule
+                self.timers[key] = entry = (at, next(self.counter), key)
+                heapq.heappush(heap, entry)
+            else:
+                done.append(key)
+
+        if done:
+            await self.delete_state(*done)
+        if repeated:
+            await self.set_state(repeated)
+        self.arm()
+
+    async def state_loaded(self):
+        for key, schedule in self.state.items():
+            if isinstance(schedule, dict) and "at" in schedule and "actor" in schedule:
+                self.push(key, schedule)
+        self.arm()
+
     async def on_message(self, msg, sender):
-        await super().on_message(msg, sender)
+        if msg["cmd"] == "FIRE":
+            await self.fire()
+            return
+
+        if msg["cmd"] not in ("schedule", "cancel"):
+            # suspend and loading, schedules don't count as received
+            # messages in the state, that would be one more write each
+            await super().on_message(msg, sender)
+            return
+
         if msg["cmd"] == "schedule":
-            await self.set_state(
-                {
-                    msg["data"]["at"]: {
-                        "at": msg["data"]["at"],
-                        "actor": msg["data"]["actor"],
-                        "msg": msg["data"]["msg"],
-                    }
-                }
-            )
+            data = msg["data"]
+            key = data.get("id") or uuid.uuid4().hex
+            schedule = {"at": data["at"], "actor": data["actor"], "msg": data["msg"]}
+            if data.get("every"):
+                schedule["every"] = data["every"]
+            self.push(key, schedule)
+            await self.set_state({key: schedule})
+            self.arm()
+            if msg.get("msg_id"):
+                await self.world.tell(sender, {"reply_to": msg["msg_id"], "data": key})
+
+        if msg["cmd"] == "cancel":
+            key = msg["data"]["id"]
+            if self.cancel(key):
+                await self.delete_state(key)
+                self.arm()
 
-    async def loop(self):
-        while True:
-            if self.stopping:
+    async def on_stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+# requeues schedules whose lease expired, then claims due schedules with a
+# lease until ARGV[2]. returns [id, at, item, ...] and the next due time
+# KEYS: due, leases, items ARGV: now, lease until, limit
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, key in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('ZADD', KEYS[1], ARGV[1], key)
+end
+local due = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[3])
+local claimed = {}
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+    redis.call('ZADD', KEYS[2], ARGV[2], due[i])
+    table.insert(claimed, due[i])
+    table.insert(claimed, due[i + 1])
+    table.insert(claimed, redis.call('HGET', KEYS[3], due[i]))
+end
+local next = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {claimed, next[2] or ''}
+"""
+
+# releases claimed schedules, a repeated one goes back to due at its next
+# time unless it was cancelled meanwhile. a schedule that isn't leased any
+# more was scheduled again or cancelled since the claim and is left alone
+# KEYS: due, leases, items ARGV: id, next time or '', ...
+ACK_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('ZREM', KEYS[2], ARGV[i]) == 1 then
+        if ARGV[i + 1] ~= '' and redis.call('HEXISTS', KEYS[3], ARGV[i]) == 1 then
+            redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+        else
+            redis.call('HDEL', KEYS[3], ARGV[i])
+        end
+    end
+end
+return #ARGV / 2
+"""
+
+
+class RedisTaskScheduler(Actor):
+    """\
+    a TaskScheduler shared by every world connected to the same redis
+
+    takes the same schedule and cancel messages. due times are in the
+    <prefix>:due sorted set, a world claims due schedules with a lua script
+    that moves them to <prefix>:leases, sends them and releases them. a
+    schedule is claimed by one world only, if that world dies before
+    releasing it the lease expires and another world sends it again.
+    """
+
+    __slots__ = ("redis", "prefix", "scripts", "timer", "timer_at")
+    sharded = False
+    stop_phase = 0
+
+    # seconds a claimed schedule is reserved for this world
+    lease_time = 30.0
+    # schedules claimed and sent at once
+    claim_batch = 500
+    # how often to look for schedules added by other worlds
+    poll_interval = 1.0
+
+    def __init__(self, name, queue, world):
+        self.redis = None
+        self.prefix = "schedule"
+        self.scripts = {}
+        self.timer = None
+        self.timer_at = None
+        super().__init__(name, queue, world)
+
+    @property
+    def keys(self):
+        return [f"{self.prefix}:due", f"{self.prefix}:leases", f"{self.prefix}:items"]
+
+    async def connect(self, conn_url, prefix="schedule"):
+        self.redis = await aioredis.create_redis_pool(conn_url)
+        self.prefix = prefix
+        self.scripts = {
+            "claim": (CLAIM_SCRIPT, await self.redis.script_load(CLAIM_SCRIPT)),
+            "ack": (ACK_SCRIPT, await self.redis.script_load(ACK_SCRIPT)),
+        }
+        # schedules left overdue by a world that stopped are sent now
+        self.arm(time.time())
+
+    async def run_script(self, name, *args):
+        script, digest = self.scripts[name]
+        try:
+            return await self.redis.evalsha(digest, keys=self.keys, args=list(args))
+        except aioredis.ReplyError as e:
+            # redis restarted and lost its script cache
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            return await self.redis.eval(script, keys=self.keys, args=list(args))
+
+    def arm(self, at=None):
+        at = time.time() + self.poll_interval if at is None else at
+        if self.timer is not None:
+            if self.timer_at <= at:
                 return
-            await asyncio.sleep(0.100)
+            self.timer.cancel()
+        loop = asyncio.get_event_loop()
+        self.timer = loop.call_later(max(0.0, at - time.time()), self.wakeup)
+        self.timer_at = at
+
+    def wakeup(self):
+        self.timer = None
+        self.queue.put_control(({"cmd": "FIRE"}, None))
+
+    async def fire(self):
+        now = time.time()
+        claimed, next_at = await self.run_script(
+            "claim", repr(now), repr(now + self.lease_time), self.claim_batch
+        )
+
+        next_at = float(next_at) if next_at else now + self.poll_interval
+        acks = []
+        for i in range(0, len(claimed), 3):
+            key, at, item = claimed[i], float(claimed[i + 1]), claimed[i + 2]
+            next_time = ""
+            if item:
+                item = codec.loads(item)
+                try:
+                    await self.world.tell(item["actor"], item["msg"], sender=self.name)
+                except Exception:
+                    logger.exception(f"Exception on sending scheduled message {key}")
+                every = item.get("every")
+                if every:
+                    at += every * ((now - at) // every + 1)
+                    next_time = repr(at)
+                    next_at = min(next_at, at)
+            acks.append(key)
+            acks.append(next_time)
+        if acks:
+            await self.run_script("ack", *acks)
+
+        if len(claimed) // 3 >= self.claim_batch:
+            # there may be more due
+            next_at = now
+        self.arm(min(next_at, now + self.poll_interval))
+
+    async def schedule(self, data):
+        key = data.get("id") or uuid.uuid4().hex
+        item = {"actor": data["actor"], "msg": data["msg"]}
+        if data.get("every"):
+            item["every"] = data["every"]
+        due, leases, items = self.keys
+        tr = self.redis.multi_exec()
+        tr.hset(items, key, self.world.serializer_for(self.name).dumps(item))
+        tr.zrem(leases, key)
+        tr.zadd(due, data["at"], key)
+        await tr.execute()
+        self.arm(data["at"])
+        return key
+
+    async def cancel(self, key):
+        due, leases, items = self.keys
+        tr = self.redis.multi_exec()
+        tr.zrem(due, key)
+        tr.zrem(leases, key)
+        tr.hdel(items, key)
+        await tr.execute()
+
+    async def on_message(self, msg, sender):
+        if msg["cmd"] == "FIRE":
+            try:
+                await self.fire()
+            except Exception:
+                logger.exception("Exception on claiming due schedules")
+                self.arm()
+
+        if msg["cmd"] == "connect":
+            await self.connect(msg["data"], msg.get("prefix", "schedule"))
+
+        if msg["cmd"] == "schedule":
+            key = await self.schedule(msg["data"])
+            if msg.get("msg_id"):
+                await self.world.tell(sender, {"reply_to": msg["msg_id"], "data": key})
+
+        if msg["cmd"] == "cancel":
+            await self.cancel(msg["data"]["id"])
+
+    async def on_stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
+
+
+class Group:
+    """\
+    members of a group of actors, see World.subscribe
+    """
+
+    __slots__ = ("local", "nodes", "shards")
+
+    def __init__(self):
+        # name -> the actor, None while it isn't running
+        self.local = {}
+        # node or shard -> {names of the members there: None}
+        self.nodes = {}
+        self.shards = {}
+
+    def __len__(self):
+        return (
+            len(self.local)
+            + sum(len(names) for names in self.nodes.values())
+            + sum(len(names) for names in self.shards.values())
+        )
 
 
 class World:
     def __init__(self):
         self.actors = {}
+        self.dispatcher = None
+        # where mailboxes with the spill overflow policy put their overflow
+        self.spill_store = None
+        # where LocalPersistence keeps states, see basic_config
+        self.data_dir = None
+        # traces every actor when set, see trace
+        self.tracer = None
+        # see enable_metrics
+        self.metrics = None
+        # the Shard when this world is one of several processes, see run_shards
+        self.shard = None
+        # the Transport to worlds on other hosts, see listen
+        self.transport = None
+        # the Directory of actors on every node, see use_directory
+        self.directory = None
+        # name -> [(msg, sender)] told while the name is looked up
+        self.lookup_backlog = {}
+        # group name -> Group, and actor name -> names of its groups
+        self.groups = {}
+        self.memberships = {}
+        self.redis_url = None
+        # how states and messages leaving the process are encoded, see set_codec
+        self.codec = codec.DEFAULT_CODEC
+        self.compress_over = None
+        # write-behind of suspendable actors' states, see set_write_behind
+        self.flush_interval = 1.0
+        self.flush_count = 1000
+        self.dirty_actors = {}
+        self.dirty_writes = 0
+        self.flush_task = None
         self.self_actor = self.create_actor("world", WorldActor)
+        # msg_id -> future of a tell_and_get waiting for the reply
         self.wait_reply_list = {}
-        self.wait_stop = set()
+        self.ask_ids = itertools.count(1)
+        # seconds tell_and_get waits for a reply by default
+        self.ask_timeout = 60.0
+        # (deadline, msg_id) of pending asks, one loop timer for the earliest
+        self.ask_deadlines = []
+        self.ask_timer = None
+        self.ask_timer_at = None
+        # name -> future resolved when the actor stopped
+        self.wait_stop = {}
+        # virtual actors, see enable_virtual_actors
+        self.virtual_actor_class = None
+        self.idle_ttl = None
+        self.max_active_actors = None
+        # name -> last time it received a message, least recently used first
+        self.virtual_actors = OrderedDict()
+        # name -> future resolved when a suspended actor closed its mailbox
+        self.passivating = {}
+        # name -> the suspended actor, until it closed its mailbox
+        self.passivating_actors = {}
+        self.passivation_task = None
+
+    def enable_virtual_actors(
+        self, klass=SuspendableActor, idle_ttl=300.0, max_active=None
+    ):
+        """\
+        Activate actors on their first message instead of creating them upfront.
+
+        A `tell` or `tell_and_get` to an unknown name creates a `klass` actor,
+        which loads its state from persistence before handling the message.
+        Actors that didn't receive a message for `idle_ttl` seconds are
+        suspended, and when more than `max_active` are alive the least
+        recently used one is suspended.
+
+        :param klass: actor class to activate, should be a SuspendableActor
+        :param idle_ttl: seconds of inactivity before suspending, None to never
+        :param max_active: maximum number of active virtual actors, None for no limit
+        """
+        self.virtual_actor_class = klass
+        self.idle_ttl = idle_ttl
+        self.max_active_actors = max_active
+        if idle_ttl and not self.passivation_task:
+            self.passivation_task = asyncio.ensure_future(self.passivate_idle_actors())
+
+    def set_codec(self, name=codec.DEFAULT_CODEC, compress_over=None):
+        """\
+        codec for the states and messages of actors whose class doesn't
+        set `codec`, values encoded to more than `compress_over` bytes are
+        compressed. values written with another codec can still be read.
+        """
+        codec.get_codec(name)
+        self.codec = name
+        self.compress_over = compress_over
+
+    def serializer_for(self, name):
+        actor = self.reply_target(name)
+        name = self.codec
+        if actor is not None and actor.codec is not None:
+            name = actor.codec
+        return codec.get_serializer(name, self.compress_over)
+
+    def set_write_behind(self, interval=1.0, count=1000):
+        """\
+        how often actors with `DURABILITY_INTERVAL` save their state
+
+        changes are flushed every `interval` seconds, or as soon as there
+        were `count` writes since the last flush. all the writes to an actor
+        between two flushes are saved once.
+        """
+        self.flush_interval = interval
+        self.flush_count = count
+
+    def mark_dirty(self, actor):
+        self.dirty_actors[actor.name] = actor
+        self.dirty_writes += 1
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_periodically())
+        if self.dirty_writes >= self.flush_count:
+            asyncio.ensure_future(self.flush_dirty())
+
+    async def flush_dirty(self):
+        dirty, self.dirty_actors = self.dirty_actors, {}
+        self.dirty_writes = 0
+        for actor in dirty.values():
+            # saved meanwhile, eg. on suspend
+            if actor.dirty:
+                await actor.save_state(full=False)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.dirty_actors:
+                try:
+                    await self.flush_dirty()
+                except Exception:
+                    logger.exception("Exception on flushing dirty states")
+
+    async def flush_all(self):
+        """\
+        save the state of every actor with unsaved changes
+        """
+        self.dirty_actors = {}
+        self.dirty_writes = 0
+        for actor in list(self.actors.values()):
+            if isinstance(actor, SuspendableActor) and actor.dirty:
+                await actor.save_state(full=False)
+
+    def use_dispatcher(self, workers=8, throughput=10):
+        """\
+        run the actors created from now on on a shared pool of `workers`
+        coroutines instead of a consume task per actor
 
-    def create_actor(self, name, klass=Actor, **init):
-        queue = asyncio.Queue()
+        a worker handles at most `throughput` messages of an actor before
+        moving on to the next one. handlers that wait for a long time, eg.
+        on `tell_and_get`, hold a worker, such actors should be `pinned`.
+        """
+        self.dispatcher = Dispatcher(workers=workers, throughput=throughput)
+        self.dispatcher.start()
+
+    def create_actor(
+        self, name, klass=Actor, mailbox_size=None, overflow=None, **init
+    ):
+        """\
+        :param mailbox_size: capacity of the mailbox, defaults to klass.mailbox_size
+        :param overflow: what a full mailbox does, defaults to klass.overflow
+        """
+        if self.shard is not None and getattr(klass, "sharded", True):
+            if self.shard.remote_owner(name) is not None:
+                return RemoteActor(name, self)
+        if mailbox_size is None:
+            mailbox_size = getattr(klass, "mailbox_size", 0)
+        if overflow is None:
+            overflow = getattr(klass, "overflow", OVERFLOW_BLOCK)
+        queue = Mailbox(mailbox_size, overflow)
+        if mailbox_size and overflow == OVERFLOW_SPILL:
+            if self.spill_store is None:
+                raise ValueError(f"{name} spills its mailbox but there is no spill store")
+            queue.spill = MailboxSpill(queue, self.spill_store, f"mailbox::{name}")
         actor = klass(name, queue, self, **init)
+        if self.metrics is not None:
+            actor.__class__ = metered_class(type(actor), self.metrics)
+        if self.tracer is not None:
+            actor.__class__ = traced_class(type(actor), self.tracer)
         self.actors[name] = actor
-        asyncio.ensure_future(actor.after_create())
-        asyncio.ensure_future(actor.consume())
+        if self.directory is not None and actor.sharded:
+            self.directory.register(name)
+        if name in self.memberships:
+            for group in self.memberships[name]:
+                self.groups[group].local[name] = actor
+        if type(actor).after_create is not Actor.after_create:
+            asyncio.ensure_future(actor.after_create())
+        if self.dispatcher is None or actor.pinned:
+            asyncio.ensure_future(actor.consume())
+        else:
+            queue.attach(actor, self.dispatcher)
         return actor
 
+    def trace(self, tracer, *names):
+        """\
+        report the messages of the named actors to tracer, every actor
+        including the ones created later when no names are given.
+        actors that aren't traced pay nothing for it
+
+        :param tracer: a tracing.Tracer, None to stop tracing them
+        """
+        if not names:
+            self.tracer = tracer
+            names = list(self.actors)
+        for name in names:
+            actor = self.actors.get(name)
+            if actor is None:
+                continue
+            if tracer is None:
+                actor.__class__ = untraced_class(type(actor))
+            else:
+                actor.__class__ = traced_class(type(actor), tracer)
+
+    def untrace(self, *names):
+        self.trace(None, *names)
+
+    def enable_metrics(self, per_actor=False):
+        """\
+        count and time the messages of every actor, read them with stats or
+        from the "metrics" actor
+
+        :param per_actor: keep stats per actor instead of per actor class
+        """
+        self.metrics = Metrics(per_actor)
+        for actor in list(self.actors.values()):
+            actor.__class__ = metered_class(type(actor), self.metrics)
+        if "metrics" not in self.actors:
+            self.create_actor("metrics", MetricsActor)
+        return self.metrics
+
+    def stats(self):
+        if self.metrics is None:
+            return {}
+        return self.metrics.snapshot(self)
+
     def get_actor(self, name):
         actor = self.actors.get(name, None)
         if not actor:
@@ -261,58 +1933,573 @@ class World:
             return actor
         return self.create_actor(name, klass)
 
+    def activate_actor(self, name):
+        actor = self.create_actor(name, self.virtual_actor_class)
+        self.virtual_actors[name] = time.monotonic()
+        if self.max_active_actors:
+            while len(self.virtual_actors) > self.max_active_actors:
+                lru_name = next(iter(self.virtual_actors))
+                logger.debug("evicting least recently used actor %s", lru_name)
+                self.passivate_actor(lru_name)
+        return actor
+
+    def lookup_actor(self, name):
+        """\
+        find the actor for a message, activating a virtual actor if needed
+
+        :raises ActorNotFound: when there is no actor of that name
+        """
+        actor = self.actors.get(name, None)
+        if actor is None:
+            if self.virtual_actor_class is None:
+                raise ActorNotFound(name)
+            return self.activate_actor(name)
+
+        if name in self.virtual_actors:
+            self.virtual_actors[name] = time.monotonic()
+            self.virtual_actors.move_to_end(name)
+        return actor
+
+    def passivate_actor(self, name):
+        """\
+        suspend an actor, it saves its state and stops after handling
+        the messages already in its mailbox
+        """
+        actor = self.actors.pop(name)
+        self.virtual_actors.pop(name, None)
+        self.actor_removed(actor)
+        if isinstance(actor, SuspendableActor):
+            loop = asyncio.get_event_loop()
+            self.passivating[name] = loop.create_future()
+            self.passivating_actors[name] = actor
+        actor.queue.put_control(({"cmd": "INTERNAL_SUSPEND"}, None))
+        actor.queue.put_control(None)
+
+    def passivated(self, name):
+        self.passivating_actors.pop(name, None)
+        fut = self.passivating.pop(name, None)
+        if fut and not fut.done():
+            fut.set_result(True)
+
+    def reply_target(self, name):
+        """\
+        the actor a reply to a request of `name` goes to
+
+        while an actor is being suspended it's still waiting for the replies
+        to its requests, a new incarnation doesn't send any request before
+        the old one closed its mailbox
+        """
+        return self.passivating_actors.get(name) or self.actors.get(name)
+
+    async def wait_passivated(self, actor):
+        """\
+        wait until the previous incarnation of `actor` closed its mailbox
+        """
+        if self.passivating_actors.get(actor.name) is actor:
+            # suspended before it loaded its state
+            return
+        fut = self.passivating.get(actor.name, None)
+        if fut:
+            await fut
+
+    async def passivate_idle_actors(self):
+        while True:
+            await asyncio.sleep(min(self.idle_ttl, 1.0))
+            deadline = time.monotonic() - self.idle_ttl
+            idle = []
+            for name, last_seen in self.virtual_actors.items():
+                if last_seen > deadline:
+                    break
+                idle.append(name)
+
+            for name in idle:
+                logger.debug("passivating idle actor %s", name)
+                self.passivate_actor(name)
+
     async def tell(self, who, msg, sender: str = None):
-        logger.info("to actor - %s %s %s", who, msg, sender)
-        actor = self.get_actor(who)
-        await actor.tell(msg, sender)
+        """\
+        send a message, waits while the mailbox of `who` is full and blocks senders
 
-    async def tell_and_get(self, who, msg, sender=None):
-        actor = self.get_actor(who)
-        msg_id = str(uuid.uuid4())
-        loop = asyncio.get_running_loop()
-        fut = loop.create_future()
+        :return: False when a full mailbox dropped the message
+        """
+        if self.transport is not None and "/" in who:
+            node, who = who.split("/", 1)
+            if node != self.transport.node:
+                return await self.transport.tell(node, who, msg, sender)
+        if who == self.self_actor.name and isinstance(msg, dict) and "reply_to" in msg:
+            # replies resolve the waiting future without a trip through
+            # the mailbox of the world actor
+            self.resolve_reply(msg)
+            return True
+        if self.shard is not None and who not in self.actors:
+            owner = self.shard.remote_owner(who)
+            if owner is not None:
+                return await self.shard.tell(owner, who, msg, sender)
+        if self.directory is not None and who not in self.actors:
+            node = await self.directory.lookup(who)
+            if node is not None and node != self.transport.node:
+                return await self.transport.tell(node, who, msg, sender)
+        actor = self.lookup_actor(who)
+        return await actor.tell(msg, sender)
+
+    def tell_nowait(self, who, msg, sender: str = None):
+        """\
+        send a message without waiting, so callers can shed load. a name that
+        isn't in the directory cache is looked up first, an unknown name is
+        logged then
+
+        :return: False when a full mailbox dropped the message
+        :raises MailboxFull: when the mailbox is full and blocks senders, or
+            LOOKUP_BACKLOG messages wait for the directory
+        """
+        if self.transport is not None and "/" in who:
+            node, who = who.split("/", 1)
+            if node != self.transport.node:
+                return self.transport.tell_nowait(node, who, msg, sender)
+        if who == self.self_actor.name and isinstance(msg, dict) and "reply_to" in msg:
+            self.resolve_reply(msg)
+            return True
+        if self.shard is not None and who not in self.actors:
+            owner = self.shard.remote_owner(who)
+            if owner is not None:
+                return self.shard.tell_nowait(owner, who, msg, sender)
+        if self.directory is not None and who not in self.actors:
+            node = self.directory.cached(who)
+            if node is None:
+                return self.tell_after_lookup(who, msg, sender)
+            if node != self.transport.node:
+                return self.transport.tell_nowait(node, who, msg, sender)
+        return self.lookup_actor(who).tell_nowait(msg, sender)
+
+    def tell_after_lookup(self, who, msg, sender):
+        """\
+        hold a message until the directory says where who is, the messages
+        held for the same name are sent in order with one lookup
+        """
+        backlog = self.lookup_backlog.get(who)
+        if backlog is None:
+            backlog = self.lookup_backlog[who] = []
+            asyncio.ensure_future(self.send_backlog(who))
+        elif len(backlog) >= LOOKUP_BACKLOG:
+            raise MailboxFull()
+        backlog.append((msg, sender))
+        return True
+
+    async def send_backlog(self, who):
+        try:
+            node = await self.directory.lookup(who)
+        except Exception:
+            logger.exception(f"Exception on looking up {who}")
+            node = None
+        backlog = self.lookup_backlog.pop(who)
+        try:
+            if node is not None and node != self.transport.node:
+                for msg, sender in backlog:
+                    self.transport.tell_nowait(node, who, msg, sender)
+                return
+            actor = self.lookup_actor(who)
+        except ActorNotFound:
+            logger.warning(f"no actor {who}, dropped {len(backlog)} messages")
+            return
+        except Exception:
+            logger.exception(f"Exception on sending messages to {who}")
+            return
+        for msg, sender in backlog:
+            try:
+                actor.tell_nowait(msg, sender)
+            except MailboxFull:
+                await actor.tell(msg, sender)
+
+    def tell_datagram(self, who, msg, sender: str = None):
+        """\
+        send a message at most once: to actors on other nodes in a datagram
+        when the nodes listen with datagrams=True, see transport. messages
+        to full mailboxes are dropped
+
+        :return: False when the message was dropped here
+        """
+        if self.transport is not None and "/" in who:
+            node, who = who.split("/", 1)
+            if node != self.transport.node:
+                return self.transport.tell_datagram(node, who, msg, sender)
+        try:
+            return self.tell_nowait(who, msg, sender)
+        except MailboxFull:
+            return False
+
+    def subscribe(self, group, *names):
+        """\
+        add actors to a group, see publish. actors on other nodes are
+        named "node/actor"
+        """
+        members = self.groups.get(group)
+        if members is None:
+            members = self.groups[group] = Group()
+        for name in names:
+            place, name = self.member_place(members, name)
+            if place is members.local:
+                place[name] = self.actors.get(name)
+                self.memberships.setdefault(name, set()).add(group)
+            else:
+                place[name] = None
+
+    def unsubscribe(self, group, *names):
+        members = self.groups.get(group)
+        if members is None:
+            return
+        for name in names:
+            place, name = self.member_place(members, name)
+            place.pop(name, None)
+            if place is members.local:
+                groups = self.memberships.get(name, set())
+                groups.discard(group)
+                if not groups:
+                    self.memberships.pop(name, None)
+        for remote in (members.nodes, members.shards):
+            for key in [key for key, names in remote.items() if not names]:
+                del remote[key]
+        if not len(members):
+            del self.groups[group]
+
+    def member_place(self, members, name):
+        """\
+        :return: the dict of members the actor is kept in, its name there
+        """
+        if self.transport is not None and "/" in name:
+            node, name = name.split("/", 1)
+            if node != self.transport.node:
+                return members.nodes.setdefault(node, {}), name
+        if self.shard is not None and name not in self.actors:
+            owner = self.shard.remote_owner(name)
+            if owner is not None:
+                return members.shards.setdefault(owner, {}), name
+        return members.local, name
+
+    async def publish(self, group, msg, sender: str = None):
+        """\
+        send msg to every member of group: the local members get it in one
+        pass, members on another node or shard in one message to it. the
+        members share msg, they mustn't change it
+
+        :return: number of members msg was sent to
+        """
+        members = self.groups.get(group)
+        if members is None:
+            return 0
+        sent = 0
+        for node, names in members.nodes.items():
+            self.transport.publish(node, list(names), msg, sender)
+            sent += len(names)
+        for owner, names in members.shards.items():
+            self.shard.publish(owner, list(names), msg, sender)
+            sent += len(names)
+        return sent + await self.deliver(members.local, msg, sender)
+
+    async def deliver(self, members, msg, sender=None):
+        """\
+        put msg in the mailboxes of members without waiting, then wait for
+        the full ones
+
+        :param members: {actor name: the actor, None to look it up}
+        :return: number of actors that took msg
+        """
+        sent = 0
+        full = []
+        virtual_actors = self.virtual_actors
+        for name, actor in members.items():
+            if actor is None:
+                try:
+                    actor = self.lookup_actor(name)
+                except ActorNotFound:
+                    logger.warning(f"no actor {name} for a group message")
+                    continue
+            elif name in virtual_actors:
+                virtual_actors[name] = time.monotonic()
+                virtual_actors.move_to_end(name)
+            try:
+                if actor.tell_nowait(msg, sender) is not False:
+                    sent += 1
+            except MailboxFull:
+                full.append(actor)
+        for actor in full:
+            if await actor.tell(msg, sender) is not False:
+                sent += 1
+        return sent
+
+    async def listen(self, node, host="127.0.0.1", port=7000, **options):
+        """\
+        take messages from worlds on other hosts as `node`, see transport
+
+        :param options: passed to Transport, eg. codec or max_batch
+        :return: the Transport
+        """
+        self.transport = Transport(node, **options)
+        await self.transport.start(self, host, port)
+        return self.transport
+
+    async def use_directory(self, directory: Directory):
+        """\
+        find actors by name on every node, the actors this world creates
+        are registered in directory. listen first, see directory
+        """
+        if self.transport is None:
+            raise ValueError("the world needs to listen before using a directory")
+        self.directory = directory
+        await directory.start(self.transport.node, self.transport.address)
+        for name, actor in self.actors.items():
+            if actor.sharded:
+                directory.register(name)
+
+    def add_node(self, node, host, port):
+        """\
+        where the world named `node` listens, nodes connecting to this one
+        are added when they connect
+        """
+        self.transport.add_node(node, host, port)
+
+    def set_ask_timeout(self, timeout):
+        """\
+        :param timeout: seconds tell_and_get waits for a reply by default
+        """
+        self.ask_timeout = timeout
+
+    async def tell_and_get(self, who, msg, sender=None, timeout=None):
+        """\
+        send a message and wait for the reply, the receiver replies with
+        {"reply_to": msg["msg_id"], ...} to the sender of the message
+
+        :param timeout: seconds to wait, defaults to ask_timeout
+        :raises AskTimeout: when there was no reply in time
+        """
+        owner = node = None
+        if self.transport is not None and "/" in who:
+            node, who = who.split("/", 1)
+            if node == self.transport.node:
+                node = None
+        if self.directory is not None and node is None and who not in self.actors:
+            node = await self.directory.lookup(who)
+            if node == self.transport.node:
+                node = None
+        if self.shard is not None and node is None and who not in self.actors:
+            owner = self.shard.remote_owner(who)
+        actor = self.lookup_actor(who) if owner is None and node is None else None
+        msg_id = next(self.ask_ids)
+        fut = asyncio.get_running_loop().create_future()
         self.wait_reply_list[msg_id] = fut
-        await actor.tell(msg, sender=self.self_actor.name, msg_id=msg_id)
-        return await fut
+        self.add_ask_deadline(msg_id, self.ask_timeout if timeout is None else timeout)
+        started = time.perf_counter()
+        try:
+            if node is not None:
+                # asked on the other node, the reply comes back to this future
+                self.transport.ask(node, msg_id, who, msg)
+            elif owner is None:
+                await actor.tell(msg, sender=self.self_actor.name, msg_id=msg_id)
+            else:
+                # asked on the owner shard, the reply comes back to this future
+                self.shard.ask(owner, msg_id, who, msg)
+            reply = await fut
+            if self.metrics is not None:
+                self.metrics.ask_time.record(time.perf_counter() - started)
+            return reply
+        finally:
+            # resolved, timed out or the caller gave up
+            self.wait_reply_list.pop(msg_id, None)
+
+    def add_ask_deadline(self, msg_id, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        heapq.heappush(self.ask_deadlines, (deadline, msg_id))
+        # answered asks stay in the heap until their deadline, drop them
+        # once they are most of it
+        if len(self.ask_deadlines) > 2 * len(self.wait_reply_list) + 64:
+            self.ask_deadlines = [
+                entry for entry in self.ask_deadlines if entry[1] in self.wait_reply_list
+            ]
+            heapq.heapify(self.ask_deadlines)
+
+        if self.ask_timer is not None:
+            if self.ask_timer_at <= deadline:
+                return
+            self.ask_timer.cancel()
+        self.ask_timer = loop.call_at(deadline, self.expire_asks)
+        self.ask_timer_at = deadline
+
+    def expire_asks(self):
+        self.ask_timer = None
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        deadlines = self.ask_deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, msg_id = heapq.heappop(deadlines)
+            fut = self.wait_reply_list.pop(msg_id, None)
+            if fut is not None and not fut.done():
+                fut.set_exception(AskTimeout(f"no reply to ask {msg_id}"))
+        if deadlines:
+            self.ask_timer_at = deadlines[0][0]
+            self.ask_timer = loop.call_at(self.ask_timer_at, self.expire_asks)
+
+    def resolve_reply(self, msg):
+        future = self.wait_reply_list.pop(msg["reply_to"], None)
+        # late replies to asks that timed out are dropped
+        if future is not None and not future.done():
+            future.set_result(msg)
 
     async def got_reply(self, msg):
-        future = self.wait_reply_list[msg["reply_to"]]
-        future.set_result(msg)
+        self.resolve_reply(msg)
 
     async def suspend_actor(self, name):
-        actor = self.actors[name]
-        await actor.tell({"cmd": "INTERNAL_SUSPEND"}, None)
-        await actor.queue.put(None)
-        del self.actors[name]
+        self.passivate_actor(name)
 
     async def remove_actor(self, name):
         actor = self.actors[name]
-        await actor.queue.put(None)
+        actor.queue.put_control(None)
         del self.actors[name]
+        self.virtual_actors.pop(name, None)
+        self.actor_removed(actor)
+
+    def actor_removed(self, actor):
+        if self.directory is not None and actor.sharded:
+            # it may come back on another node
+            self.directory.unregister(actor.name)
+        if actor.name in self.memberships:
+            # groups keep the name, a revived actor gets the messages
+            for group in self.memberships[actor.name]:
+                self.groups[group].local[actor.name] = None
+
+    def stop_actors(self, names, drain=True):
+        """\
+        ask actors to stop
 
-    async def stop_actor(self, name):
-        actor = self.get_actor(name)
-        self.wait_stop.add(name)
-        logger.info(f"WAIT self.wait_stop {self.wait_stop}")
-        await actor.tell({"cmd": "INTERNAL_STOP"}, None)
-        while True:
-            if not self.wait_stop or (name not in self.wait_stop):
-                break
-            await asyncio.sleep(0.100)
+        :param drain: handle the messages already queued before stopping,
+            otherwise they are dropped
+        :return: futures resolved when each actor stopped
+        """
+        loop = asyncio.get_event_loop()
+        futures = []
+        for name in names:
+            fut = self.wait_stop.get(name)
+            if fut is None:
+                fut = self.wait_stop[name] = loop.create_future()
+                actor = self.actors[name]
+                if not drain:
+                    actor.stopping = True
+                actor.queue.put_control(({"cmd": "INTERNAL_STOP"}, None), first=not drain)
+            futures.append(fut)
+        return futures
+
+    def stopped(self, actor):
+        fut = self.wait_stop.pop(actor.name, None)
+        if fut is None:
+            return
+        if self.actors.get(actor.name) is actor:
+            del self.actors[actor.name]
+            self.virtual_actors.pop(actor.name, None)
+            self.actor_removed(actor)
+        if not fut.done():
+            fut.set_result(True)
+
+    def failed(self, actor):
+        """\
+        forget an actor whose mailbox isn't handled any more after an error
+        """
+        actor.stopping = True
+        if self.actors.get(actor.name) is actor:
+            del self.actors[actor.name]
+            self.virtual_actors.pop(actor.name, None)
+            self.actor_removed(actor)
+        if self.passivating_actors.get(actor.name) is actor:
+            self.passivated(actor.name)
+        fut = self.wait_stop.pop(actor.name, None)
+        if fut is not None and not fut.done():
+            fut.set_result(True)
+
+    async def wait_stopped(self, names, futures, timeout=None):
+        """\
+        :return: names of the actors that didn't stop within timeout
+        """
+        if not futures:
+            return []
+        await asyncio.wait(futures, timeout=timeout)
+        late = [name for name, fut in zip(names, futures) if not fut.done()]
+        for name in late:
+            logger.warning(f"{name} didn't stop in {timeout} seconds")
+        return late
+
+    async def stop_actor(self, name, drain=True, timeout=None):
+        """\
+        :return: True when the actor stopped within timeout
+        """
+        futures = self.stop_actors([name], drain)
+        return not await self.wait_stopped([name], futures, timeout)
 
-    async def stop(self):
+    async def stop(self, drain=True, timeout=None):
+        """\
+        stop every actor, phase by phase, see Actor.stop_phase
+
+        :param drain: actors handle the messages already queued before stopping
+        :param timeout: seconds to wait for all actors, the ones that didn't
+            stop by then are abandoned
+        :return: names of the abandoned actors
+        """
+        if self.passivation_task:
+            self.passivation_task.cancel()
+            self.passivation_task = None
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.ask_timer:
+            self.ask_timer.cancel()
+            self.ask_timer = None
+
+        phases = {}
         for name, actor in self.actors.items():
-            if name != self.self_actor.name:
-                self.wait_stop.add(name)
-                logger.info(f"WAIT self.wait_stop {self.wait_stop}")
-                await actor.tell({"cmd": "INTERNAL_STOP"}, None)
+            if actor is not self.self_actor:
+                phases.setdefault(actor.stop_phase, []).append(name)
 
-        while True:
-            if not self.wait_stop:
-                break
-            await asyncio.sleep(0.100)
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        late = []
+        for phase in sorted(phases):
+            # suspended actors and unsaved states queue their last save
+            # before persistence stops
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            passivating = {fut: name for name, fut in self.passivating.items() if name not in late}
+            if passivating:
+                _, pending = await asyncio.wait(passivating, timeout=remaining)
+                for fut in pending:
+                    logger.warning(f"{passivating[fut]} didn't suspend in {timeout} seconds")
+                    late.append(passivating[fut])
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                await asyncio.wait_for(self.flush_all(), remaining)
+            except asyncio.TimeoutError:
+                logger.warning(f"unsaved states weren't saved in {timeout} seconds")
+
+            names = [name for name in phases[phase] if name in self.actors]
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            late += await self.wait_stopped(
+                names, self.stop_actors(names, drain), remaining
+            )
+
+        for name in late:
+            self.wait_stop.pop(name, None)
+            self.passivating.pop(name, None)
+            self.passivating_actors.pop(name, None)
+            self.actors.pop(name, None)
+            self.virtual_actors.pop(name, None)
 
         await self.remove_actor(self.self_actor.name)
+        if self.shard is not None:
+            self.shard.close()
+        if self.directory is not None:
+            await self.directory.close()
+        if self.transport is not None:
+            await self.transport.close()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        if self.spill_store:
+            await self.spill_store.close()
+        return late
 
     async def revive_actor(self, name, klass):
         actor = self.create_actor(name, klass)
@@ -320,18 +2507,89 @@ class World:
 
     async def destroy(self):
         for k, actor in self.actors.items():
-            await actor.queue.put(None)
+            actor.queue.put_control(None)
 
-    async def basic_config(self, redis_url=None):
-        if not redis_url:
-            redis_url = self.redis_url
-        persistence = self.create_actor('persistence', RedisPersistence)
-        await persistence.tell({'cmd': 'connect', 'data': redis_url})
-        self.create_actor("task_scheduler", TaskScheduler)
+    async def basic_config(
+        self, redis_url=None, state_format=STATE_BLOB, data_dir=None,
+        distributed_scheduler=False,
+    ):
+        """\
+        :param state_format: STATE_BLOB or STATE_HASH, see RedisPersistence
+        :param data_dir: keep the states in a file in this directory with
+            LocalPersistence instead of redis. every shard has a file of its
+            own and actors are placed on shards by name, so a data_dir can
+            only be used with the number of shards it was made with
+        :param distributed_scheduler: share schedules with the other worlds
+            using the same redis, see RedisTaskScheduler
+        :raises ValueError: when data_dir was made with another number of
+            shards
+        """
+        if not data_dir:
+            data_dir = self.data_dir
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            check_shard_count(data_dir, 1 if self.shard is None else self.shard.count)
+            persistence = self.create_actor('persistence', LocalPersistence)
+            # a log file can only have one writer
+            log_name = "states.log" if self.shard is None else f"states-{self.shard.index}.log"
+            await persistence.tell(
+                {'cmd': 'connect', 'data': os.path.join(data_dir, log_name)}
+            )
+        else:
+            if not redis_url:
+                redis_url = self.redis_url
+            self.spill_store = RedisSpillStore(redis_url)
+            persistence = self.create_actor('persistence', RedisPersistence)
+            await persistence.tell(
+                {'cmd': 'connect', 'data': redis_url, 'state_format': state_format}
+            )
+        if distributed_scheduler:
+            scheduler = self.create_actor("task_scheduler", RedisTaskScheduler)
+            await scheduler.tell({'cmd': 'connect', 'data': redis_url or self.redis_url})
+        else:
+            self.create_actor("task_scheduler", TaskScheduler)
 
     def set_redis_url(self, redis_url):
         self.redis_url = redis_url
 
+    def set_data_dir(self, data_dir):
+        self.data_dir = data_dir
+
+
+def check_shard_count(data_dir, count):
+    """\
+    record the number of shards using data_dir, the state logs hold the
+    actors placed on each shard and would be read by the wrong shards with
+    another number
+
+    :raises ValueError: when data_dir was made with another number of shards
+    """
+    path = os.path.join(data_dir, "shards")
+    try:
+        with open(path) as fh:
+            made_with = int(fh.read())
+    except FileNotFoundError:
+        # data dirs made before the count was recorded
+        logs = [name for name in os.listdir(data_dir) if re.fullmatch(r"states(-\d+)?\.log", name)]
+        made_with = None
+        if "states.log" in logs:
+            made_with = 1
+        elif logs:
+            made_with = len(logs)
+        if made_with is None or made_with == count:
+            # every shard writes the same, written to a file of its own first
+            # so no shard reads half of it
+            tmp = f"{path}.{os.getpid()}"
+            with open(tmp, "w") as fh:
+                fh.write(str(count))
+            os.replace(tmp, path)
+            return
+    if made_with != count:
+        raise ValueError(
+            f"{data_dir} holds the states of {made_with} shards, not {count}. "
+            f"run with --workers {made_with} or use a new data dir"
+        )
+
 
 async def run(world):
     try:
@@ -343,8 +2601,60 @@ async def run(world):
     await mdl.main(world)
 
 
-def run_proc(redis_url, dev=None):
+def run_proc(redis_url, dev=None, data_dir=None, workers=1, shm=False, listen=None):
+    """\
+    :param listen: (node, host, port) to take messages from other nodes on
+    """
+    if workers > 1:
+        return run_shards(workers, redis_url, data_dir, shm, listen)
+    run_shard(redis_url, data_dir, listen=listen)
+
+
+def run_shards(count, redis_url, data_dir=None, shm=False, listen=None):
+    """\
+    run the world in `count` processes, see sharding
+
+    :param shm: connect the processes with shared memory rings instead of
+        socket pairs
+    :param listen: (node, host, port), shard i listens as node-i on port + i
+    """
+    sockets = shard_channels(count) if shm else shard_sockets(count)
+    processes = []
+    for index in range(count):
+        process = Process(
+            target=run_shard,
+            args=(redis_url, data_dir),
+            kwargs={
+                'shard': (index, count, sockets[index]),
+                'listen': listen and (f'{listen[0]}-{index}', listen[1], listen[2] + index),
+            },
+        )
+        process.start()
+        processes.append(process)
+    for peers in sockets:
+        for sock in peers.values():
+            sock.close()
+            if shm:
+                # the shards have it mapped already
+                sock.unlink()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # the shards got the interrupt too and stop their worlds
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
+
+
+def run_shard(redis_url, data_dir=None, shard=None, listen=None):
+    """\
+    :param shard: (index, count, sockets) when this is one of several shards
+    :param listen: (node, host, port) to take messages from other nodes on
+    """
     import uvloop
+    logging.basicConfig(level=logging.INFO)
     uvloop.install()
 
     try:
@@ -358,7 +2668,14 @@ def run_proc(redis_url, dev=None):
 
     world = World()
     world.set_redis_url(redis_url)
+    if data_dir:
+        world.set_data_dir(data_dir)
     try:
+        if shard is not None:
+            world.shard = Shard(*shard)
+            loop.run_until_complete(world.shard.start(world))
+        if listen is not None:
+            loop.run_until_complete(world.listen(*listen))
         asyncio.ensure_future(run(world))
         loop.run_forever()
     except KeyboardInterrupt:
@@ -370,12 +2687,17 @@ def run_proc(redis_url, dev=None):
 
 
 class DevProcess:
-    def __init__(self, redis_url):
+    def __init__(self, redis_url, data_dir=None):
         self.process: Union[None, Process] = None
         self.redis_url = redis_url
+        self.data_dir = data_dir
 
     def spawn(self):
-        process = Process(target=run_proc, args=(self.redis_url,), kwargs={'dev': True})
+        process = Process(
+            target=run_proc,
+            args=(self.redis_url,),
+            kwargs={'dev': True, 'data_dir': self.data_dir},
+        )
         process.start()
         self.process = process
         return process
@@ -403,12 +2725,17 @@ class FileChangeHandler(FileSystemEventHandler):
 
 @click.command()
 @click.option('--redis-url', default='redis://localhost:6379/11', help='Redis url')
-@click.option("-d", "--dev", is_flag=True, help="run in development mode")
-def run_world(redis_url, dev=None):
+@click.option('--data-dir', default=None, help='keep actor states in this directory instead of redis')
+@click.option('--workers', default=1, help='number of processes, actors are spread over them by name. a --data-dir only works with the number it was made with')
+@click.option('--shm', is_flag=True, help='connect worker processes with shared memory instead of sockets')
+@click.option('--listen', default=None, help='host:port to take messages from other nodes on')
+@click.option('--node', default='world', help='name of this node for other nodes')
+@click.option("-d", "--dev", is_flag=True, help="run in development mode, in one process")
+def run_world(redis_url, data_dir=None, workers=1, shm=False, listen=None, node='world', dev=None):
     from watchdog.observers import Observer
 
     if dev:
-        dev_process = DevProcess(redis_url)
+        dev_process = DevProcess(redis_url, data_dir)
         dev_process.spawn()
         fch = FileChangeHandler(dev_process)
         observer = Observer()
@@ -422,4 +2749,7 @@ def run_world(redis_url, dev=None):
         observer.join()
 
     else:
-        run_proc(redis_url, dev=dev)
+        if listen:
+            host, port = listen.rsplit(':', 1)
+            listen = (node, host, int(port))
+        run_proc(redis_url, dev=dev, data_dir=data_dir, workers=workers, shm=shm, listen=listen)
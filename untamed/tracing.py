@@ -0,0 +1,171 @@
+"""\
+message tracing
+
+a traced actor's class is swapped for a subclass that reports each message
+it receives to a Tracer: send, enqueue, dequeue, handle_start and
+handle_end. actors that aren't traced keep their own class, so tracing
+costs them nothing.
+"""
+import collections
+import itertools
+import logging
+import random
+import time
+
+__all__ = ["Tracer", "LoggingTracer", "RecordingTracer", "traced_class", "untraced_class"]
+
+SEND = "send"
+ENQUEUE = "enqueue"
+DEQUEUE = "dequeue"
+HANDLE_START = "handle_start"
+HANDLE_END = "handle_end"
+
+
+class Tracer:
+    """\
+    receives the trace events of sampled messages
+
+    :param sample_rate: part of the messages traced, 1.0 for all of them
+    """
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.ids = itertools.count(1)
+
+    def sample(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def event(self, kind, actor, trace_id, msg, sender, **fields):
+        """\
+        :param kind: SEND, ENQUEUE, DEQUEUE, HANDLE_START or HANDLE_END
+        :param trace_id: the same for every event of a message
+        :param fields: queued (seconds in the mailbox) on DEQUEUE,
+            duration (seconds) on HANDLE_END, accepted on ENQUEUE
+        """
+        self.record({
+            "kind": kind,
+            "actor": actor,
+            "trace_id": trace_id,
+            "time": time.time(),
+            "sender": sender,
+            "msg": msg,
+            **fields,
+        })
+
+    def record(self, event: dict):
+        raise NotImplementedError
+
+
+class LoggingTracer(Tracer):
+    def __init__(self, sample_rate=1.0, logger="untamed.trace", level=logging.INFO):
+        super().__init__(sample_rate)
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def record(self, event):
+        self.logger.log(self.level, "%s", event)
+
+
+class RecordingTracer(Tracer):
+    """\
+    keeps the last `size` events in memory
+    """
+
+    def __init__(self, sample_rate=1.0, size=10_000):
+        super().__init__(sample_rate)
+        self.events = collections.deque(maxlen=size)
+
+    def record(self, event):
+        self.events.append(event)
+
+
+class TracedItem(tuple):
+    """\
+    a (msg, sender) mailbox item of a sampled message
+    """
+
+    def __new__(cls, msg, sender, trace_id):
+        item = super().__new__(cls, (msg, sender))
+        item.trace_id = trace_id
+        item.enqueued_at = time.perf_counter()
+        return item
+
+    def __reduce__(self):
+        # spilled mailboxes pickle their items
+        return TracedItem, (self[0], self[1], self.trace_id)
+
+
+TRACED_CLASSES = {}
+
+
+def traced_class(klass, tracer):
+    """\
+    a subclass of klass reporting messages to tracer, an actor is traced by
+    assigning it to its __class__
+    """
+    klass = untraced_class(klass)
+    key = (klass, tracer)
+    traced = TRACED_CLASSES.get(key)
+    if traced is not None:
+        return traced
+
+    def wrap(msg, sender, msg_id):
+        if msg_id:
+            msg["msg_id"] = msg_id
+        return TracedItem(msg, sender, next(tracer.ids))
+
+    async def tell(self, msg, sender=None, msg_id=None):
+        if not tracer.sample():
+            return await klass.tell(self, msg, sender, msg_id)
+        item = wrap(msg, sender, msg_id)
+        tracer.event(SEND, self.name, item.trace_id, msg, sender)
+        accepted = await self.queue.put(item)
+        item.enqueued_at = time.perf_counter()
+        tracer.event(ENQUEUE, self.name, item.trace_id, msg, sender, accepted=accepted)
+        return accepted
+
+    def tell_nowait(self, msg, sender=None, msg_id=None):
+        if not tracer.sample():
+            return klass.tell_nowait(self, msg, sender, msg_id)
+        item = wrap(msg, sender, msg_id)
+        tracer.event(SEND, self.name, item.trace_id, msg, sender)
+        accepted = self.queue.put_nowait(item)
+        tracer.event(ENQUEUE, self.name, item.trace_id, msg, sender, accepted=accepted)
+        return accepted
+
+    async def process(self, item):
+        if type(item) is not TracedItem:
+            return await klass.process(self, item)
+        msg, sender = item
+        started = time.perf_counter()
+        tracer.event(
+            DEQUEUE, self.name, item.trace_id, msg, sender,
+            queued=started - item.enqueued_at,
+        )
+        tracer.event(HANDLE_START, self.name, item.trace_id, msg, sender)
+        running = await klass.process(self, item)
+        tracer.event(
+            HANDLE_END, self.name, item.trace_id, msg, sender,
+            duration=time.perf_counter() - started,
+        )
+        return running
+
+    traced = TRACED_CLASSES[key] = type(
+        f"Traced{klass.__name__}",
+        (klass,),
+        {
+            # same layout as klass so __class__ can be swapped
+            "__slots__": (),
+            "__module__": klass.__module__,
+            "untraced": klass,
+            "tracer": tracer,
+            "tell": tell,
+            "tell_nowait": tell_nowait,
+            "process": process,
+        },
+    )
+    return traced
+
+
+def untraced_class(klass):
+    return klass.__dict__.get("untraced", klass)